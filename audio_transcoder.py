@@ -0,0 +1,311 @@
+import collections
+import json
+import os
+import re
+import subprocess
+import threading
+import instrumentation
+from workspace import atomic_outputs
+
+# ffmpeg encoder used when an output extension needs a real re-encode
+ENCODERS = {
+    '.mp3': 'libmp3lame',
+    '.m4a': 'aac',
+    '.aac': 'aac',
+    '.opus': 'libopus',
+    '.ogg': 'libvorbis',
+    '.flac': 'flac',
+    '.wav': 'pcm_s16le',
+}
+
+# Output containers that can carry an embedded cover picture
+COVER_EXTENSIONS = {'.mp3', '.m4a'}
+
+# EBU R128 analysis (integrated loudness and true peak) fed from the decoded audio. Its
+# summary is logged at info level when the stream ends; the per-frame lines go to the
+# verbose level, so the info-level stderr read back stays a few lines long.
+LOUDNESS_FILTER = "ebur128=peak=true:framelog=verbose"
+LOUDNESS_OUTPUT = ["-map", "0:a:0", "-af", LOUDNESS_FILTER, "-f", "null", "-"] # Analysis only, nothing written
+_LOUDNESS_PATTERN = re.compile(r"Integrated loudness:\s*I:\s*(?P<integrated>-?[\d.]+|-inf) LUFS"
+                               r".*?True peak:\s*Peak:\s*(?P<peak>-?[\d.]+|-inf) dBFS", re.DOTALL)
+
+# Source audio codecs each output container can take as-is (stream copy / remux)
+COPY_COMPATIBLE_CODECS = {
+    '.mp3': {'mp3'},
+    '.m4a': {'aac', 'alac'},
+    '.aac': {'aac'},
+    '.opus': {'opus'},
+    '.ogg': {'vorbis', 'opus'},
+    '.flac': {'flac'},
+}
+
+
+def probe_streams(filepath):
+    """
+    Returns the stream list ffprobe reports for a media file (codec_type, codec_name, ...).
+
+    Raises:
+        subprocess.CalledProcessError if ffprobe cannot read the file.
+    """
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=index,codec_type,codec_name,bit_rate,channels,sample_rate",
+        "-of", "json",
+        filepath,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout or '{}').get('streams', [])
+
+
+def audio_codec(filepath):
+    """Returns the codec name of the first audio stream of a file, or None if it has none."""
+    for stream in probe_streams(filepath):
+        if stream.get('codec_type') == 'audio':
+            return stream.get('codec_name')
+    return None
+
+
+def can_stream_copy(source_codec, output_filepath):
+    """True if audio in `source_codec` can be remuxed into the output's container without re-encoding."""
+    output_extension = os.path.splitext(output_filepath)[1].lower()
+    return source_codec in COPY_COMPATIBLE_CODECS.get(output_extension, set())
+
+
+def parse_loudness(stderr):
+    """
+    Reads the summary LOUDNESS_FILTER logged to an ffmpeg stderr.
+
+    Returns:
+        A {'integrated_lufs': float, 'true_peak_dbfs': float} dict, or None if there is no
+        summary or the audio was silent.
+    """
+    matches = list(_LOUDNESS_PATTERN.finditer(stderr or ''))
+    if not matches or '-inf' in (matches[-1]['integrated'], matches[-1]['peak']):
+        return None
+    return {'integrated_lufs': float(matches[-1]['integrated']), 'true_peak_dbfs': float(matches[-1]['peak'])}
+
+
+def _output_options(output_filepath, bitrate=None, copy=False, metadata=None, with_cover=False):
+    """The ffmpeg options of one output of an audio command (the audio is input 0, a cover input 1)."""
+    output_extension = os.path.splitext(output_filepath)[1].lower()
+    with_cover = with_cover and output_extension in COVER_EXTENSIONS
+    if with_cover:
+        options = ["-map", "0:a:0", "-map", "1:v:0", "-c:v", "mjpeg", "-disposition:v:0", "attached_pic"]
+    else:
+        options = ["-map", "0:a:0", "-vn", "-sn", "-dn"]
+
+    if copy:
+        options += ["-c:a", "copy"]
+    else:
+        encoder = ENCODERS.get(output_extension)
+        if encoder is None:
+            raise ValueError(f"Unsupported audio output format: '{output_extension}'")
+        options += ["-c:a", encoder]
+        if bitrate:
+            options += ["-b:a", bitrate]
+
+    if metadata is not None:
+        options += ["-map_metadata", "-1"] # Replace the source's tags instead of merging with them
+        for key, value in metadata.items():
+            options += ["-metadata", f"{key}={value}"]
+    if output_extension == '.mp3' and (metadata or with_cover):
+        options += ["-id3v2_version", "3"] # Widest player support for ID3 text and pictures
+    options.append(output_filepath)
+    return options
+
+
+def build_audio_command(input_filepath, output_filepath, bitrate=None, copy=False, metadata=None, cover_filepath=None,
+                        extra_outputs=(), analyze_loudness=False):
+    """
+    Builds an audio-only ffmpeg command: only the first audio stream is mapped, so video
+    is never decoded, and ffmpeg streams the file instead of loading it into memory.
+
+    `metadata` ({ffmpeg tag key: value}, e.g. title/artist/date/track) and an optional
+    cover image are written by the same command, so the output never needs a separate
+    tagging pass. ffmpeg maps the keys to ID3 frames for MP3 and to MP4 atoms for M4A.
+
+    `extra_outputs` ((output_filepath, bitrate, copy) tuples) are written by the same
+    command too: ffmpeg decodes the input once and feeds every output's encoder from it.
+
+    With `analyze_loudness` the decoded audio also feeds LOUDNESS_FILTER (into a null
+    output), so the encode measures loudness on the way (see parse_loudness). The log
+    level is raised to info for its summary.
+    """
+    outputs = [(output_filepath, bitrate, copy)] + list(extra_outputs)
+    with_cover = bool(cover_filepath) and any(os.path.splitext(filepath)[1].lower() in COVER_EXTENSIONS
+                                              for filepath, _, _ in outputs)
+    log_options = ["-loglevel", "info", "-nostats"] if analyze_loudness else ["-loglevel", "error"]
+    command = ["ffmpeg", "-hide_banner", "-nostdin"] + log_options + ["-y", "-i", input_filepath]
+    if with_cover:
+        command += ["-i", cover_filepath]
+    for filepath, output_bitrate, output_copy in outputs:
+        command += _output_options(filepath, output_bitrate, output_copy, metadata, with_cover)
+    if analyze_loudness:
+        command += LOUDNESS_OUTPUT
+    return command
+
+
+def transcode_audio(input_filepath, output_filepath, bitrate=None, allow_copy=True, metadata=None, cover_filepath=None,
+                    extra_outputs=(), loudness_callback=None):
+    """
+    Writes the audio of `input_filepath` to `output_filepath` with ffmpeg.
+
+    The output format follows the output extension. When the source codec already fits
+    the target container (for example AAC in MP4 -> M4A) the stream is copied instead
+    of re-encoded, which turns a full transcode into a quick remux.
+
+    Args:
+        input_filepath: The source media file (webm, m4a, mp4, ...).
+        output_filepath: The audio file to write (.mp3, .m4a, ...).
+        bitrate: Target bitrate for a re-encode, e.g. "320k" (ignored for stream copies).
+        allow_copy: Boolean, if False, always re-encode.
+        metadata: Optional {ffmpeg tag key: value} dict written in the same pass.
+        cover_filepath: Optional cover image embedded in the same pass (MP3/M4A only).
+        extra_outputs: Optional (output_filepath, bitrate) pairs written from the same decode,
+                       e.g. an M4A and a low-bitrate MP3 next to the main output. An extra
+                       output without a bitrate is remuxed when the source codec fits it.
+        loudness_callback: Optional callback(measurement). The same ffmpeg run then also
+                           measures the audio's loudness (see parse_loudness) and the
+                           callback gets the measurement once the outputs are in place.
+
+    Returns:
+        'copy' if the stream was remuxed, 'encode' if it was re-encoded (for `output_filepath`).
+
+    Raises:
+        subprocess.CalledProcessError if ffmpeg fails (stderr holds ffmpeg's error lines).
+        FileNotFoundError if ffmpeg/ffprobe are not installed.
+    """
+    output_filepaths = [output_filepath] + [filepath for filepath, _ in extra_outputs]
+    with instrumentation.stage('transcode', input=input_filepath, output=", ".join(output_filepaths)) as record:
+        source_codec = audio_codec(input_filepath)
+        copy = allow_copy and can_stream_copy(source_codec, output_filepath)
+        # Written under temporary names and renamed when ffmpeg succeeds, so an interrupted
+        # run never leaves a truncated file under the final name
+        with atomic_outputs(output_filepaths) as temporary_paths:
+            command = build_audio_command(
+                input_filepath, temporary_paths[0], bitrate=bitrate, copy=copy, metadata=metadata,
+                cover_filepath=cover_filepath,
+                extra_outputs=[(temporary_path, extra_bitrate,
+                                allow_copy and extra_bitrate is None and can_stream_copy(source_codec, temporary_path))
+                               for temporary_path, (_, extra_bitrate) in zip(temporary_paths[1:], extra_outputs)],
+                analyze_loudness=loudness_callback is not None)
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, text=True)
+            stderr = process.stderr.read()
+            process.stderr.close()
+            returncode = instrumentation.wait_for_child(process)
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+        record.update(mode='copy' if copy else 'encode', bytes=os.path.getsize(input_filepath),
+                      output_bytes=sum(os.path.getsize(filepath) for filepath in output_filepaths))
+    measurement = parse_loudness(stderr)
+    if loudness_callback and measurement:
+        loudness_callback(measurement)
+    return 'copy' if copy else 'encode'
+
+
+def probe_duration(filepath):
+    """Returns the duration of a media file in seconds, or None if ffprobe cannot tell."""
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", filepath]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        return float(json.loads(result.stdout or '{}').get('format', {}).get('duration'))
+    except (subprocess.CalledProcessError, FileNotFoundError, TypeError, ValueError):
+        return None
+
+
+def run_ffmpeg_with_progress(command, progress_callback=None, stderr_lines=20):
+    """
+    Runs an ffmpeg command, reporting progress from ffmpeg's `-progress` key=value stream.
+
+    `-progress pipe:1 -nostats` is added to the command, stdout is parsed line by line and
+    `progress_callback(seconds_done)` is called with the output timestamp. Only the last
+    `stderr_lines` lines of stderr are kept (for error reports) instead of the whole log.
+
+    Raises:
+        subprocess.CalledProcessError if ffmpeg exits with a non-zero status.
+    """
+    command = [command[0], "-progress", "pipe:1", "-nostats"] + list(command[1:])
+    stderr_tail = collections.deque(maxlen=stderr_lines)
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL, text=True, bufsize=1)
+    stderr_reader = threading.Thread(target=lambda: stderr_tail.extend(process.stderr), daemon=True)
+    stderr_reader.start()
+
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        if key in ('out_time_us', 'out_time_ms') and progress_callback and value.isdigit():
+            progress_callback(int(value) / 1_000_000)
+
+    returncode = instrumentation.wait_for_child(process)
+    stderr_reader.join()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr=''.join(stderr_tail))
+
+
+def transcode_stream(chunks, output_filepath, bitrate=None, metadata=None, cover_filepath=None, stderr_lines=20,
+                     extra_outputs=(), loudness_callback=None):
+    """
+    Encodes audio fed through a pipe (e.g. bytes arriving from the network) into a file.
+
+    The chunks are written to ffmpeg's stdin as they arrive, so encoding overlaps with
+    the transfer and no intermediate file is written. The output format follows the
+    output extension; the source is always re-encoded since its codec is not known upfront.
+
+    Args:
+        chunks: An iterable of bytes objects holding the source media (webm, m4a, ...).
+        output_filepath: The audio file to write (.mp3, .m4a, ...).
+        bitrate: Target bitrate, e.g. "320k".
+        metadata: Optional {ffmpeg tag key: value} dict written in the same pass.
+        cover_filepath: Optional cover image embedded in the same pass (MP3/M4A only).
+        extra_outputs: Optional (output_filepath, bitrate) pairs encoded from the same stream.
+        loudness_callback: Optional callback(measurement) given the loudness measured from
+                           the same stream (see transcode_audio).
+
+    Returns:
+        The number of source bytes fed to ffmpeg.
+
+    Raises:
+        subprocess.CalledProcessError if ffmpeg fails or stops reading its input.
+    """
+    output_filepaths = [output_filepath] + [filepath for filepath, _ in extra_outputs]
+    with instrumentation.stage('stream', output=", ".join(output_filepaths)) as record, \
+            atomic_outputs(output_filepaths) as temporary_paths:
+        command = build_audio_command("pipe:0", temporary_paths[0], bitrate=bitrate, metadata=metadata,
+                                      cover_filepath=cover_filepath,
+                                      extra_outputs=[(temporary_path, extra_bitrate, False)
+                                                     for temporary_path, (_, extra_bitrate)
+                                                     in zip(temporary_paths[1:], extra_outputs)],
+                                      analyze_loudness=loudness_callback is not None)
+        # The loudness summary is the last thing ffmpeg logs; keep enough lines for it
+        stderr_tail = collections.deque(maxlen=max(stderr_lines, 40) if loudness_callback else stderr_lines)
+
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_tail.extend(line.decode(errors='replace') for line in process.stderr), daemon=True)
+        stderr_reader.start()
+
+        bytes_fed = 0
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+                bytes_fed += len(chunk)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass # ffmpeg exited early; its return code and stderr tell why
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            returncode = instrumentation.wait_for_child(process)
+            stderr_reader.join()
+            record['bytes'] = bytes_fed
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stderr=''.join(stderr_tail))
+        record['output_bytes'] = sum(os.path.getsize(filepath) for filepath in temporary_paths)
+    measurement = parse_loudness(''.join(stderr_tail))
+    if loudness_callback and measurement:
+        loudness_callback(measurement)
+    return bytes_fed
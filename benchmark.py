@@ -0,0 +1,379 @@
+import argparse
+import contextlib
+import functools
+import http.server
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+    import resource
+except ImportError: # Windows: no getrusage, so CPU time and peak RSS are not reported
+    resource = None
+
+# Benchmarks run fully offline: fixtures are synthesised with ffmpeg and the download
+# stage fetches them from a local HTTP server standing in for the media host.
+
+STAGES = ['webm_to_mp4', 'mp4_to_m4a', 'mp3_conversion', 'tagging', 'download', 'download_streaming']
+
+
+def generate_fixture(filepath, seconds, video=False):
+    """Writes a synthetic test file (sine tone, plus a test pattern when `video` is True) with ffmpeg."""
+    command = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+               "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}"]
+    if video:
+        command += ["-f", "lavfi", "-i", f"testsrc=size=320x240:rate=25:duration={seconds}"]
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.webm':
+        command += ["-c:a", "libopus"] + (["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8"] if video else [])
+    elif extension == '.mp4':
+        command += ["-c:a", "aac"] + (["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"] if video else [])
+    elif extension == '.mp3':
+        command += ["-c:a", "libmp3lame", "-b:a", "192k"]
+    command += ["-shortest", filepath]
+    subprocess.run(command, capture_output=True, text=True, check=True)
+
+
+def generate_fixtures(directory, extension, count, seconds, video=False):
+    """Writes `count` fixtures named track_<n><extension> into `directory` and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    template = os.path.join(directory, "track_0" + extension)
+    generate_fixture(template, seconds, video)
+    filepaths = [template]
+    for index in range(1, count):
+        filepath = os.path.join(directory, f"track_{index}{extension}")
+        shutil.copyfile(template, filepath)
+        filepaths.append(filepath)
+    return filepaths
+
+
+def generate_artwork(filepath, size=1000):
+    """Writes a synthetic JPEG cover image with ffmpeg."""
+    subprocess.run(["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+                    "-f", "lavfi", "-i", f"testsrc=size={size}x{size}:duration=1", "-frames:v", "1", filepath],
+                   capture_output=True, text=True, check=True)
+
+
+def _rusage():
+    if resource is None:
+        return None, None
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage, children_usage
+
+
+def measure(stage, function, files, total_bytes, latencies=None, settings=None):
+    """
+    Runs `function()` and returns its figures as a dict.
+
+    cpu_s includes the ffmpeg child processes. Peak RSS values are reported in MB as
+    the kernel tracks them: the process high-water mark, and the largest child so far.
+    Both only cover one run when it is measured in its own process (see run_measured).
+    CPU and RSS figures are None where the resource module is missing (Windows).
+    `latencies` are per-item seconds, each from the item's own start.
+    """
+    self_before, children_before = _rusage()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr): # Keep stdout for the JSON report
+        function()
+    wall = time.perf_counter() - start
+    self_after, children_after = _rusage()
+
+    cpu = None
+    if resource is not None:
+        cpu = round(sum(getattr(after, field) - getattr(before, field)
+                        for before, after in ((self_before, self_after), (children_before, children_after))
+                        for field in ('ru_utime', 'ru_stime')), 4)
+    result = {
+        'stage': stage,
+        'files': files,
+        'bytes': total_bytes,
+        'wall_s': round(wall, 4),
+        'cpu_s': cpu,
+        'files_per_s': round(files / wall, 3) if wall else None,
+        'mb_per_s': round(total_bytes / 1e6 / wall, 3) if wall else None,
+        'peak_rss_mb': round(self_after.ru_maxrss / 1024, 1) if self_after else None,
+        'children_peak_rss_mb': round(children_after.ru_maxrss / 1024, 1) if children_after else None,
+        'settings': settings or {},
+    }
+    if latencies:
+        latencies = sorted(latencies)
+        result['latency_p50_s'] = round(statistics.median(latencies), 4)
+        result['latency_p95_s'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4)
+        result['latency_max_s'] = round(latencies[-1], 4)
+    return result
+
+
+def run_measured(stage, directory, files, total_bytes, settings):
+    """
+    Measures one run of a stage (see RUNS) in a fresh interpreter and returns its figures.
+
+    ru_maxrss is a high-water mark over a process's whole life, so runs sharing this
+    process would all report the peak of the heaviest earlier run (or fixture encode).
+    """
+    spec = {'stage': stage, 'directory': directory, 'files': files, 'bytes': total_bytes, 'settings': settings}
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", json.dumps(spec)],
+                            stdout=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"the {stage} run exited with status {result.returncode}")
+    return json.loads(result.stdout)
+
+
+def _run_in_this_process(spec):
+    """The child side of run_measured: sets the run up, then measures it."""
+    with _working_directory(spec['directory']), RUNS[spec['stage']](spec['settings']) as (function, latencies):
+        return measure(spec['stage'], function, spec['files'], spec['bytes'], latencies, spec['settings'])
+
+
+@contextlib.contextmanager
+def local_media_host(directory):
+    """Serves `directory` over HTTP on a free localhost port; yields the base URL."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def _working_directory(directory):
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _size(filepaths):
+    return sum(os.path.getsize(filepath) for filepath in filepaths)
+
+
+# Stage run -> context manager taking the run's settings and yielding (function to measure,
+# latencies list it fills). Entered in the child process, inside the run's directory.
+
+@contextlib.contextmanager
+def _webm_to_mp4_run(settings):
+    from webm_to_mp4_converter import batch_convert_webm_to_mp4_ffmpeg_direct
+    yield functools.partial(batch_convert_webm_to_mp4_ffmpeg_direct, delete_webm=True, jobs=settings['jobs'],
+                            allow_remux=settings['allow_remux'], copy_webm_codecs=True), None
+
+
+@contextlib.contextmanager
+def _mp4_to_m4a_run(settings):
+    from mp4_to_m4a_converter import batch_convert_mp4_to_m4a
+    yield functools.partial(batch_convert_mp4_to_m4a, delete_mp4=True), None
+
+
+@contextlib.contextmanager
+def _mp3_conversion_run(settings):
+    from concurrent.futures import ThreadPoolExecutor
+    from video_downloader_mp3 import convert_audio_to_mp3
+    fixtures = sorted(filename for filename in os.listdir('.') if filename.endswith('.webm'))
+    latencies = []
+
+    def convert(filepath):
+        start = time.perf_counter()
+        convert_audio_to_mp3(filepath, delete_original=False)
+        latencies.append(time.perf_counter() - start)
+
+    def run():
+        with ThreadPoolExecutor(max_workers=settings['transcode_workers']) as pool:
+            list(pool.map(convert, fixtures))
+
+    yield run, latencies
+
+
+@contextlib.contextmanager
+def _tagging_run(settings):
+    from mp3_metadata_editor import batch_edit_audio_metadata
+    yield functools.partial(batch_edit_audio_metadata, "Benchmark Artist", "Benchmark Album", "Benchmark",
+                            workers=settings['workers'], use_index=settings['use_index']), None
+
+
+@contextlib.contextmanager
+def _download_run(settings):
+    from download_scheduler import DownloadScheduler
+    from video_downloader_mp3 import download_videos
+
+    class StartTimes(DownloadScheduler):
+        """No rate limits or retries; records when each video's download starts."""
+
+        def __init__(self):
+            super().__init__(requests_per_second=None, retries=0)
+            self.started = {}
+
+        def call(self, url, function, *args, **kwargs):
+            self.started.setdefault(url, time.perf_counter())
+            return super().call(url, function, *args, **kwargs)
+
+    scheduler = StartTimes()
+    latencies = [] # Download start to MP3 written, per video
+
+    with local_media_host("host") as base_url:
+        video_links = [f"{base_url}/{filename}" for filename in sorted(os.listdir("host"))]
+
+        def converted(video_url, mp3_filepath):
+            latencies.append(time.perf_counter() - scheduler.started[video_url])
+
+        def run():
+            download_videos(video_links, "output", download_workers=settings['download_workers'],
+                            transcode_workers=settings['transcode_workers'], streaming=settings['streaming'],
+                            embed_metadata=False, scheduler=scheduler, on_converted=converted)
+
+        yield run, latencies
+
+
+RUNS = {
+    'webm_to_mp4': _webm_to_mp4_run,
+    'mp4_to_m4a': _mp4_to_m4a_run,
+    'mp3_conversion': _mp3_conversion_run,
+    'tagging': _tagging_run,
+    'download': _download_run,
+    'download_streaming': _download_run,
+}
+
+
+# Stage benchmarks: write the fixtures here, then measure each run with run_measured
+
+def bench_webm_to_mp4(work_directory, files, seconds, jobs):
+    results = []
+    for allow_remux in (True, False):
+        stage_directory = os.path.join(work_directory, f"webm_to_mp4_{'remux' if allow_remux else 'encode'}")
+        fixtures = generate_fixtures(stage_directory, '.webm', files, seconds, video=True)
+        results.append(run_measured('webm_to_mp4', stage_directory, files, _size(fixtures),
+                                    settings={'jobs': jobs, 'allow_remux': allow_remux}))
+    return results
+
+
+def bench_mp4_to_m4a(work_directory, files, seconds, jobs):
+    stage_directory = os.path.join(work_directory, "mp4_to_m4a")
+    fixtures = generate_fixtures(stage_directory, '.mp4', files, seconds, video=True)
+    return [run_measured('mp4_to_m4a', stage_directory, files, _size(fixtures), settings={})]
+
+
+def bench_mp3_conversion(work_directory, files, seconds, jobs):
+    stage_directory = os.path.join(work_directory, "mp3_conversion")
+    fixtures = generate_fixtures(stage_directory, '.webm', files, seconds)
+    return [run_measured('mp3_conversion', stage_directory, files, _size(fixtures),
+                         settings={'transcode_workers': jobs})]
+
+
+def bench_tagging(work_directory, files, seconds, jobs):
+    stage_directory = os.path.join(work_directory, "tagging")
+    fixtures = generate_fixtures(stage_directory, '.mp3', files, seconds)
+    generate_artwork(os.path.join(stage_directory, "artwork.jpg"))
+    results = []
+    # 'unchanged' reopens every file and measures the tag-diff skip path; 'indexed' measures
+    # the file index skipping them without opening them (after an unmeasured run builds it)
+    for run, use_index in (('first', False), ('unchanged', False), ('indexed', True)):
+        settings = {'workers': jobs, 'run': run, 'use_index': use_index}
+        if use_index:
+            run_measured('tagging', stage_directory, files, _size(fixtures), settings)
+        results.append(run_measured('tagging', stage_directory, files, _size(fixtures), settings))
+    return results
+
+
+def _bench_download(work_directory, files, seconds, jobs, streaming):
+    stage = 'download_streaming' if streaming else 'download'
+    stage_directory = os.path.join(work_directory, stage)
+    fixtures = generate_fixtures(os.path.join(stage_directory, "host"), '.webm', files, seconds)
+    return [run_measured(stage, stage_directory, files, _size(fixtures),
+                         settings={'download_workers': jobs, 'transcode_workers': jobs, 'streaming': streaming})]
+
+
+def bench_download(work_directory, files, seconds, jobs):
+    return _bench_download(work_directory, files, seconds, jobs, streaming=False)
+
+
+def bench_download_streaming(work_directory, files, seconds, jobs):
+    return _bench_download(work_directory, files, seconds, jobs, streaming=True)
+
+
+BENCHMARKS = {
+    'webm_to_mp4': bench_webm_to_mp4,
+    'mp4_to_m4a': bench_mp4_to_m4a,
+    'mp3_conversion': bench_mp3_conversion,
+    'tagging': bench_tagging,
+    'download': bench_download,
+    'download_streaming': bench_download_streaming,
+}
+
+
+def run_benchmarks(stages=STAGES, files=8, seconds=30, jobs=None, work_directory=None):
+    """
+    Runs the selected stage benchmarks on fresh fixtures and returns the report dict.
+
+    Args:
+        stages: Names from STAGES to run.
+        files: Number of fixture files per stage.
+        seconds: Duration of each fixture.
+        jobs: Concurrency used by every stage (default: CPU count).
+        work_directory: Where fixtures are written (default: a temporary directory, removed afterwards).
+    """
+    jobs = jobs or os.cpu_count() or 1
+    keep = work_directory is not None
+    work_directory = os.path.abspath(work_directory or tempfile.mkdtemp(prefix="ytdl-bench-")) # Runs chdir into it
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'files': files,
+        'fixture_seconds': seconds,
+        'jobs': jobs,
+        'results': [],
+    }
+    try:
+        for stage in stages:
+            try:
+                report['results'] += BENCHMARKS[stage](work_directory, files, seconds, jobs)
+            except Exception as e:
+                report['results'].append({'stage': stage, 'error': f"{type(e).__name__}: {e}"})
+    finally:
+        if not keep:
+            shutil.rmtree(work_directory, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the download, transcode and tagging stages offline.")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma-separated stages to run (default: all of {','.join(STAGES)})")
+    parser.add_argument("--files", type=int, default=8, help="fixture files per stage (default: 8)")
+    parser.add_argument("--seconds", type=int, default=30, help="duration of each fixture (default: 30)")
+    parser.add_argument("--jobs", type=int, help="concurrency for every stage (default: CPU count)")
+    parser.add_argument("--work-dir", help="keep fixtures and outputs in this directory")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--run", metavar="SPEC", help=argparse.SUPPRESS) # One run, see run_measured
+    options = parser.parse_args()
+    if options.run:
+        print(json.dumps(_run_in_this_process(json.loads(options.run))))
+        sys.exit(0)
+
+    selected = [stage.strip() for stage in options.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in selected if stage not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    report = run_benchmarks(selected, options.files, options.seconds, options.jobs, options.work_dir)
+    report_json = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report_json + "\n")
+        print(f"Benchmark report written to '{options.output}'")
+    else:
+        print(report_json)
\ No newline at end of file
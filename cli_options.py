@@ -0,0 +1,25 @@
+import sys
+
+# Hand-rolled argv parsing shared by the scripts that are run directly (pipeline, benchmark and
+# job_queue use argparse instead). Both helpers remove what they consume, so whatever is left in
+# the list afterwards is the positional arguments.
+
+
+def pop_option(args, name, default=None, cast=str):
+    """Removes `name <value>` from an argv list and returns the cast value (or default)."""
+    if name not in args:
+        return default
+    index = args.index(name)
+    if index + 1 >= len(args):
+        sys.exit(f"{name} needs a value.")
+    value = cast(args[index + 1])
+    del args[index:index + 2]
+    return value
+
+
+def pop_flag(args, name):
+    """Removes a boolean `name` flag from an argv list and returns whether it was present."""
+    if name in args:
+        args.remove(name)
+        return True
+    return False
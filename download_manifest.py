@@ -0,0 +1,179 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+from workspace import SOURCES_DIRNAME
+
+MANIFEST_FILENAME = ".download_manifest.sqlite" # Stored inside the download directory
+STAGES = ['listed', 'downloaded', 'transcoded', 'tagged'] # Pipeline stages, in order
+
+
+def video_id_from_url(video_url):
+    """
+    Returns the YouTube video ID of a watch/short/youtu.be URL.
+    Falls back to the stripped URL itself so any link can still be used as a key.
+    """
+    parsed = urlparse(video_url.strip())
+    if parsed.hostname and parsed.hostname.endswith('youtu.be'):
+        return parsed.path.lstrip('/').split('/')[0] or video_url.strip()
+    query_id = parse_qs(parsed.query).get('v')
+    if query_id:
+        return query_id[0]
+    parts = [part for part in parsed.path.split('/') if part]
+    if len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+        return parts[1]
+    return video_url.strip()
+
+
+def file_checksum(filepath, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """
+    SQLite-backed record of every video a download run has seen, keyed by video ID.
+
+    Each entry remembers the furthest stage reached (see STAGES), the intermediate
+    source file, the final output path with its size and checksum, so a repeated or
+    interrupted run can skip finished items and resume half-done ones.
+    The object is safe to share between worker threads.
+    """
+
+    def __init__(self, manifest_path=MANIFEST_FILENAME):
+        self.manifest_path = manifest_path
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+        os.makedirs(manifest_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(manifest_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    title TEXT,
+                    stage TEXT NOT NULL,
+                    source_path TEXT,
+                    output_path TEXT,
+                    size INTEGER,
+                    checksum TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, video_id):
+        """Returns the manifest row for a video ID as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return dict(row) if row else None
+
+    def mark(self, video_id, url, stage, **fields):
+        """
+        Records that a video reached `stage`, updating any of the title, source_path,
+        output_path, size, checksum or error columns passed as keyword arguments.
+        A video never moves back to an earlier stage through mark().
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown manifest stage: {stage}")
+        columns = ['title', 'source_path', 'output_path', 'size', 'checksum', 'error']
+        unknown = set(fields) - set(columns)
+        if unknown:
+            raise ValueError(f"Unknown manifest fields: {', '.join(sorted(unknown))}")
+
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT stage FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO videos (video_id, url, stage, updated_at) VALUES (?, ?, ?, ?)",
+                    (video_id, url, stage, time.time()))
+            elif STAGES.index(stage) < STAGES.index(row['stage']):
+                stage = row['stage']
+            assignments = ', '.join(f"{column} = ?" for column in fields)
+            values = list(fields.values())
+            self._conn.execute(
+                f"UPDATE videos SET url = ?, stage = ?, updated_at = ?{', ' if fields else ''}{assignments} "
+                f"WHERE video_id = ?",
+                [url, stage, time.time()] + values + [video_id])
+
+    def reset(self, video_id, stage='listed'):
+        """Moves a video back to `stage` (used when its recorded files went missing)."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE videos SET stage = ?, updated_at = ? WHERE video_id = ?",
+                               (stage, time.time(), video_id))
+
+    def resume_point(self, video_id):
+        """
+        Decides where a run should pick a video up.
+
+        Returns:
+            'done' if the recorded output still exists with its recorded size,
+            'transcode' if only the downloaded source file survives (in the scratch space,
+            or kept in the .sources directory beside the manifest, see workspace.Workspace.close),
+            'download' otherwise.
+        """
+        entry = self.get(video_id)
+        if entry is None:
+            return 'download'
+
+        stage_index = STAGES.index(entry['stage'])
+        output_path = entry['output_path']
+        if stage_index >= STAGES.index('transcoded') and output_path and os.path.exists(output_path) \
+                and os.path.getsize(output_path) == entry['size']:
+            return 'done'
+
+        source_path = entry['source_path']
+        if stage_index >= STAGES.index('downloaded') and source_path:
+            if os.path.exists(source_path):
+                return 'transcode'
+            kept_path = os.path.join(os.path.dirname(os.path.abspath(self.manifest_path)), SOURCES_DIRNAME,
+                                     os.path.basename(source_path))
+            if os.path.exists(kept_path):
+                self.mark(video_id, entry['url'], entry['stage'], source_path=kept_path)
+                return 'transcode'
+
+        if stage_index > 0:
+            self.reset(video_id)
+        return 'download'
+
+    def stage_counts(self):
+        """Returns a {stage: number of videos} dict."""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) AS n FROM videos GROUP BY stage").fetchall()
+        counts = {stage: 0 for stage in STAGES}
+        counts.update({row['stage']: row['n'] for row in rows})
+        return counts
+
+
+if __name__ == "__main__":
+    manifest_file = sys.argv[1] if len(sys.argv) > 1 else MANIFEST_FILENAME
+    if os.path.isdir(manifest_file):
+        manifest_file = os.path.join(manifest_file, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_file):
+        print(f"No manifest found at '{manifest_file}'.")
+        print("Usage: python download_manifest.py [manifest_file_or_download_directory]")
+        sys.exit(1)
+
+    with DownloadManifest(manifest_file) as manifest:
+        print(f"Manifest: {manifest_file}")
+        for stage, count in manifest.stage_counts().items():
+            print(f"  {stage:<11} {count}")
\ No newline at end of file
@@ -0,0 +1,205 @@
+import http.client
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+from urllib.parse import urlparse
+import instrumentation
+
+DEFAULT_REQUESTS_PER_SECOND = 2.0 # Requests started per second against any one host
+DEFAULT_RETRIES = 3 # Extra attempts for a download that failed on a transient error
+DEFAULT_BACKOFF_BASE = 2.0 # Seconds; the retry delay ceiling doubles with every attempt
+DEFAULT_BACKOFF_MAX = 120.0 # Seconds; cap of the retry delay ceiling
+DEAD_LETTER_FILENAME = "failed_links.txt" # Stored inside the download directory
+
+RETRYABLE_HTTP_CODES = {408, 425, 429, 500, 502, 503, 504}
+# Error messages that no retry can fix
+PERMANENT_ERROR_MARKERS = (
+    'Video unavailable', 'Private video', 'This video has been removed', 'members-only',
+    'Sign in to confirm your age', 'Unsupported URL', 'HTTP Error 404', 'HTTP Error 410',
+)
+
+
+def parse_rate(value):
+    """Parses a byte rate such as '500K', '2M' or '1.5G' (powers of 1024) into bytes per second."""
+    if value is None:
+        return None
+    value = str(value).strip().upper()
+    for suffix in ('/S', 'B'): # Accept '2MB/s' as well as '2M'
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+    if not value:
+        return None
+    multiplier = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}.get(value[-1], 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+
+
+def is_retryable(error):
+    """True if a failed download may succeed when attempted again (network trouble, throttling)."""
+    message = str(error)
+    if any(marker in message for marker in PERMANENT_ERROR_MARKERS):
+        return False
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in RETRYABLE_HTTP_CODES
+    if isinstance(error, (urllib.error.URLError, ConnectionError, TimeoutError, http.client.HTTPException)):
+        return True
+    return type(error).__name__ == 'DownloadError' # yt-dlp wraps network errors in DownloadError
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second, holding at most `capacity`.
+
+    acquire() takes its tokens at once and sleeps off any deficit, so concurrent callers
+    are served in arrival order and the long-run rate never exceeds `rate`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class DownloadScheduler:
+    """
+    Network policy shared by every download worker of a batch.
+
+    - A global bandwidth budget: all concurrent downloads draw the bytes they receive
+      from one token bucket (see throttle_bytes), so the batch as a whole stays under
+      `bandwidth_limit` however many workers run.
+    - A per-host request rate: wait_for_host() spaces out the requests this program
+      starts against each host (yt-dlp's own follow-up requests are not counted).
+    - Retries: call() re-runs a download that failed on a transient error after an
+      exponential backoff with full jitter, honouring a Retry-After header if given.
+    - A dead-letter file: URLs that still failed are saved to `dead_letter_path`
+      (one per line, like video_links.txt) so a later run can retry only them, and
+      removed from it once they succeed.
+
+    Args:
+        bandwidth_limit: Bytes per second for all downloads together (None: unlimited).
+        requests_per_second: Requests per second per host (None or 0: unlimited).
+        retries: Extra attempts after a retryable failure.
+        backoff_base, backoff_max: Retry delay ceiling is min(backoff_max, backoff_base * 2**attempt).
+        dead_letter_path: Optional file collecting permanently failed URLs.
+    """
+
+    def __init__(self, bandwidth_limit=None, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, retries=DEFAULT_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX, dead_letter_path=None):
+        self.bandwidth = TokenBucket(bandwidth_limit) if bandwidth_limit else None
+        self.requests_per_second = requests_per_second
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_letter_path = dead_letter_path
+        self._host_buckets = {}
+        self._lock = threading.Lock()
+        self._dead_letters = []
+        if dead_letter_path and os.path.exists(dead_letter_path):
+            with open(dead_letter_path, 'r') as f:
+                self._dead_letters = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    def throttle_bytes(self, nbytes):
+        """Blocks the calling download until `nbytes` fit the shared bandwidth budget."""
+        if self.bandwidth and nbytes > 0:
+            self.bandwidth.acquire(nbytes)
+
+    def wait_for_host(self, url):
+        """Blocks until another request to the host of `url` fits its request rate."""
+        if not self.requests_per_second or not url:
+            return
+        host = urlparse(url).hostname or ''
+        with self._lock:
+            bucket = self._host_buckets.get(host)
+            if bucket is None:
+                bucket = self._host_buckets[host] = TokenBucket(self.requests_per_second,
+                                                                max(1.0, self.requests_per_second))
+        bucket.acquire(1)
+
+    def backoff_delay(self, attempt, error=None):
+        """Seconds to wait before retry number `attempt` (0-based)."""
+        retry_after = getattr(error, 'headers', None) and error.headers.get('Retry-After')
+        if retry_after and str(retry_after).isdigit():
+            return min(self.backoff_max, float(retry_after))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, url, function, *args, **kwargs):
+        """
+        Runs `function(*args, **kwargs)` for `url`, retrying transient failures.
+
+        Raises:
+            The last error once it is not retryable or the retries are used up.
+        """
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                attempt += 1
+                from tqdm import tqdm
+                instrumentation.increment('ytdl_retries_total')
+                instrumentation.emit('retry', url=url, attempt=attempt, delay_s=round(delay, 2),
+                                     reason=instrumentation.failure_reason(e))
+                tqdm.write(f"Retrying {url} in {delay:.1f}s (attempt {attempt}/{self.retries}): {e}")
+                time.sleep(delay)
+
+    @property
+    def dead_letters(self):
+        with self._lock:
+            return list(self._dead_letters)
+
+    def record_failure(self, url):
+        """Adds a URL that failed for good to the dead-letter file."""
+        with self._lock:
+            if url in self._dead_letters:
+                return
+            self._dead_letters.append(url)
+            self._save_dead_letters()
+
+    def clear_failure(self, url):
+        """Removes a URL from the dead-letter file (it succeeded after all)."""
+        with self._lock:
+            if url not in self._dead_letters:
+                return
+            self._dead_letters.remove(url)
+            self._save_dead_letters()
+
+    def _save_dead_letters(self):
+        if not self.dead_letter_path:
+            return
+        if not self._dead_letters:
+            if os.path.exists(self.dead_letter_path):
+                os.remove(self.dead_letter_path)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+        temporary_path = self.dead_letter_path + ".tmp"
+        with open(temporary_path, 'w') as f:
+            f.writelines(url + '\n' for url in self._dead_letters)
+        os.replace(temporary_path, self.dead_letter_path)
+
+
+if __name__ == "__main__":
+    dead_letter_path = os.path.join(sys.argv[1] if len(sys.argv) > 1 else ".", DEAD_LETTER_FILENAME)
+    scheduler = DownloadScheduler(dead_letter_path=dead_letter_path)
+    print(f"Dead-letter file: {dead_letter_path}")
+    print(f"  Failed URLs waiting for a retry: {len(scheduler.dead_letters)}")
+    for url in scheduler.dead_letters:
+        print(f"  {url}")
+    print("Retry them with: python video_downloader_mp3.py --playlist --retry-failed [download_directory]")
@@ -1,32 +1,133 @@
-from pytube import Playlist
 import sys # Import sys
 import os
+import queue
+import threading
+import instrumentation
+from cli_options import pop_flag
+from download_manifest import video_id_from_url
 
-def extract_playlist_links(playlist_url, output_file="video_links.txt"):
+DEFAULT_LISTING_WORKERS = 4 # Playlists fetched at the same time
+
+_DONE = object() # Sentinel a listing thread puts on the queue when its playlist is exhausted
+
+
+def iter_playlist_links(playlist_url):
+    """
+    Yields the video URLs of a YouTube playlist page by page, as pytube loads them,
+    instead of waiting for the whole listing.
+    """
+    from pytube import Playlist # Imported here: pytube is slow to load and only listing needs it
+    playlist = Playlist(playlist_url)
+    yield from playlist.url_generator()
+
+
+def iter_playlists_links(playlist_urls, max_workers=DEFAULT_LISTING_WORKERS):
+    """
+    Fetches several playlists concurrently and yields every video URL once.
+
+    URLs are yielded as soon as any playlist page arrives; a video appearing in several
+    playlists (or twice in one) is only yielded the first time. A failing playlist is
+    reported and skipped without stopping the others.
+
+    Args:
+        playlist_urls: An iterable of playlist URLs.
+        max_workers: Maximum number of playlists listed at the same time.
+    """
+    playlist_urls = list(dict.fromkeys(playlist_urls))
+    results = queue.Queue(maxsize=1000)
+    slots = threading.Semaphore(max(1, max_workers))
+
+    def list_playlist(playlist_url):
+        with slots:
+            try:
+                with instrumentation.stage('list', playlist=playlist_url) as record:
+                    record['videos'] = 0
+                    for url in iter_playlist_links(playlist_url):
+                        results.put(url)
+                        record['videos'] += 1
+            except Exception as e:
+                print(f"Error extracting playlist links from '{playlist_url}': {e}")
+            finally:
+                results.put(_DONE)
+
+    for playlist_url in playlist_urls:
+        threading.Thread(target=list_playlist, args=(playlist_url,), daemon=True).start()
+
+    seen_ids = set()
+    remaining = len(playlist_urls)
+    while remaining:
+        url = results.get()
+        if url is _DONE:
+            remaining -= 1
+            continue
+        video_id = video_id_from_url(url)
+        if video_id not in seen_ids:
+            seen_ids.add(video_id)
+            yield url
+
+
+def stream_playlist_links(playlist_urls, output_file="video_links.txt", append=False, manifest=None,
+                          max_workers=DEFAULT_LISTING_WORKERS):
+    """
+    Lists one or more playlists and yields each new video URL while saving it.
+
+    Every URL is appended (and flushed) to `output_file` the moment it arrives, so the
+    links found so far survive a failure and a consumer such as
+    video_downloader_mp3.download_videos can start on the first entries while later
+    pages are still loading.
+
+    Args:
+        playlist_urls: A playlist URL or a list of playlist URLs.
+        output_file: The file to save video URLs to (default: "video_links.txt").
+        append: Boolean, if True, keep the links already in the file (and skip them);
+                otherwise the file is started afresh.
+        manifest: Optional DownloadManifest; each new video is recorded as 'listed'.
+        max_workers: Maximum number of playlists listed at the same time.
+    """
+    if isinstance(playlist_urls, str):
+        playlist_urls = [playlist_urls]
+
+    known_ids = set()
+    if append and os.path.exists(output_file):
+        with open(output_file, 'r') as f:
+            known_ids = {video_id_from_url(line) for line in f if line.strip()}
+
+    with open(output_file, 'a' if append else 'w') as f:
+        for url in iter_playlists_links(playlist_urls, max_workers=max_workers):
+            video_id = video_id_from_url(url)
+            if video_id in known_ids:
+                continue
+            known_ids.add(video_id)
+            f.write(url + '\n')
+            f.flush()
+            if manifest:
+                manifest.mark(video_id, url, 'listed')
+            yield url
+
+
+def extract_playlist_links(playlist_url, output_file="video_links.txt", append=False):
     """
     Extracts video URLs from a YouTube playlist and saves them to a file.
 
     Args:
-        playlist_url: The URL of the YouTube playlist.
+        playlist_url: The URL of the YouTube playlist, or a list of playlist URLs
+                      (fetched concurrently, duplicates removed).
         output_file: The name of the file to save video URLs to (default: "video_links.txt").
+        append: Boolean, if True, add to the links already in the file instead of replacing them.
     """
     try:
-        playlist = Playlist(playlist_url)
-        video_urls = playlist.video_urls
-
-        with open(output_file, 'w+') as f:
-            for url in video_urls:
-                f.write(url + '\n')
-
-        print(f"Extracted {len(video_urls)} video links from playlist and saved to '{output_file}'")
+        extracted = sum(1 for _ in stream_playlist_links(playlist_url, output_file, append=append))
+        print(f"Extracted {extracted} video links from playlist and saved to '{output_file}'")
 
     except Exception as e:
         print(f"Error extracting playlist links: {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1: # Check for command line argument
-        playlist_link = sys.argv[1] # Get playlist URL from command line argument
-        extract_playlist_links(playlist_link)
+    args = sys.argv[1:]
+    append_links = pop_flag(args, "--append")
+    playlist_links = args
+    if playlist_links: # Check for command line arguments
+        extract_playlist_links(playlist_links, append=append_links) # Get playlist URLs from command line arguments
     else:
         print("Usage when running extract_link.py directly:")
-        print("  python extract_link.py <playlist_url>")
\ No newline at end of file
+        print("  python extract_link.py <playlist_url> [<playlist_url> ...] [--append]")
\ No newline at end of file
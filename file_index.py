@@ -0,0 +1,201 @@
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+INDEX_FILENAME = ".file_index.sqlite" # Stored inside the scanned directory
+CLAIM_TTL_SECONDS = 6 * 60 * 60 # A claim older than this is left over from a crashed job
+
+
+def scan_files(directory='.', extensions=(), recursive=False):
+    """
+    Yields (path, size, mtime_ns) for the files under `directory` with one of `extensions`,
+    using os.scandir so a directory is read with one call and no per-file listing.
+    Hidden files (e.g. outputs still being written, see workspace.atomic_outputs) are
+    skipped, and so are hidden directories when recursing.
+    """
+    extensions = {extension.lower() for extension in extensions}
+    directories = [directory]
+    while directories:
+        try:
+            entries = sorted(os.scandir(directories.pop(0)), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and not entry.name.startswith('.'):
+                    directories.append(entry.path)
+            elif not entry.name.startswith('.') and os.path.splitext(entry.name)[1].lower() in extensions \
+                    and entry.is_file():
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+class FileIndex:
+    """
+    SQLite-backed record of which files of a directory each batch stage has processed.
+
+    For every (file, stage) pair the index keeps the file's size and mtime when the
+    stage finished it, the stage's settings, its output and an optional result (e.g. a
+    measurement, see results()), so pending() only returns
+    files that are new or changed since. Stages also claim the outputs they are still
+    writing, and pending() skips claimed files, so one batch job never picks up
+    another's half-written output. Paths are stored relative to `directory`; several
+    jobs (and processes) can share one index. The object is safe to share between
+    worker threads.
+    """
+
+    def __init__(self, directory='.', index_path=None):
+        self.directory = directory
+        self.index_path = index_path or os.path.join(directory, INDEX_FILENAME)
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    settings TEXT,
+                    output_path TEXT,
+                    error TEXT,
+                    result TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (path, stage)
+                )
+            """)
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(files)")}
+            if 'result' not in columns: # Index written before stages could store results
+                self._conn.execute("ALTER TABLE files ADD COLUMN result TEXT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _key(self, path):
+        return os.path.normpath(os.path.relpath(path, self.directory))
+
+    def _path(self, key):
+        return os.path.normpath(os.path.join(self.directory, key))
+
+    def claimed(self):
+        """Returns the set of paths (relative to the directory) some stage is still writing."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM files WHERE state = 'writing' AND updated_at > ?",
+                                      (time.time() - CLAIM_TTL_SECONDS,)).fetchall()
+        return {row['path'] for row in rows}
+
+    def pending(self, stage, extensions, recursive=False, settings=''):
+        """
+        Scans the directory and returns the paths `stage` still has to process.
+
+        A file is pending unless the stage finished it with the same size, mtime and
+        settings and its recorded output still exists. Files claimed by a running stage
+        are left out, and records of files that disappeared are dropped.
+
+        Args:
+            stage: The batch stage name, e.g. 'webm_to_mp4'.
+            extensions: File extensions the stage takes as input.
+            recursive: Boolean, if True, include subdirectories (hidden ones excepted).
+            settings: A string describing the stage's settings (e.g. the tags applied);
+                      files done with other settings are pending again.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM files WHERE stage = ? AND state != 'writing'",
+                                      (stage,)).fetchall()
+        done = {row['path']: row for row in rows if row['state'] == 'done'}
+        claimed = self.claimed()
+
+        pending = []
+        seen = set()
+        for path, size, mtime_ns in scan_files(self.directory, extensions, recursive):
+            key = self._key(path)
+            seen.add(key)
+            if key in claimed:
+                continue
+            row = done.get(key)
+            if row and row['size'] == size and row['mtime_ns'] == mtime_ns and row['settings'] == settings \
+                    and (not row['output_path'] or os.path.exists(self._path(row['output_path']))):
+                continue
+            pending.append(self._path(key))
+
+        gone = [(row['path'], stage) for row in rows if row['path'] not in seen
+                and (recursive or os.path.dirname(row['path']) == '')]
+        if gone:
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM files WHERE path = ? AND stage = ?", gone)
+        return pending
+
+    def mark(self, path, stage, state='done', settings='', output_path=None, error=None, result=None):
+        """
+        Records the outcome of `stage` for a file, with the file's current size and mtime.
+        `result` is an optional string the stage wants to keep for the file (see results()).
+        """
+        try:
+            stat = os.stat(path)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError: # Deleted by the stage (e.g. the source of a conversion)
+            size, mtime_ns = None, None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, stage, state, size, mtime_ns, settings, output_path, error, "
+                "result, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(path), stage, state, size, mtime_ns, settings,
+                 self._key(output_path) if output_path else None, error, result, time.time()))
+
+    @contextlib.contextmanager
+    def claim(self, output_path, stage):
+        """Marks `output_path` as being written by `stage` until the block exits."""
+        key = self._key(output_path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, stage, state, updated_at) VALUES (?, ?, 'writing', ?)",
+                (key, stage + ":output", time.time()))
+        try:
+            yield
+        finally:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM files WHERE path = ? AND stage = ?", (key, stage + ":output"))
+
+    def results(self, stage):
+        """Returns {path: result} for the files `stage` finished with a result."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, result FROM files WHERE stage = ? AND state = 'done' "
+                                      "AND result IS NOT NULL ORDER BY path", (stage,)).fetchall()
+        return {self._path(row['path']): row['result'] for row in rows}
+
+    def stage_counts(self):
+        """Returns a {stage: {state: number of files}} dict."""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, state, COUNT(*) AS n FROM files GROUP BY stage, state").fetchall()
+        counts = {}
+        for row in rows:
+            counts.setdefault(row['stage'], {})[row['state']] = row['n']
+        return counts
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else "."
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        print(f"No file index found at '{index_path}'.")
+        print("Usage: python file_index.py [directory]")
+        sys.exit(1)
+
+    with FileIndex(directory) as index:
+        print(f"File index: {index_path}")
+        for stage, states in sorted(index.stage_counts().items()):
+            print(f"  {stage:<14} " + ", ".join(f"{state}: {count}" for state, count in sorted(states.items())))
@@ -0,0 +1,246 @@
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Structured events are appended (one JSON object per line) to the file named by this
+# variable, or by configure(events_file=...). Nothing is written when neither is set.
+EVENTS_ENV = "DOWNLOADYOUTUBE_EVENTS"
+# Prometheus text-format metrics are written to this file at exit (or by write_metrics)
+METRICS_ENV = "DOWNLOADYOUTUBE_METRICS"
+PROGRESS_EVENT_INTERVAL = 5.0 # Seconds between download_progress events of one download
+
+# Metric name -> (Prometheus type, help text)
+METRICS = {
+    'ytdl_stage_runs_total': ('counter', 'Stage runs by outcome.'),
+    'ytdl_stage_seconds_total': ('counter', 'Wall-clock seconds spent in each stage.'),
+    'ytdl_stage_cpu_seconds_total': ('counter', 'CPU seconds of this process spent in each stage.'),
+    'ytdl_encoder_cpu_seconds_total': ('counter', 'CPU seconds used by ffmpeg child processes in each stage.'),
+    'ytdl_bytes_total': ('counter', 'Bytes processed by each stage.'),
+    'ytdl_failures_total': ('counter', 'Failed stage runs by exception type.'),
+    'ytdl_stage_in_progress': ('gauge', 'Stage runs currently in progress.'),
+    'ytdl_retries_total': ('counter', 'Download attempts repeated after a transient failure.'),
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_metrics = {} # (name, sorted label items) -> value
+_events = None
+_metrics_path = None
+_configured = False
+
+
+def configure(events_file=None, metrics_file=None):
+    """
+    Sets where events and metrics are written.
+
+    Args:
+        events_file: JSON-lines file events are appended to (default: $DOWNLOADYOUTUBE_EVENTS).
+        metrics_file: File the Prometheus text metrics are written to at exit
+                      (default: $DOWNLOADYOUTUBE_METRICS), e.g. for node_exporter's textfile collector.
+    """
+    global _events, _metrics_path, _configured
+    events_file = events_file or os.environ.get(EVENTS_ENV)
+    with _lock:
+        if _events:
+            _events.close()
+            _events = None
+        if events_file:
+            os.makedirs(os.path.dirname(os.path.abspath(events_file)), exist_ok=True)
+            _events = open(events_file, 'a', buffering=1) # Line-buffered: each event reaches the file at once
+        _metrics_path = metrics_file or os.environ.get(METRICS_ENV)
+        _configured = True
+
+
+def emit(event, **fields):
+    """Writes one structured event (timestamp, event name, thread and `fields`) if events are enabled."""
+    if not _configured:
+        configure()
+    if _events is None:
+        return
+    record = {'ts': round(time.time(), 3), 'event': event, 'thread': threading.current_thread().name}
+    record.update(fields)
+    line = json.dumps(record, default=str)
+    with _lock:
+        if _events:
+            _events.write(line + "\n")
+
+
+def increment(name, value=1, **labels):
+    """Adds `value` to the metric `name` with the given labels."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _metrics[key] = _metrics.get(key, 0) + value
+
+
+def failure_reason(error):
+    """A one-line reason for an exception, with the last stderr line of a failed ffmpeg call."""
+    reason = f"{type(error).__name__}: {error}"
+    stderr = getattr(error, 'stderr', None)
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors='replace')
+    if stderr and stderr.strip():
+        reason += f" ({stderr.strip().splitlines()[-1]})"
+    return reason
+
+
+def current_stage():
+    """The fields dict of the innermost stage running on this thread, or None."""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """
+    Times one unit of work of a stage (extract, download, transcode, tag, ...).
+
+    Yields a dict the caller can add fields to; a 'bytes' field also feeds the byte
+    counter and a bytes_per_s figure. Helpers running inside the block add theirs
+    through current_stage() (e.g. wait_for_child adds the encoder CPU time). When the
+    block exits a 'stage' event is emitted with its wall and CPU time, and an exception
+    is recorded with its reason and re-raised.
+    """
+    record = dict(fields)
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(record)
+    increment('ytdl_stage_in_progress', 1, stage=name)
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    status = 'ok'
+    try:
+        yield record
+    except Exception as e:
+        status = 'error'
+        record['error'] = failure_reason(e)
+        increment('ytdl_failures_total', stage=name, reason=type(e).__name__)
+        raise
+    except BaseException:
+        status = 'cancelled'
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+        stack.remove(record) # Not pop(): a stage may span yields of a generator
+        increment('ytdl_stage_in_progress', -1, stage=name)
+        increment('ytdl_stage_runs_total', stage=name, status=status)
+        increment('ytdl_stage_seconds_total', duration, stage=name)
+        increment('ytdl_stage_cpu_seconds_total', cpu, stage=name)
+        if record.get('encoder_cpu_s'):
+            increment('ytdl_encoder_cpu_seconds_total', record['encoder_cpu_s'], stage=name)
+        if record.get('bytes'):
+            increment('ytdl_bytes_total', record['bytes'], stage=name)
+            if duration > 0:
+                record.setdefault('bytes_per_s', round(record['bytes'] / duration))
+        emit('stage', stage=name, status=status, duration_s=round(duration, 4), cpu_s=round(cpu, 4), **record)
+
+
+def wait_for_child(process):
+    """
+    Waits for a subprocess.Popen child (e.g. ffmpeg) and returns its exit status.
+
+    Where the platform reports it, the child's CPU time is added to the current stage
+    as 'encoder_cpu_s', which the parent's own CPU clock does not include.
+    """
+    if not hasattr(os, 'wait4'): # Windows
+        return process.wait()
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError: # Already reaped
+        return process.wait()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record = current_stage()
+    if record is not None:
+        record['encoder_cpu_s'] = round(record.get('encoder_cpu_s', 0) + usage.ru_utime + usage.ru_stime, 4)
+    return process.returncode
+
+
+def prometheus_text():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _lock:
+        items = sorted(_metrics.items())
+    lines = []
+    described = set()
+    for (name, labels), value in items:
+        if name not in described:
+            kind, help_text = METRICS.get(name, ('untyped', ''))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            described.add(name)
+        label_text = ",".join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, label in labels)
+        value = round(value, 6) if isinstance(value, float) else value
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics_file=None):
+    """Writes prometheus_text() to `metrics_file` (default: the configured one) atomically."""
+    metrics_file = metrics_file or _metrics_path
+    if not metrics_file:
+        return
+    temporary_path = metrics_file + ".tmp"
+    with open(temporary_path, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(temporary_path, metrics_file)
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serves prometheus_text() over HTTP from a background thread; returns the server."""
+    import http.server # Only needed here; keeps importing this module cheap
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+@atexit.register
+def _shutdown():
+    try:
+        write_metrics()
+    except OSError as e:
+        print(f"Could not write metrics: {e}", file=sys.stderr)
+    with _lock:
+        if _events:
+            _events.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python instrumentation.py <events.jsonl>")
+        print("  Summarises the stage events of earlier runs (see DOWNLOADYOUTUBE_EVENTS).")
+        sys.exit(1)
+
+    totals = {}
+    with open(sys.argv[1], 'r') as f:
+        for line in f:
+            event = json.loads(line)
+            if event.get('event') != 'stage':
+                continue
+            entry = totals.setdefault(event['stage'], {'runs': 0, 'failed': 0, 'seconds': 0.0, 'cpu': 0.0,
+                                                       'encoder_cpu': 0.0, 'bytes': 0})
+            entry['runs'] += 1
+            entry['failed'] += event['status'] != 'ok'
+            entry['seconds'] += event['duration_s']
+            entry['cpu'] += event['cpu_s']
+            entry['encoder_cpu'] += event.get('encoder_cpu_s', 0)
+            entry['bytes'] += event.get('bytes', 0)
+
+    print(f"{'stage':<16}{'runs':>7}{'failed':>8}{'wall s':>11}{'cpu s':>10}{'ffmpeg s':>10}{'MB':>10}")
+    for name, entry in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name:<16}{entry['runs']:>7}{entry['failed']:>8}{entry['seconds']:>11.1f}{entry['cpu']:>10.1f}"
+              f"{entry['encoder_cpu']:>10.1f}{entry['bytes'] / 1e6:>10.1f}")
\ No newline at end of file
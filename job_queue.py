@@ -0,0 +1,540 @@
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import instrumentation
+from workspace import parse_size, remove_partial_files, wait_for_free_space
+
+QUEUE_FILENAME = ".job_queue.sqlite" # Default queue location (inside the shared download directory)
+JOB_KINDS = ('list', 'download', 'transcode', 'tag')
+DEFAULT_LEASE_SECONDS = 120.0 # A job whose worker stops heartbeating for this long is handed out again
+DEFAULT_MAX_ATTEMPTS = 3 # Runs of a job (including re-runs after a crashed worker) before it is marked failed
+DEFAULT_POLL_INTERVAL = 2.0 # Seconds an idle worker waits before looking for work again
+RETRY_DELAY_BASE = 5.0 # Seconds; a failed job waits RETRY_DELAY_BASE * 2**(attempts - 1) before its next run
+RETRY_DELAY_MAX = 300.0
+
+# Info dict fields a download job hands on to its transcode job (tags and thumbnail)
+JOB_INFO_FIELDS = ('id', 'title', 'track', 'artist', 'creator', 'uploader', 'channel', 'album', 'album_artist',
+                   'genre', 'release_date', 'upload_date', 'release_year', 'track_number', 'playlist_index',
+                   'playlist_title', 'thumbnail', 'http_headers')
+
+
+def default_worker_id():
+    """Identifies a worker process across hosts: '<hostname>:<pid>'."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of pipeline jobs (see JOB_KINDS) that several worker processes,
+    on one host or on several hosts sharing the queue file, take work from.
+
+    A worker claims a job with a lease and renews it with heartbeats while it runs.
+    A job whose lease runs out (its worker crashed, hung or lost the storage) is
+    queued again, up to `max_attempts` runs; failed jobs are retried after a growing
+    delay. A job enqueued with a key is not added while a job with that key is queued
+    or running (nor, with skip_done, once one is done), so listing a playlist again
+    only adds its new videos, while the playlist itself can be queued again.
+
+    The rollback journal is used instead of WAL, which needs memory shared by all
+    processes on one host. Leases use wall-clock time, so hosts need synchronised clocks.
+    The object is safe to share between worker threads.
+    """
+
+    def __init__(self, queue_path=QUEUE_FILENAME):
+        self.queue_path = queue_path
+        os.makedirs(os.path.dirname(os.path.abspath(queue_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE (see _transaction)
+        self._conn = sqlite3.connect(queue_path, check_same_thread=False, timeout=60, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    key TEXT UNIQUE,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    run_after REAL NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, kind, run_after)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Runs the block in a write transaction that holds the database lock from its start."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def enqueue(self, kind, payload, key=None, max_attempts=DEFAULT_MAX_ATTEMPTS, skip_done=False):
+        """
+        Adds a job.
+
+        Args:
+            kind: One of JOB_KINDS.
+            payload: A JSON-serialisable dict handed to the job's handler.
+            key: Optional key; the job is not added while a job with the same key is queued or running.
+            max_attempts: Runs before the job is marked failed.
+            skip_done: Boolean, if True, the job is not added either when a job with `key` is done.
+
+        Returns:
+            The new job's ID, or None if a job with `key` is pending (or done, see skip_done).
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        with self._transaction() as conn:
+            if key is not None:
+                row = conn.execute("SELECT state FROM jobs WHERE key = ?", (key,)).fetchone()
+                if row and (row['state'] in ('queued', 'running') or (skip_done and row['state'] == 'done')):
+                    return None
+                if row: # The finished job keeps its history but hands its key on to the new one
+                    conn.execute("UPDATE jobs SET key = NULL WHERE key = ?", (key,))
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, key, payload, state, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (kind, key, json.dumps(payload), max_attempts, now, now, now))
+        instrumentation.emit('job_enqueued', job_id=cursor.lastrowid, kind=kind, key=key)
+        return cursor.lastrowid
+
+    def _requeue_expired(self, conn, now):
+        expired = conn.execute("SELECT id, kind, worker, attempts, max_attempts FROM jobs "
+                               "WHERE state = 'running' AND lease_expires < ?", (now,)).fetchall()
+        for job in expired:
+            state = 'queued' if job['attempts'] < job['max_attempts'] else 'failed'
+            conn.execute("UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                         "WHERE id = ?", (state, f"Lease of worker {job['worker']} expired", now, job['id']))
+            instrumentation.emit('job_requeued' if state == 'queued' else 'job_failed', job_id=job['id'],
+                                 kind=job['kind'], worker=job['worker'], reason='lease expired')
+        return len(expired)
+
+    def requeue_expired(self):
+        """Queues the running jobs whose lease ran out again; returns how many there were."""
+        with self._transaction() as conn:
+            return self._requeue_expired(conn, time.time())
+
+    def claim(self, worker_id, kinds=JOB_KINDS, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Takes the oldest runnable job of one of `kinds` for `worker_id`.
+
+        Returns:
+            The job as a dict (payload decoded), or None if there is no work.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+            placeholders = ", ".join("?" for _ in kinds)
+            row = conn.execute(f"SELECT * FROM jobs WHERE state = 'queued' AND run_after <= ? "
+                               f"AND kind IN ({placeholders}) ORDER BY run_after, id LIMIT 1",
+                               [now] + list(kinds)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET state = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                         "updated_at = ? WHERE id = ?", (worker_id, now + lease_seconds, now, row['id']))
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['attempts'] += 1
+        return job
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extends a running job's lease; returns False if the worker no longer holds it."""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                                  "WHERE id = ? AND worker = ? AND state = 'running'",
+                                  (now + lease_seconds, now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result=None):
+        """Marks a job done; returns False if its lease had already been lost to another worker."""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET state = 'done', result = ?, error = NULL, lease_expires = NULL, "
+                                  "updated_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                                  (json.dumps(result), now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        """
+        Records a failed run: the job is queued again after a delay while it has attempts
+        left (and `retry` is True), and marked failed otherwise.
+
+        Returns:
+            The job's new state, or None if the worker no longer held it.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? "
+                               "AND state = 'running'", (job_id, worker_id)).fetchone()
+            if row is None:
+                return None
+            state = 'queued' if retry and row['attempts'] < row['max_attempts'] else 'failed'
+            delay = min(RETRY_DELAY_MAX, RETRY_DELAY_BASE * 2 ** (row['attempts'] - 1))
+            conn.execute("UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, error = ?, run_after = ?, "
+                         "updated_at = ? WHERE id = ?", (state, str(error), now + delay, now, job_id))
+        return state
+
+    def release(self, job_id, worker_id):
+        """Hands a running job back without counting the run (e.g. the worker is shutting down)."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET state = 'queued', worker = NULL, lease_expires = NULL, "
+                         "attempts = attempts - 1, updated_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                         (now, job_id, worker_id))
+
+    def retry_failed(self, kinds=JOB_KINDS):
+        """Queues every failed job of `kinds` again with fresh attempts; returns how many."""
+        now = time.time()
+        placeholders = ", ".join("?" for _ in kinds)
+        with self._transaction() as conn:
+            cursor = conn.execute(f"UPDATE jobs SET state = 'queued', attempts = 0, run_after = ?, updated_at = ? "
+                                  f"WHERE state = 'failed' AND kind IN ({placeholders})", [now, now] + list(kinds))
+        return cursor.rowcount
+
+    def counts(self):
+        """Returns a {kind: {state: number of jobs}} dict."""
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, state, COUNT(*) AS n FROM jobs GROUP BY kind, state").fetchall()
+        counts = {kind: {} for kind in JOB_KINDS}
+        for row in rows:
+            counts.setdefault(row['kind'], {})[row['state']] = row['n']
+        return counts
+
+    def failures(self, limit=20):
+        """Returns (kind, payload, error) of the most recently failed jobs."""
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, payload, error FROM jobs WHERE state = 'failed' "
+                                      "ORDER BY updated_at DESC LIMIT ?", (limit,)).fetchall()
+        return [(row['kind'], json.loads(row['payload']), row['error']) for row in rows]
+
+
+# Job handlers: handler(payload, job_queue) runs one job and returns a JSON-serialisable result.
+# The pipeline modules are imported inside them so a worker only loads what its job kinds need.
+
+def _video_key(kind, video_url, download_directory):
+    from download_manifest import video_id_from_url
+    return f"{kind}:{video_id_from_url(video_url)}:{download_directory}"
+
+
+def handle_list(payload, job_queue):
+    """Lists a playlist and queues a download job per video."""
+    from extract_link import iter_playlist_links
+    options = payload['options']
+    listed = queued = 0
+    with instrumentation.stage('list', playlist=payload['playlist_url']) as record:
+        for video_url in iter_playlist_links(payload['playlist_url']):
+            listed += 1
+            queued += job_queue.enqueue('download', dict(options, url=video_url, track_number=listed),
+                                        key=_video_key('download', video_url, options['download_directory']),
+                                        skip_done=True) is not None
+        record['videos'] = listed
+    return {'listed': listed, 'queued': queued}
+
+
+def handle_download(payload, job_queue):
+    """Downloads a video's audio into the download directory and queues its transcode job."""
+    from video_downloader_mp3 import download_audio
+    video_info, filepath = download_audio(payload['url'], payload['download_directory'], show_progress=False)
+    info = {field: video_info[field] for field in JOB_INFO_FIELDS if video_info.get(field) is not None}
+    transcode_payload = dict(payload, source_path=filepath, info=info)
+    job_queue.enqueue('transcode', transcode_payload, key=_video_key('transcode', payload['url'],
+                                                                     payload['download_directory']))
+    return {'source_path': filepath}
+
+
+def handle_transcode(payload, job_queue):
+    """
+    Encodes a downloaded source to MP3 (and its profile versions), adds ReplayGain tags
+    measured by the same encode if asked, and queues a tag job if there is artwork.
+    The source is kept until the job is marked done (see finish_transcode), so a run
+    that dies before that can be retried.
+    """
+    from loudness import record_loudness, tag_replaygain
+    from video_downloader_mp3 import (DEFAULT_MP3_QUALITY, convert_audio_to_mp3, output_filename, profile_outputs,
+                                      track_metadata)
+    output_profiles = payload.get('output_profiles') or ()
+    measurements = []
+    metadata_context = contextlib.nullcontext((None, None))
+    if payload.get('embed_metadata', True):
+        metadata_context = track_metadata(payload['info'], payload['download_directory'], payload.get('track_number'),
+                                          extra_tags=payload.get('extra_tags'),
+                                          embed_thumbnail=not payload.get('artwork_filename'))
+    mp3_filename = output_filename(payload['info'], payload['download_directory'], output_profiles)
+    with metadata_context as (metadata, cover_filepath):
+        mp3_filepath = convert_audio_to_mp3(payload['source_path'], payload.get('mp3_quality') or DEFAULT_MP3_QUALITY,
+                                            delete_original=False, metadata=metadata, cover_filepath=cover_filepath,
+                                            output_profiles=output_profiles, mp3_filename=mp3_filename,
+                                            loudness_callback=measurements.append if payload.get('replaygain') else None)
+    if measurements:
+        output_filepaths = [mp3_filepath] + [filepath for filepath, _ in profile_outputs(mp3_filepath, output_profiles)]
+        tag_replaygain(output_filepaths, measurements[-1])
+        record_loudness(payload['download_directory'], output_filepaths, measurements[-1])
+    if payload.get('artwork_filename'):
+        job_queue.enqueue('tag', {'path': mp3_filepath, 'artwork_filename': payload['artwork_filename']},
+                          key=f"tag:{mp3_filepath}")
+    return {'output_path': mp3_filepath}
+
+
+def handle_tag(payload, job_queue):
+    """Adds the artwork to a finished MP3."""
+    from mp3_metadata_editor import load_artwork, tag_audio_file
+    artwork = load_artwork(payload['artwork_filename'])
+    return {'result': tag_audio_file(payload['path'], {}, artwork)}
+
+
+def finish_transcode(payload, result):
+    """Deletes a transcode job's source once the job is marked done."""
+    source_path = payload['source_path']
+    if os.path.abspath(source_path) != os.path.abspath(result['output_path']) and os.path.exists(source_path):
+        os.remove(source_path)
+
+
+HANDLERS = {
+    'list': handle_list,
+    'download': handle_download,
+    'transcode': handle_transcode,
+    'tag': handle_tag,
+}
+
+# Cleanup run after a job of the kind is marked done: finisher(payload, result)
+FINISHERS = {
+    'transcode': finish_transcode,
+}
+
+
+def enqueue_pipeline(job_queue, video_urls=(), playlist_urls=(), download_directory=".", mp3_quality=None,
+                     embed_metadata=True, extra_tags=None, artwork_filename=None, output_profiles=(), replaygain=False):
+    """
+    Queues list jobs for playlists and download jobs for videos; the workers queue the
+    later stages (transcode, then tag when there is artwork) as each job finishes.
+
+    The download directory and the artwork must be on storage every worker can reach.
+
+    Returns:
+        The number of jobs added (pending jobs and finished downloads are not added again).
+    """
+    options = {
+        'download_directory': os.path.abspath(download_directory),
+        'mp3_quality': mp3_quality,
+        'embed_metadata': embed_metadata,
+        'extra_tags': extra_tags or {},
+        'artwork_filename': os.path.abspath(artwork_filename) if artwork_filename else None,
+        'output_profiles': list(output_profiles),
+        'replaygain': replaygain,
+    }
+    added = 0
+    for playlist_url in playlist_urls: # Queued again once listed, to pick up videos added since
+        added += job_queue.enqueue('list', {'playlist_url': playlist_url, 'options': options},
+                                   key=f"list:{playlist_url}:{options['download_directory']}") is not None
+    for track_number, video_url in enumerate(video_urls, start=1):
+        added += job_queue.enqueue('download', dict(options, url=video_url, track_number=track_number),
+                                   key=_video_key('download', video_url, options['download_directory']),
+                                   skip_done=True) is not None
+    return added
+
+
+def run_job(job_queue, job, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Runs one claimed job, renewing its lease from a heartbeat thread while the handler runs.
+
+    Returns:
+        True if the job succeeded.
+    """
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(lease_seconds / 3):
+            if not job_queue.heartbeat(job['id'], worker_id, lease_seconds):
+                print(f"Lost the lease of job {job['id']}; another worker may run it again.")
+                return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, name=f"heartbeat-{job['id']}", daemon=True)
+    heartbeat_thread.start()
+    try:
+        with instrumentation.stage('job', job_id=job['id'], kind=job['kind'], attempt=job['attempts']) as record:
+            result = HANDLERS[job['kind']](job['payload'], job_queue)
+            record['result'] = result
+    except Exception as e:
+        state = job_queue.fail(job['id'], worker_id, instrumentation.failure_reason(e))
+        print(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}/{job['max_attempts']}"
+              f"{', will be retried' if state == 'queued' else ''}: {e}")
+        return False
+    except BaseException:
+        job_queue.release(job['id'], worker_id) # Interrupted: let another worker take it at once
+        raise
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+    if job_queue.complete(job['id'], worker_id, result) and job['kind'] in FINISHERS:
+        FINISHERS[job['kind']](job['payload'], result)
+    print(f"Job {job['id']} ({job['kind']}) done: {result}")
+    return True
+
+
+def run_worker(job_queue, worker_id=None, kinds=JOB_KINDS, lease_seconds=DEFAULT_LEASE_SECONDS,
+               poll_interval=DEFAULT_POLL_INTERVAL, exit_when_idle=False, min_free_bytes=None):
+    """
+    Claims and runs jobs until interrupted (or, with `exit_when_idle`, until no job of
+    `kinds` is queued or running any more).
+
+    Args:
+        job_queue: The shared JobQueue.
+        worker_id: Name the worker's leases are held under (default: default_worker_id()).
+        kinds: Job kinds this worker takes, e.g. ('transcode',) on a CPU-heavy host.
+        lease_seconds: Lease length; the job goes back to the queue if no heartbeat renews it in time.
+        poll_interval: Seconds to wait when there is no work.
+        exit_when_idle: Boolean, if True, return once the queue holds no more work for this worker.
+        min_free_bytes: No new job is claimed while the queue's filesystem has less free space
+                        (default: see workspace.default_min_free_bytes).
+
+    Returns:
+        A (succeeded, failed) tuple of job counts.
+    """
+    worker_id = worker_id or default_worker_id()
+    succeeded = failed = 0
+    queue_directory = os.path.dirname(os.path.abspath(job_queue.queue_path))
+    while True:
+        wait_for_free_space([queue_directory], min_free_bytes) # Left to other hosts while this disk is full
+        job = job_queue.claim(worker_id, kinds, lease_seconds)
+        if job is None:
+            if exit_when_idle and not any(states.get('queued') or states.get('running')
+                                          for kind, states in job_queue.counts().items() if kind in kinds):
+                return succeeded, failed
+            time.sleep(poll_interval)
+            continue
+        if run_job(job_queue, job, worker_id, lease_seconds):
+            succeeded += 1
+        else:
+            failed += 1
+
+
+def print_status(job_queue):
+    states = ('queued', 'running', 'done', 'failed')
+    print(f"Job queue: {job_queue.queue_path}")
+    print(f"  {'kind':<10}" + "".join(f"{state:>9}" for state in states))
+    for kind, counts in job_queue.counts().items():
+        print(f"  {kind:<10}" + "".join(f"{counts.get(state, 0):>9}" for state in states))
+    for kind, payload, error in job_queue.failures():
+        print(f"  failed {kind}: {payload.get('url') or payload.get('playlist_url') or payload.get('path')}: {error}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Queue pipeline jobs and run workers that share the queue file.")
+    parser.add_argument("--queue", default=QUEUE_FILENAME, metavar="FILE", dest="queue_path",
+                        help=f"queue database on storage every worker can reach (default: {QUEUE_FILENAME})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="queue videos and playlists for the workers")
+    enqueue.add_argument("video_urls", nargs="*", metavar="VIDEO_URL")
+    enqueue.add_argument("-p", "--playlist", action="append", default=[], metavar="URL", dest="playlist_urls")
+    enqueue.add_argument("-f", "--links-file", metavar="FILE", help="also queue the video URLs in FILE")
+    enqueue.add_argument("-o", "--output", default=".", metavar="DIR", dest="download_directory")
+    enqueue.add_argument("-q", "--quality", dest="mp3_quality", help="MP3 bitrate (default: 320k)")
+    enqueue.add_argument("--no-tags", action="store_false", dest="embed_metadata")
+    enqueue.add_argument("--artwork", metavar="IMAGE", dest="artwork_filename",
+                         help="queue a tag job adding this cover to every MP3")
+    enqueue.add_argument("--profiles", default="", metavar="NAME[,NAME...]",
+                         help="also encode these versions from the same decode (see video_downloader_mp3)")
+    enqueue.add_argument("--replaygain", action="store_true",
+                         help="measure loudness during each encode and write ReplayGain tags")
+    for name in ('artist', 'album', 'genre'):
+        enqueue.add_argument(f"--{name}", help=f"{name} tag for every track")
+
+    work = commands.add_parser("work", help="run a worker")
+    work.add_argument("--kinds", default=",".join(JOB_KINDS),
+                      help=f"comma-separated job kinds to take (default: {','.join(JOB_KINDS)})")
+    work.add_argument("--workers", type=int, default=1, help="worker threads in this process (default: 1)")
+    work.add_argument("--worker-id", help="lease owner name (default: <hostname>:<pid>)")
+    work.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, dest="lease_seconds",
+                      help=f"lease length in seconds (default: {DEFAULT_LEASE_SECONDS:g})")
+    work.add_argument("--exit-when-idle", action="store_true", help="stop once there is no more work")
+    work.add_argument("--min-free", type=parse_size, metavar="SIZE", dest="min_free_bytes",
+                      help="claim no new job while the queue's disk has less than SIZE free, e.g. 5G (default: 256M)")
+
+    commands.add_parser("status", help="show job counts and recent failures")
+    commands.add_parser("requeue", help="queue jobs of crashed workers again now")
+    commands.add_parser("retry-failed", help="queue failed jobs again with fresh attempts")
+    return parser
+
+
+def main(argv=None):
+    """Command-line entry point; returns a process exit status."""
+    options = build_parser().parse_args(argv)
+    with JobQueue(options.queue_path) as job_queue:
+        if options.command == "enqueue":
+            video_urls = list(options.video_urls)
+            if options.links_file:
+                with open(options.links_file, 'r') as f:
+                    video_urls += [line.strip() for line in f if line.strip()]
+            from video_downloader_mp3 import parse_profiles
+            extra_tags = {name: getattr(options, name) for name in ('artist', 'album', 'genre')
+                          if getattr(options, name) is not None}
+            added = enqueue_pipeline(job_queue, video_urls, options.playlist_urls, options.download_directory,
+                                     options.mp3_quality, options.embed_metadata, extra_tags,
+                                     options.artwork_filename, parse_profiles(options.profiles), options.replaygain)
+            print(f"Queued {added} jobs in '{options.queue_path}'.")
+        elif options.command == "work":
+            kinds = [kind.strip() for kind in options.kinds.split(",") if kind.strip()]
+            unknown = [kind for kind in kinds if kind not in JOB_KINDS]
+            if unknown:
+                print(f"Unknown job kinds: {', '.join(unknown)}")
+                return 2
+            worker_id = options.worker_id or default_worker_id()
+            # Outputs half-written when a worker crashed (their jobs were requeued since)
+            remove_partial_files(os.path.dirname(os.path.abspath(options.queue_path)))
+            threads = [threading.Thread(target=run_worker, name=f"worker-{i}", daemon=True,
+                                        args=(job_queue, f"{worker_id}/{i}", kinds, options.lease_seconds,
+                                              DEFAULT_POLL_INTERVAL, options.exit_when_idle,
+                                              options.min_free_bytes))
+                       for i in range(max(1, options.workers))]
+            print(f"Worker {worker_id} taking {', '.join(kinds)} jobs from '{options.queue_path}' "
+                  f"({len(threads)} threads). Press Ctrl+C to stop.")
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(1)
+            except KeyboardInterrupt:
+                print("\nStopping; running jobs go back to the queue when their lease expires.")
+                return 130
+        elif options.command == "requeue":
+            print(f"Requeued {job_queue.requeue_expired()} jobs with expired leases.")
+        elif options.command == "retry-failed":
+            print(f"Requeued {job_queue.retry_failed()} failed jobs.")
+        print_status(job_queue)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+
+LIBRARY_DIRNAME = ".library" # Default library location (current directory)
+STAGING_DIRNAME = ".staging" # Downloads and encodes in progress, inside the library
+
+# Fields of a yt-dlp info dict that identify the source format a track was encoded from
+FORMAT_FIELDS = ('format_id', 'ext', 'acodec', 'abr', 'asr', 'audio_channels', 'filesize', 'filesize_approx')
+
+
+def format_hash(video_info, **output_settings):
+    """
+    Returns a short hash of the source format selected in `video_info` and the output
+    settings (e.g. codec and bitrate), so a different source or encode gets its own entry.
+    """
+    key = {field: video_info.get(field) for field in FORMAT_FIELDS}
+    key.update(output_settings)
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _same_file(path, other_path):
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
+
+
+def link_file(source_path, destination_path):
+    """
+    Makes `destination_path` point at `source_path` without copying the data when possible.
+
+    Returns:
+        'hardlink', 'symlink' (other filesystem, or no hardlink support) or 'copy' (neither works).
+    """
+    try:
+        os.link(source_path, destination_path)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        try:
+            target = os.path.relpath(os.path.abspath(source_path), os.path.dirname(os.path.abspath(destination_path)))
+        except ValueError: # Different drives on Windows
+            target = os.path.abspath(source_path)
+        os.symlink(target, destination_path)
+        return 'symlink'
+    except OSError:
+        shutil.copy2(source_path, destination_path)
+        return 'copy'
+
+
+def unshare_file(filepath):
+    """
+    Gives `filepath` its own copy of the data if it shares it (a hardlink or symlink into
+    the library), so editing it in place changes neither the stored track nor the other
+    directories linking to it. Call it before any in-place edit.
+
+    Returns:
+        True if a private copy was made.
+    """
+    if not os.path.islink(filepath) and os.stat(filepath).st_nlink < 2:
+        return False
+    directory, filename = os.path.split(filepath)
+    base, extension = os.path.splitext(filename)
+    # Hidden and marked partial, so an interrupted copy is cleaned up like other partial outputs
+    temporary_path = os.path.join(directory, f".{base}.{uuid.uuid4().hex[:8]}.partial{extension}")
+    try:
+        shutil.copy2(filepath, temporary_path) # Follows a symlink to the stored file
+        os.replace(temporary_path, filepath)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return True
+
+
+class LibraryStore:
+    """
+    Content-addressed store holding each encoded track once, keyed by video ID and
+    source-format hash: <library>/<video_id>/<format_hash><ext>.
+
+    Playlist directories only get links to the stored files (see place), so a video
+    referenced by several playlists or directories is downloaded and encoded once.
+    Hardlinks need the library and the playlist directories on the same filesystem;
+    otherwise symlinks (or, failing that, copies) are used. Placed files must not be
+    edited in place without unshare_file.
+    """
+
+    def __init__(self, library_path=LIBRARY_DIRNAME):
+        self.library_path = library_path
+        self.staging_directory = os.path.join(library_path, STAGING_DIRNAME)
+        os.makedirs(self.staging_directory, exist_ok=True)
+
+    def entry_path(self, video_id, entry_hash, extension='.mp3'):
+        safe_id = "".join(c if c.isalnum() or c in '-_' else '_' for c in video_id)
+        return os.path.join(self.library_path, safe_id, entry_hash + extension)
+
+    def lookup(self, video_id, entry_hash, extension='.mp3'):
+        """Returns the stored file for a video/format, or None if it has not been encoded yet."""
+        entry_path = self.entry_path(video_id, entry_hash, extension)
+        return entry_path if os.path.exists(entry_path) else None
+
+    def add(self, filepath, video_id, entry_hash):
+        """
+        Moves a finished file into the store (the source path is gone afterwards).
+
+        Returns:
+            The stored file's path.
+        """
+        entry_path = self.entry_path(video_id, entry_hash, os.path.splitext(filepath)[1].lower())
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        if os.path.exists(entry_path): # Another run stored it first
+            os.remove(filepath)
+            return entry_path
+        temporary_path = f"{entry_path}.{uuid.uuid4().hex[:8]}.part" # Unique: other runs may add the same entry
+        shutil.move(filepath, temporary_path) # A rename unless the file comes from another filesystem
+        os.replace(temporary_path, entry_path)
+        return entry_path
+
+    def place(self, entry_path, directory, filename, video_id):
+        """
+        Links a stored file into `directory` as `filename`.
+
+        A different file already using that name (another video with the same title)
+        is left alone and the link is named "<title> [<video_id>]<ext>" instead.
+
+        Returns:
+            A (destination_path, method) tuple, method being 'existing', 'hardlink', 'symlink' or 'copy'.
+        """
+        os.makedirs(directory, exist_ok=True)
+        destination_path = os.path.join(directory, filename)
+        if os.path.lexists(destination_path):
+            if _same_file(destination_path, entry_path):
+                return destination_path, 'existing'
+            base, extension = os.path.splitext(filename)
+            destination_path = os.path.join(directory, f"{base} [{video_id}]{extension}")
+            if os.path.lexists(destination_path):
+                if _same_file(destination_path, entry_path):
+                    return destination_path, 'existing'
+                os.remove(destination_path) # An older encode of this same video
+        return destination_path, link_file(entry_path, destination_path)
+
+    def entries(self):
+        """Yields (video_id, stored file path) for every stored track."""
+        for video_entry in sorted(os.scandir(self.library_path), key=lambda entry: entry.name):
+            if not video_entry.is_dir() or video_entry.name == STAGING_DIRNAME:
+                continue
+            for file_entry in os.scandir(video_entry.path):
+                if file_entry.is_file() and not file_entry.name.endswith('.part'):
+                    yield video_entry.name, file_entry.path
+
+
+if __name__ == "__main__":
+    library_path = sys.argv[1] if len(sys.argv) > 1 else LIBRARY_DIRNAME
+    if not os.path.isdir(library_path):
+        print(f"No library found at '{library_path}'.")
+        print("Usage: python library_store.py [library_directory]")
+        sys.exit(1)
+
+    library = LibraryStore(library_path)
+    entries = list(library.entries())
+    total_size = sum(os.path.getsize(entry_path) for _, entry_path in entries)
+    links = sum(os.stat(entry_path).st_nlink - 1 for _, entry_path in entries)
+    print(f"Library: {library_path}")
+    print(f"  Tracks: {len(entries)} ({total_size / 1024 / 1024:.1f} MB), hardlinked {links} times")
@@ -0,0 +1,208 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import subprocess
+import sys
+import instrumentation
+from audio_transcoder import LOUDNESS_OUTPUT, parse_loudness
+from cli_options import pop_flag, pop_option
+from file_index import FileIndex
+from mp3_metadata_editor import find_audio_files, freeform_key, tag_audio_file
+
+REFERENCE_LOUDNESS = -18.0 # LUFS; the ReplayGain 2.0 reference level
+REPLAYGAIN_EXTENSIONS = ['.mp3', '.m4a', '.mp4'] # Formats tag_audio_file can write ReplayGain tags to
+DEFAULT_ANALYSIS_WORKERS = os.cpu_count() or 1 # Files measured at the same time (each is one ffmpeg decode)
+STAGE = 'loudness' # File index stage; its results are the measurements as JSON
+
+# Downloads can measure loudness during their own encode (see audio_transcoder.transcode_audio's
+# loudness_callback), get their ReplayGain tags right away and record the measurement in the
+# file index (see record_loudness). Files encoded without it are only measured on request
+# (analyze_directory's `measure`), with one decode-only ffmpeg pass each; audio is never re-encoded.
+
+
+def replaygain_tags(measurement):
+    """
+    Returns the ReplayGain track tags (see mp3_metadata_editor.FREEFORM_TAGS) for a
+    loudness measurement (see audio_transcoder.parse_loudness).
+    """
+    gain = REFERENCE_LOUDNESS - measurement['integrated_lufs']
+    peak = 10 ** (measurement['true_peak_dbfs'] / 20) # dBFS -> linear amplitude
+    return {'replaygain_track_gain': f"{gain:+.2f} dB", 'replaygain_track_peak': f"{peak:.6f}"}
+
+
+def replaygain_measurement(tags):
+    """
+    Turns ReplayGain track tag values (as written by replaygain_tags) back into a measurement.
+
+    Returns:
+        A {'integrated_lufs': float, 'true_peak_dbfs': float} dict, or None if a tag is
+        missing or malformed.
+    """
+    try:
+        gain = float(tags['replaygain_track_gain'].split()[0])
+        peak = float(tags['replaygain_track_peak'])
+    except (KeyError, IndexError, ValueError):
+        return None
+    if peak <= 0:
+        return None
+    return {'integrated_lufs': round(REFERENCE_LOUDNESS - gain, 2), 'true_peak_dbfs': round(20 * math.log10(peak), 2)}
+
+
+def read_replaygain(audio_filepath):
+    """
+    Reads the ReplayGain track tags of an MP3/M4A/MP4 file back into a measurement.
+
+    Returns:
+        A {'integrated_lufs': float, 'true_peak_dbfs': float} dict, or None if the file
+        has no (readable) ReplayGain tags.
+    """
+    from mutagen import File
+    file_extension = os.path.splitext(audio_filepath)[1].lower()
+    audio = File(audio_filepath)
+    if not audio or audio.tags is None:
+        return None
+    values = {}
+    for name in ('replaygain_track_gain', 'replaygain_track_peak'):
+        value = audio.tags.get(freeform_key(name, file_extension))
+        if value:
+            values[name] = str(value.text[0]) if file_extension == '.mp3' else bytes(value[0]).decode(errors='replace')
+    return replaygain_measurement(values)
+
+
+def measure_loudness(audio_filepath):
+    """
+    Measures a file's integrated loudness and true peak with one decode-only ffmpeg pass.
+
+    Returns:
+        A measurement dict (see audio_transcoder.parse_loudness), or None for silent audio.
+
+    Raises:
+        subprocess.CalledProcessError if ffmpeg cannot decode the file.
+    """
+    command = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "info", "-nostats", "-i", audio_filepath]
+    command += LOUDNESS_OUTPUT
+    with instrumentation.stage('loudness', input=audio_filepath) as record:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True)
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = instrumentation.wait_for_child(process)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+        record['bytes'] = os.path.getsize(audio_filepath)
+    return parse_loudness(stderr)
+
+
+def tag_replaygain(audio_filepaths, measurement):
+    """
+    Writes the ReplayGain tags of `measurement` to each file that supports them (other
+    formats, e.g. Opus, are left alone). Only the tags are rewritten, never the audio.
+    """
+    tags = replaygain_tags(measurement)
+    for audio_filepath in audio_filepaths:
+        if os.path.splitext(audio_filepath)[1].lower() in REPLAYGAIN_EXTENSIONS:
+            tag_audio_file(audio_filepath, tags)
+
+
+def record_loudness(directory, audio_filepaths, measurement):
+    """
+    Caches the measurement an encode took in the file index of `directory` for the files
+    tagged with it, so analyze_directory and print_report use it without opening them.
+    """
+    with FileIndex(directory) as index:
+        for audio_filepath in audio_filepaths:
+            if os.path.splitext(audio_filepath)[1].lower() in REPLAYGAIN_EXTENSIONS:
+                index.mark(audio_filepath, STAGE, result=json.dumps(measurement))
+
+
+def analyze_directory(directory='.', recursive=True, workers=DEFAULT_ANALYSIS_WORKERS, use_index=True, measure=False):
+    """
+    Collects the loudness of the MP3/M4A/MP4 files under a directory.
+
+    A file that already carries ReplayGain tags (e.g. from a download run with loudness
+    analysis) is not decoded; its measurement is read back from the tags. Files without
+    them are only decoded, measured and tagged with `measure` (one decode-only pass each);
+    otherwise they are counted as untagged. The measurements are cached in the file
+    index, so later runs only open new or changed files.
+
+    Args:
+        directory: The directory holding the audio files (default: current directory).
+        recursive: Boolean, if True, also analyse files in subdirectories.
+        workers: Number of files measured at the same time.
+        use_index: Boolean, if True, skip files analysed before and unchanged since
+                   (see file_index.FileIndex).
+        measure: Boolean, if True, decode the files without ReplayGain tags to measure them.
+
+    Returns:
+        A dict with the numbers of files 'measured', read 'from_tags', 'untagged', 'silent' and 'failed'.
+    """
+    index = FileIndex(directory) if use_index else None
+    if index:
+        audio_filepaths = index.pending(STAGE, REPLAYGAIN_EXTENSIONS, recursive)
+        print(f"Found {len(audio_filepaths)} new or changed audio files under '{directory}'.")
+    else:
+        audio_filepaths = find_audio_files(directory, recursive)
+        print(f"Found {len(audio_filepaths)} audio files under '{directory}'.")
+
+    def process(audio_filepath):
+        try:
+            measurement = read_replaygain(audio_filepath)
+            outcome = 'from_tags'
+            if measurement is None and not measure:
+                return 'untagged' # Not recorded: a later run with `measure` still picks it up
+            if measurement is None:
+                measurement = measure_loudness(audio_filepath)
+                outcome = 'measured' if measurement else 'silent'
+                if measurement:
+                    tag_replaygain([audio_filepath], measurement)
+        except Exception as e:
+            print(f"  Error analysing {audio_filepath}: {instrumentation.failure_reason(e)}")
+            if index:
+                index.mark(audio_filepath, STAGE, state='failed', error=str(e))
+            return 'failed'
+        if index: # After tagging, so the recorded mtime is the tagged file's
+            index.mark(audio_filepath, STAGE, result=json.dumps(measurement) if measurement else None)
+        if outcome == 'measured':
+            print(f"  {measurement['integrated_lufs']:6.1f} LUFS, peak {measurement['true_peak_dbfs']:5.1f} dBFS: "
+                  f"{audio_filepath}")
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        outcomes = list(pool.map(process, audio_filepaths))
+    if index:
+        index.close()
+
+    counts = {outcome: outcomes.count(outcome) for outcome in ('measured', 'from_tags', 'untagged', 'silent', 'failed')}
+    print(f"\nLoudness analysis completed.")
+    print(f"Measured and tagged: {counts['measured']}, already tagged: {counts['from_tags']}, "
+          f"silent: {counts['silent']}, failed: {counts['failed']}")
+    if counts['untagged']:
+        print(f"{counts['untagged']} files have no ReplayGain tags; run with --measure to decode and tag them.")
+    return counts
+
+
+def print_report(directory='.'):
+    """Prints the cached measurements of a directory, loudest first."""
+    with FileIndex(directory) as index:
+        measurements = {path: json.loads(result) for path, result in index.results(STAGE).items()}
+    for path, measurement in sorted(measurements.items(), key=lambda item: -item[1]['integrated_lufs']):
+        gain = replaygain_tags(measurement)['replaygain_track_gain']
+        print(f"{measurement['integrated_lufs']:7.1f} LUFS {measurement['true_peak_dbfs']:6.1f} dBFS {gain:>10}  {path}")
+    print(f"\n{len(measurements)} files measured.")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers = pop_option(args, "--workers", DEFAULT_ANALYSIS_WORKERS, int)
+    report = pop_flag(args, "--report")
+    use_index = not pop_flag(args, "--full-scan") # Reopen every file, ignoring the file index
+    measure = pop_flag(args, "--measure") # Decode the files without ReplayGain tags
+    directory = args[0] if args else "."
+
+    if report:
+        print_report(directory)
+    else:
+        print("Loudness Analysis (ReplayGain tags)")
+        analyze_directory(directory, workers=workers, use_index=use_index, measure=measure)
+        print("\nScript finished.")
@@ -1,89 +1,125 @@
-import subprocess
+import runpy
+import sys
 
-def run_extract_links():
-    """Runs extract_link.py to extract video links from a playlist."""
+# The stages run in this process (see pipeline.py): no interpreter is spawned per stage and
+# every downloaded file moves on to conversion and tagging as soon as it is ready.
+# Run with arguments (e.g. `python main.py --playlist <url> -o music`) for unattended use,
+# or with a command (e.g. `python main.py manifest music/.download_manifest.sqlite`); see
+# `python main.py --help`. Only the module a command needs is imported, and the modules
+# themselves import yt-dlp, pytube, mutagen and tqdm only where they are used, so quick
+# commands start fast (checked by test_import_time.py).
+
+# Command -> (module run as the command, description)
+COMMANDS = {
+    'pipeline': ('pipeline', "download videos/playlists as tagged MP3s (default without a command)"),
+    'download': ('video_downloader_mp3', "standalone MP3 downloader (single video or video_links.txt)"),
+    'list': ('extract_link', "save a playlist's video links to video_links.txt"),
+    'tag': ('mp3_metadata_editor', "set artist/album/genre/artwork on existing files"),
+    'webm-to-mp4': ('webm_to_mp4_converter', "convert the WEBM files in the current directory to MP4"),
+    'mp4-to-m4a': ('mp4_to_m4a_converter', "convert the MP4 files in the current directory to M4A"),
+    'jobs': ('job_queue', "queue jobs and run workers sharing a job queue"),
+    'manifest': ('download_manifest', "show a download manifest's progress"),
+    'index': ('file_index', "show a directory's file index"),
+    'library': ('library_store', "show library statistics"),
+    'loudness': ('loudness', "report the loudness of a directory's audio files (--measure tags untagged ones)"),
+    'workspace': ('workspace', "show scratch and free space; remove leftovers of interrupted runs"),
+    'failed': ('download_scheduler', "list the links that failed for good"),
+    'cache': ('metadata_cache', "show or clear the video metadata cache"),
+    'events': ('instrumentation', "summarise the stage events of earlier runs"),
+    'benchmark': ('benchmark', "benchmark the stages offline"),
+}
+
+
+def print_usage():
+    print("Usage: python main.py                  interactive menu")
+    print("       python main.py [pipeline] ARGS  download (see python main.py pipeline --help)")
+    print("       python main.py COMMAND [ARGS]   run one tool:")
+    for command, (module_name, description) in COMMANDS.items():
+        print(f"  {command:<12} {description} ({module_name}.py)")
+
+
+def run_command(command, args):
+    """Runs a command's module as if it were started as `python <module>.py ARGS`."""
+    module_name = COMMANDS[command][0]
+    sys.argv = [f"{module_name}.py"] + list(args)
     try:
-        print("Running extract_link.py to get video links...")
-        playlist_url = input("Enter YouTube Playlist URL: ") # Get playlist URL here
-        subprocess.run(["python", "extract_link.py", playlist_url], check=True) # Execute extract_link.py, pass URL as argument
-        print("Video link extraction complete. Links saved to video_links.txt")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running extract_link.py: {e}")
-    except FileNotFoundError:
-        print("Error: extract_link.py not found. Make sure it's in the same directory.")
+        runpy.run_module(module_name, run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    return 0
+
 
 def run_single_video_downloader():
-    """Runs video_downloader_mp3.py to download a single video."""
+    """Downloads a single video as a tagged MP3."""
+    from pipeline import run_pipeline
     try:
-        print("\nRunning video_downloader_mp3.py for single video download...")
         video_url = input("Enter YouTube Video URL: ") # Get single video URL here
         download_directory = input("Enter download directory (leave blank for current directory): ") or "."
-        subprocess.run(["python", "video_downloader_mp3.py", video_url, download_directory], check=True) # Execute video_downloader_mp3.py, pass URL and directory as arguments
-        print("Single video MP3 download process complete.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running video_downloader_mp3.py: {e}")
-    except FileNotFoundError:
-        print("Error: video_downloader_mp3.py not found. Make sure it's in the same directory.")
+        results = run_pipeline(video_urls=[video_url], download_directory=download_directory)
+        print(f"Single video MP3 download process complete. Converted: {len(results['converted'])}, "
+              f"failed: {len(results['failed'])}")
+    except Exception as e:
+        print(f"Error downloading video: {e}")
 
 def run_playlist_video_downloader():
-    """Runs video_downloader_mp3.py to download MP3s from video links in video_links.txt."""
+    """Lists a playlist into video_links.txt and downloads its videos as tagged MP3s while it is listed."""
+    from pipeline import run_pipeline
     try:
-        print("\nRunning video_downloader_mp3.py for playlist download...")
+        playlist_url = input("Enter YouTube Playlist URL: ") # Get playlist URL here
         download_directory = input("Enter download directory (leave blank for current directory): ") or "."
-        subprocess.run(["python", "video_downloader_mp3.py", "--playlist", download_directory], check=True) # Execute video_downloader_mp3.py with --playlist flag and directory
-        print("Playlist MP3 download process complete.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running video_downloader_mp3.py: {e}")
-    except FileNotFoundError:
-        print("Error: video_downloader_mp3.py not found. Make sure it's in the same directory.")
-
-def run_webm_to_mp4_converter():
-    """Runs webm_to_mp4_converter.py to convert WEBM files to MP4."""
-    try:
-        print("\nRunning webm_to_mp4_converter.py to convert WEBM files to MP4...")
-        subprocess.run(["python", "webm_to_mp4_converter.py"], check=True) # Execute webm_to_mp4_converter.py
-        print("WEBM to MP4 conversion complete.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running webm_to_mp4_converter.py: {e}")
-    except FileNotFoundError:
-        print("Error: webm_to_mp4_converter.py not found. Make sure it's in the same directory.")
+        results = run_pipeline(playlist_urls=[playlist_url], download_directory=download_directory)
+        print(f"Playlist MP3 download process complete. Converted: {len(results['converted'])}, "
+              f"already done: {len(results['skipped'])}, failed: {len(results['failed'])}")
+    except Exception as e:
+        print(f"Error downloading playlist: {e}")
 
 def run_mp3_metadata_editor():
-    """Runs mp3_metadata_editor.py to edit MP3 and MP4 metadata."""
+    """Applies one artist/album/genre and the artwork file to the audio files in a directory."""
+    from mp3_metadata_editor import batch_edit_audio_metadata
     try:
-        print("\nRunning mp3_metadata_editor.py to edit metadata...")
-        subprocess.run(["python", "mp3_metadata_editor.py"], check=True) # Execute mp3_metadata_editor.py
+        directory = input("Enter the directory holding the audio files (leave blank for current directory): ") or "."
+        artist = input("Enter the Artist Name for all audio files: ")
+        album = input("Enter the Album Name for all audio files: ")
+        genre = input("Enter the Genre for all audio files: ")
+        batch_edit_audio_metadata(artist, album, genre, directory=directory)
         print("Metadata editing process complete.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running mp3_metadata_editor.py: {e}")
-    except FileNotFoundError:
-        print("Error: mp3_metadata_editor.py not found. Make sure it's in the same directory.")
+    except Exception as e:
+        print(f"Error editing metadata: {e}")
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1: # Non-interactive mode for cron jobs and workers
+        if sys.argv[1] in ('-h', '--help', 'help'):
+            print_usage()
+            sys.exit(0)
+        if sys.argv[1] in COMMANDS:
+            sys.exit(run_command(sys.argv[1], sys.argv[2:]))
+        from pipeline import main as pipeline_main
+        sys.exit(pipeline_main(sys.argv[1:]))
+
     print("YouTube to MP3 Downloader and Metadata Editor - Main Script")
 
     while True:
         print("\nChoose download type:")
         print("1. Download Single Video to MP3")
         print("2. Download Playlist to MP3s")
-        print("3. Exit")
+        print("3. Set Artist/Album/Genre/Artwork on existing files")
+        print("4. Exit")
 
-        choice = input("Enter your choice (1, 2, or 3): ")
+        choice = input("Enter your choice (1, 2, 3, or 4): ")
 
+        # Downloads tag each MP3 (title, artist, date, track, thumbnail) while it is encoded,
+        # so no separate metadata editing pass is needed after them.
         if choice == '1':
             run_single_video_downloader()
-            run_webm_to_mp4_converter() # Convert WEBM to MP4 after download
-            run_mp3_metadata_editor()    # Edit metadata after conversion
         elif choice == '2':
-            run_extract_links()
             run_playlist_video_downloader()
-            run_webm_to_mp4_converter() # Convert WEBM to MP4 after download
-            run_mp3_metadata_editor()    # Edit metadata after conversion
         elif choice == '3':
+            run_mp3_metadata_editor()
+        elif choice == '4':
             print("Exiting.")
             break
         else:
-            print("Invalid choice. Please enter 1, 2, or 3.")
+            print("Invalid choice. Please enter 1, 2, 3, or 4.")
 
     print("\nAll steps completed.")
\ No newline at end of file
@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# Shared by every download directory, since a video's metadata does not depend on where it is saved
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "DownloadYoutube", "metadata_cache.sqlite")
+# Extracted info carries signed format URLs that YouTube expires after a few hours
+DEFAULT_TTL_SECONDS = 4 * 60 * 60
+
+
+class MetadataCache:
+    """
+    Persistent cache of yt-dlp info dicts keyed by video ID and format selection.
+
+    Entries older than `ttl` seconds are treated as missing and evicted, so downloads
+    never reuse format URLs that have expired. The object is safe to share between
+    worker threads.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS info (
+                    video_id TEXT NOT NULL,
+                    format_spec TEXT NOT NULL,
+                    info_json TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, format_spec)
+                )
+            """)
+        self.evict_expired()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, video_id, format_spec=''):
+        """Returns the cached info dict for a video, or None if it is missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT info_json, fetched_at FROM info WHERE video_id = ? AND format_spec = ?",
+                (video_id, format_spec)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self.invalidate(video_id)
+            return None
+        return json.loads(row[0])
+
+    def put(self, video_id, info, format_spec=''):
+        """Stores a JSON-serialisable info dict (see yt_dlp.YoutubeDL.sanitize_info)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO info (video_id, format_spec, info_json, fetched_at) VALUES (?, ?, ?, ?)",
+                (video_id, format_spec, json.dumps(info), time.time()))
+
+    def invalidate(self, video_id):
+        """Drops every cached entry of a video."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM info WHERE video_id = ?", (video_id,))
+
+    def evict_expired(self):
+        """Deletes entries older than the TTL and returns how many were removed."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM info WHERE fetched_at < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM info")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM info").fetchone()[0]
+
+
+if __name__ == "__main__":
+    with MetadataCache() as cache:
+        if "--clear" in sys.argv:
+            cache.clear()
+            print(f"Cleared metadata cache '{cache.cache_path}'.")
+        else:
+            print(f"Metadata cache: {cache.cache_path}")
+            print(f"  Cached entries: {len(cache)} (TTL: {cache.ttl // 60} minutes)")
+            print("Usage: python metadata_cache.py [--clear]")
\ No newline at end of file
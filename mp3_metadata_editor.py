@@ -1,25 +1,101 @@
-from mutagen import File # Import general File function
-from mutagen.mp3 import MP3
-from mutagen.mp4 import MP4, MP4Cover  # Import MP4 for m4a
-from mutagen.id3 import ID3, TIT2, TPE1, TPE2, TALB, APIC, TCON
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
 import os
+import sys
+import instrumentation
+from cli_options import pop_flag, pop_option
+from file_index import FileIndex
+from library_store import unshare_file
 
 SUPPORTED_EXTENSIONS = ['.mp3', '.m4a', '.mp4'] # ADDED .mp4 to supported extensions
+DEFAULT_TAG_WORKERS = 8 # Files tagged at the same time (tagging is mostly file I/O)
 
-def batch_edit_audio_metadata(artist_name, album_name, genre_name, artwork_filename="artwork.jpg"):
+# Tag name -> ID3 frame ID (MP3), the name of its mutagen.id3 class
+ID3_TEXT_FRAMES = {
+    'title': 'TIT2',
+    'artist': 'TPE1',
+    'album_artist': 'TPE2',
+    'album': 'TALB',
+    'genre': 'TCON',
+    'date': 'TDRC',
+    'track': 'TRCK',
+}
+
+# Tag name -> MP4 atom (M4A/MP4)
+MP4_TEXT_ATOMS = {
+    'title': '\xa9nam',
+    'artist': '\xa9ART',
+    'album_artist': 'aART',
+    'album': '\xa9alb',
+    'genre': '\xa9gen',
+    'date': '\xa9day',
+    'track': 'trkn',
+}
+
+# Tag name -> name of a tag without a standard frame/atom, written as an ID3 TXXX frame
+# with this description (MP3) or a ----:com.apple.iTunes:<lowercase name> atom (M4A/MP4)
+FREEFORM_TAGS = {
+    'replaygain_track_gain': 'REPLAYGAIN_TRACK_GAIN',
+    'replaygain_track_peak': 'REPLAYGAIN_TRACK_PEAK',
+}
+
+
+def freeform_key(name, file_extension):
+    """The mutagen key of a FREEFORM_TAGS tag: 'TXXX:<name>' for MP3, the iTunes atom for M4A/MP4."""
+    if file_extension == '.mp3':
+        return f"TXXX:{FREEFORM_TAGS[name]}"
+    return f"----:com.apple.iTunes:{FREEFORM_TAGS[name].lower()}"
+
+
+def track_tags_from_info(video_info, track_number=None, track_total=None):
     """
-    Batch edits metadata for MP3, M4A, and MP4 audio files in the current directory.
-    WEBM files are skipped. Now includes MP4 support.
+    Builds per-track tags from a yt-dlp info dict (title, artist, album, upload date, track).
+
+    The keys match ID3_TEXT_FRAMES / MP4_TEXT_ATOMS and are also ffmpeg's metadata keys,
+    so the same dict can be written by ffmpeg during the encode or by apply_tags.
 
     Args:
-        artist_name: The artist name to set for all audio files.
-        album_name: The album name to set for all audio files.
-        genre_name: The genre name to set for all audio files.
-        artwork_filename: The filename of the artwork image (default: "artwork.jpg").
-                          It should be in the same directory as the script.
-                          Supports "artwork.jpg" and "artwork.png".
+        video_info: The info dict yt-dlp extracted for the video.
+        track_number: Optional position in the playlist (falls back to the info's
+                      track_number / playlist_index).
+        track_total: Optional number of tracks in the playlist.
+
+    Returns:
+        A {tag name: string} dict holding only the values that are known.
     """
+    artist = (video_info.get('artist') or video_info.get('creator') or video_info.get('uploader')
+              or video_info.get('channel'))
+    upload_date = video_info.get('release_date') or video_info.get('upload_date') or ''
+    track_number = track_number or video_info.get('track_number') or video_info.get('playlist_index')
+
+    tags = {
+        'title': video_info.get('track') or video_info.get('title'),
+        'artist': artist,
+        'album_artist': video_info.get('album_artist') or artist,
+        'album': video_info.get('album') or video_info.get('playlist_title'),
+        'genre': video_info.get('genre'),
+        'date': f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:8]}" if len(upload_date) == 8
+                else (str(video_info['release_year']) if video_info.get('release_year') else None),
+        'track': (f"{track_number}/{track_total}" if track_total else str(track_number)) if track_number else None,
+    }
+    return {name: value for name, value in tags.items() if value}
 
+
+def load_artwork(artwork_filename="artwork.jpg", max_size=None):
+    """
+    Reads the artwork image once for a whole batch.
+
+    Args:
+        artwork_filename: The artwork image to use; "artwork.png" is tried if it is missing.
+        max_size: Optional longest side in pixels. Bigger images are downscaled (and
+                  re-saved as JPEG) so every tagged file carries a smaller cover.
+                  Requires Pillow; the original image is used if it is not installed.
+
+    Returns:
+        A (artwork_data, mime_type) tuple, or None if no artwork file was found.
+    """
     artwork_path = None
     if os.path.exists(artwork_filename):
         artwork_path = artwork_filename
@@ -27,77 +103,213 @@ def batch_edit_audio_metadata(artist_name, album_name, genre_name, artwork_filen
         artwork_path = "artwork.png"
     else:
         print("Artwork file 'artwork.jpg' or 'artwork.png' not found in the current directory. No artwork will be added.")
+        return None
+
+    with open(artwork_path, 'rb') as img_file:
+        artwork_data = img_file.read()
+    mime_type = 'image/png' if artwork_path.lower().endswith('.png') else 'image/jpeg'
+
+    if max_size:
+        try:
+            from PIL import Image
+        except ImportError:
+            print("Pillow is not installed; using the artwork at its original size.")
+        else:
+            image = Image.open(io.BytesIO(artwork_data))
+            if max(image.size) > max_size:
+                image.thumbnail((max_size, max_size))
+                output = io.BytesIO()
+                image.convert('RGB').save(output, format='JPEG', quality=90)
+                artwork_data, mime_type = output.getvalue(), 'image/jpeg'
+
+    print(f"Artwork loaded from '{artwork_path}' ({len(artwork_data) // 1024} KB)")
+    return artwork_data, mime_type
+
+
+def find_audio_files(directory='.', recursive=True):
+    """
+    Returns the supported audio files under `directory`, recursing into subdirectories
+    unless `recursive` is False. Hidden files and directories are skipped.
+    """
+    audio_filepaths = []
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if not filename.startswith('.') and os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                audio_filepaths.append(os.path.join(root, filename))
+        if not recursive:
+            break
+    return audio_filepaths
+
+
+def apply_tags(audio, file_extension, tags, artwork=None):
+    """
+    Sets text tags and artwork on a loaded mutagen file, touching only values that differ.
+
+    Args:
+        audio: A mutagen file object with tags (see tag_audio_file).
+        file_extension: '.mp3' for ID3 frames, '.m4a'/'.mp4' for MP4 atoms.
+        tags: A {tag name: value} dict using the keys of ID3_TEXT_FRAMES / MP4_TEXT_ATOMS / FREEFORM_TAGS.
+        artwork: Optional (artwork_data, mime_type) tuple from load_artwork.
+
+    Returns:
+        True if anything changed (and the file needs saving).
+    """
+    from mutagen import id3
+    from mutagen.mp4 import MP4Cover # Import MP4Cover for m4a/mp4 artwork
+    changed = False
+    if file_extension == '.mp3':
+        for name, value in tags.items():
+            if name in FREEFORM_TAGS:
+                key = freeform_key(name, file_extension)
+                current = audio.tags.get(key)
+                if current is None or [str(text) for text in current.text] != [value]:
+                    audio.tags.setall(key, [id3.TXXX(encoding=3, desc=FREEFORM_TAGS[name], text=value)])
+                    changed = True
+                continue
+            frame_id = ID3_TEXT_FRAMES[name]
+            current = audio.tags.get(frame_id)
+            if current is None or [str(text) for text in current.text] != [value]:
+                audio.tags.setall(frame_id, [getattr(id3, frame_id)(encoding=3, text=value)])
+                changed = True
+        if artwork:
+            artwork_data, mime_type = artwork
+            current = audio.tags.getall('APIC')
+            if len(current) != 1 or current[0].data != artwork_data or current[0].mime != mime_type:
+                audio.tags.setall('APIC', [id3.APIC(encoding=3, mime=mime_type, type=3, desc=u'Cover', data=artwork_data)])
+                changed = True
+    else:
+        for name, value in tags.items():
+            if name in FREEFORM_TAGS: # Freeform atoms hold bytes
+                atom = freeform_key(name, file_extension)
+                if audio.tags.get(atom) != [value.encode()]:
+                    audio.tags[atom] = [value.encode()]
+                    changed = True
+                continue
+            atom = MP4_TEXT_ATOMS[name]
+            if name == 'track': # trkn holds (number, total) pairs
+                number, _, total = value.partition('/')
+                value = (int(number), int(total or 0))
+            if audio.tags.get(atom) != [value]:
+                audio.tags[atom] = [value]
+                changed = True
+        if artwork:
+            artwork_data, mime_type = artwork
+            image_format = MP4Cover.FORMAT_JPEG if mime_type == 'image/jpeg' else MP4Cover.FORMAT_PNG
+            current = audio.tags.get('covr') or []
+            if len(current) != 1 or bytes(current[0]) != artwork_data or current[0].imageformat != image_format:
+                audio.tags['covr'] = [MP4Cover(artwork_data, imageformat=image_format)]
+                changed = True
+    return changed
+
+
+def tag_audio_file(audio_filepath, tags, artwork=None):
+    """
+    Applies tags and artwork to one MP3/M4A/MP4 file, saving only if something changed.
+
+    Returns:
+        'updated', 'unchanged' or 'unsupported'.
+    """
+    from mutagen import File # Import general File function
+    with instrumentation.stage('tag', path=audio_filepath) as record:
+        file_extension = os.path.splitext(audio_filepath)[1].lower()
+        audio = File(audio_filepath) # Use mutagen.File to detect file type
+        if not audio: # mutagen.File might return None if it can't handle the file
+            record['result'] = 'unsupported'
+            return 'unsupported'
+
+        if audio.tags is None:
+            audio.add_tags() # ID3 for MP3, MP4 tags for M4A/MP4
 
-    audio_files_processed = 0
-
-    for filename in os.listdir('.'):
-        file_extension = os.path.splitext(filename)[1].lower()
-        if file_extension in SUPPORTED_EXTENSIONS: # Check against supported extensions (now includes .mp4)
-            audio_filepath = filename
-            print(f"Processing audio file: {audio_filepath}")
-
-            try:
-                audio = File(audio_filepath) # Use mutagen.File to detect file type
-
-                if not audio: # mutagen.File might return None if it can't handle the file
-                    print(f"  Skipping: Unrecognized or unsupported audio format for '{audio_filepath}'")
-                    continue # Skip to the next file
-
-                # Ensure tags exist - this is more general now
-                if audio.tags is None:
-                    print("  No existing tags found, creating new tags.")
-                    if file_extension == '.mp3':
-                        audio.tags = ID3() # Create ID3 tags for MP3
-                    elif file_extension == '.m4a' or file_extension == '.mp4': # Also create MP4 tags for .mp4
-                        audio.tags = MP4() # Create MP4 tags for M4A and MP4
-                    else: # For webm and potentially others, let mutagen.File handle tag creation if possible.
-                        pass # Rely on mutagen.File to initialize tags appropriately if needed.
-
-                # Set Artist, Album, and Genre (using ID3 tags for simplicity - might work for m4a too)
-                audio.tags['TPE1'] = TPE1(encoding=3, text=artist_name) # Artist
-                audio.tags['TPE2'] = TPE2(encoding=3, text=artist_name) # Album Artist
-                audio.tags['TALB'] = TALB(encoding=3, text=album_name) # Album
-                audio.tags['TCON'] = TCON(encoding=3, text=genre_name) # Genre
-
-                # Set Artwork if available (format-specific handling)
-                if artwork_path:
-                    with open(artwork_path, 'rb') as img_file:
-                        artwork_data = img_file.read()
-                        mime_type = 'image/jpeg' if artwork_path.lower().endswith('.jpg') else 'image/png'
-
-                        if file_extension == '.mp3':
-                            audio.tags['APIC:'] = APIC( # Use APIC for MP3
-                                encoding=3,
-                                mime=mime_type,
-                                type=3,
-                                desc=u'Cover',
-                                data=artwork_data
-                            )
-                        elif file_extension == '.m4a' or file_extension == '.mp4': # Also use MP4Cover for .mp4
-                            # Use MP4Cover for M4A/MP4 artwork
-                            image_format = MP4Cover.FORMAT_JPEG if mime_type == 'image/jpeg' else MP4Cover.FORMAT_PNG
-                            audio.tags['covr'] = [MP4Cover(artwork_data)] # Assign a list of MP4Cover objects
-
-
-                    print(f"  Artwork added from '{artwork_path}'")
-                else:
-                    print("  No artwork added.")
-
-                audio.save() # Save the changes
-                audio_files_processed += 1
-                print(f"  Metadata updated for: {audio_filepath}")
-
-            except Exception as e:
-                print(f"  Error processing {audio_filepath}: {e}")
+        record['result'] = 'updated' if apply_tags(audio, file_extension, tags, artwork) else 'unchanged'
+        if record['result'] == 'updated':
+            unshare_file(audio_filepath) # Copy-on-write: a library link's edits would show in every playlist
+            audio.save() # Save the changes
+        return record['result']
+
+
+def batch_edit_audio_metadata(artist_name, album_name, genre_name, artwork_filename="artwork.jpg", directory='.',
+                              recursive=True, workers=DEFAULT_TAG_WORKERS, max_artwork_size=None, use_index=True):
+    """
+    Batch edits metadata for MP3, M4A, and MP4 audio files under a directory.
+    WEBM files are skipped. Now includes MP4 support.
+
+    The artwork is read once for the whole batch, files are tagged in parallel, and a
+    file is only rewritten when its current tags differ from the requested ones.
+
+    Args:
+        artist_name: The artist name to set for all audio files.
+        album_name: The album name to set for all audio files.
+        genre_name: The genre name to set for all audio files.
+        artwork_filename: The filename of the artwork image (default: "artwork.jpg").
+                          It should be in the same directory as the script.
+                          Supports "artwork.jpg" and "artwork.png".
+        directory: The directory holding the audio files (default: current directory).
+        recursive: Boolean, if True, also tag files in subdirectories (e.g. download directories).
+        workers: Number of files tagged at the same time.
+        max_artwork_size: Optional longest artwork side in pixels (see load_artwork).
+        use_index: Boolean, if True, only open files that are new or changed since they were
+                   last tagged with the same tags and artwork (see file_index.FileIndex).
+    """
+    artwork = load_artwork(artwork_filename, max_artwork_size)
+    tags = {'artist': artist_name, 'album_artist': artist_name, 'album': album_name, 'genre': genre_name}
+    index = FileIndex(directory) if use_index else None
+    if index:
+        # Tagging again with other tags or artwork must revisit every file
+        settings = hashlib.sha256(json.dumps(tags, sort_keys=True).encode()
+                                  + (artwork[0] if artwork else b'')).hexdigest()[:16]
+        audio_filepaths = index.pending('tag', SUPPORTED_EXTENSIONS, recursive, settings)
+        print(f"Found {len(audio_filepaths)} new or changed audio files under '{directory}'.")
+    else:
+        audio_filepaths = find_audio_files(directory, recursive)
+        print(f"Found {len(audio_filepaths)} audio files under '{directory}'.")
+
+    def process(audio_filepath):
+        try:
+            result = tag_audio_file(audio_filepath, tags, artwork)
+        except Exception as e:
+            print(f"  Error processing {audio_filepath}: {e}")
+            if index:
+                index.mark(audio_filepath, 'tag', state='failed', settings=settings, error=str(e))
+            return 'failed'
+        if index: # After saving, so the recorded mtime is the tagged file's
+            index.mark(audio_filepath, 'tag', settings=settings)
+        if result == 'updated':
+            print(f"  Metadata updated for: {audio_filepath}")
+        elif result == 'unsupported':
+            print(f"  Skipping: Unrecognized or unsupported audio format for '{audio_filepath}'")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(process, audio_filepaths))
+    if index:
+        index.close()
 
     print(f"\nMetadata update process completed.")
-    print(f"Successfully processed {audio_files_processed} audio files.")
+    print(f"Successfully processed {results.count('updated') + results.count('unchanged')} audio files "
+          f"({results.count('updated')} updated, {results.count('unchanged')} already up to date, "
+          f"{results.count('failed')} failed).")
+
 
 if __name__ == "__main__":
-    artist = input("Enter the Artist Name for all audio files: ")
-    album = input("Enter the Album Name for all audio files: ")
-    genre = input("Enter the Genre for all audio files: ")
+    args = sys.argv[1:]
+    artist = pop_option(args, "--artist")
+    album = pop_option(args, "--album")
+    genre = pop_option(args, "--genre")
+    workers = pop_option(args, "--workers", DEFAULT_TAG_WORKERS, int)
+    artwork_size = pop_option(args, "--artwork-size", None, int)
+    recursive = not pop_flag(args, "--no-recursive")
+    use_index = not pop_flag(args, "--full-scan") # Open every file, ignoring the file index
+    directory = next((arg for arg in args if not arg.startswith("--")), '.')
+
+    if artist is None:
+        artist = input("Enter the Artist Name for all audio files: ")
+    if album is None:
+        album = input("Enter the Album Name for all audio files: ")
+    if genre is None:
+        genre = input("Enter the Genre for all audio files: ")
 
     print(f"\nSetting Artist: '{artist}', Album: '{album}', Genre: '{genre}' and adding artwork (if found).")
-    batch_edit_audio_metadata(artist, album, genre)
+    batch_edit_audio_metadata(artist, album, genre, directory=directory, recursive=recursive, workers=workers,
+                              max_artwork_size=artwork_size, use_index=use_index)
     print("\nScript finished.")
\ No newline at end of file
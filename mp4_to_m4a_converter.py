@@ -1,52 +1,89 @@
-from moviepy import *
+import contextlib
 import os
-from tqdm import tqdm
+import subprocess
+import sys
+import instrumentation
+from audio_transcoder import transcode_audio
+from cli_options import pop_flag
+from file_index import FileIndex
+from workspace import remove_partial_files, wait_for_free_space
 
-def batch_convert_mp4_to_m4a(delete_mp4=True):
+DEFAULT_M4A_QUALITY = "256k" # AAC bitrate used only when the MP4 audio cannot be remuxed
+
+def batch_convert_mp4_to_m4a(delete_mp4=True, m4a_quality=DEFAULT_M4A_QUALITY, use_index=True, min_free_bytes=None):
     """
     Batch converts MP4 video files in the current directory to M4A audio format.
+    AAC audio is remuxed into the M4A container as-is; other codecs are re-encoded to AAC.
 
     Args:
         delete_mp4: Boolean, if True, delete the original MP4 file after successful conversion (default: True).
+        m4a_quality: AAC bitrate used when the audio has to be re-encoded (default: DEFAULT_M4A_QUALITY).
+        use_index: Boolean, if True, skip MP4s already converted and unchanged since, and MP4s
+                   the WEBM converter is still writing (see file_index.FileIndex).
+        min_free_bytes: Conversions wait to start while the disk has less free space (default: see
+                        workspace.default_min_free_bytes).
     """
+    from tqdm import tqdm
 
     mp4_files_processed = 0
     m4a_files_converted = 0
+    remove_partial_files('.') # M4As left half-written by an interrupted run
+    index = FileIndex('.') if use_index else None
+    if index:
+        mp4_filepaths = index.pending('mp4_to_m4a', ['.mp4'])
+    else:
+        mp4_filepaths = [filename for filename in os.listdir('.')
+                         if filename.lower().endswith('.mp4') and not filename.startswith('.')]
+
+    for mp4_filepath in mp4_filepaths:
+        m4a_filepath = os.path.splitext(mp4_filepath)[0] + '.m4a' # Change extension to .m4a
+        print(f"Processing MP4 file: {mp4_filepath}")
+        mp4_files_processed += 1
+
+        try:
+            wait_for_free_space(['.'], min_free_bytes)
+            with tqdm(total=1, unit="file", desc=f"Converting to M4A: {mp4_filepath}", leave=False) as pbar:
+                with index.claim(m4a_filepath, 'mp4_to_m4a') if index else contextlib.nullcontext():
+                    mode = transcode_audio(mp4_filepath, m4a_filepath, bitrate=m4a_quality) # Audio-only, copy when AAC
+                pbar.update(1)
+            print(f"  Converted to M4A ({'remuxed' if mode == 'copy' else 're-encoded'}): {m4a_filepath}")
+            m4a_files_converted += 1
+            if index:
+                index.mark(mp4_filepath, 'mp4_to_m4a', output_path=m4a_filepath)
+
+            if delete_mp4:
+                os.remove(mp4_filepath)
+                print(f"  Deleted original MP4 file: {mp4_filepath}")
 
-    for filename in os.listdir('.'):
-        if filename.lower().endswith('.mp4'):
-            mp4_filepath = filename
-            m4a_filepath = os.path.splitext(mp4_filepath)[0] + '.m4a' # Change extension to .m4a
-            print(f"Processing MP4 file: {mp4_filepath}")
-            mp4_files_processed += 1
-
-            try:
-                with tqdm(total=1, unit="file", desc=f"Converting to M4A: {mp4_filepath}", leave=False) as pbar:
-                    video_clip = VideoFileClip(mp4_filepath) # Load MP4 video clip
-                    audio_clip = video_clip.audio # Extract audio clip
-                    audio_clip.write_audiofile(m4a_filepath, codec='aac') # Write audio as M4A (AAC codec)
-                    video_clip.close() # Close video clip to release resources
-                    audio_clip.close() # Close audio clip to release resources
-                    pbar.update(1)
-                print(f"  Converted to M4A: {m4a_filepath}")
-                m4a_files_converted += 1
-
-                if delete_mp4:
-                    os.remove(mp4_filepath)
-                    print(f"  Deleted original MP4 file: {mp4_filepath}")
-
-            except Exception as e:
-                print(f"  Error converting {mp4_filepath} to M4A: {e}")
-                print(f"  Error details: {e}")
+        except subprocess.CalledProcessError as e:
+            if index:
+                index.mark(mp4_filepath, 'mp4_to_m4a', state='failed', error=instrumentation.failure_reason(e))
+            print(f"  Error converting {mp4_filepath} to M4A: ffmpeg command failed.")
+            print(f"  Error details: {e.stderr}")
+
+        except Exception as e:
+            print(f"  Error converting {mp4_filepath} to M4A: {e}")
+            print(f"  Error details: {e}")
+
+    if index:
+        index.close()
 
     print(f"\nMP4 to M4A conversion process completed.")
-    print(f"Total MP4 files found: {mp4_files_processed}")
+    print(f"Total MP4 files found: {mp4_files_processed}" + (" (new or changed)" if index else ""))
     print(f"Successfully converted to M4A: {m4a_files_converted}")
 
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    use_index = not pop_flag(args, "--full-scan") # Reconvert every MP4, ignoring the file index
+    answered_yes = pop_flag(args, "--yes")
+    no_delete = pop_flag(args, "--no-delete")
+
     print("MP4 to M4A Batch Converter")
-    delete_original = input("Delete original MP4 files after conversion? (yes/no, default: yes): ").strip().lower()
-    delete_mp4_files = True if delete_original in ['yes', 'y', ''] else False
+    if answered_yes or no_delete:
+        delete_mp4_files = not no_delete
+    else:
+        delete_original = input("Delete original MP4 files after conversion? (yes/no, default: yes): ").strip().lower()
+        delete_mp4_files = True if delete_original in ['yes', 'y', ''] else False
 
-    batch_convert_mp4_to_m4a(delete_mp4_files)
+    batch_convert_mp4_to_m4a(delete_mp4_files, use_index=use_index)
     print("\nScript finished.")
\ No newline at end of file
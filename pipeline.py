@@ -0,0 +1,222 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+import instrumentation
+from download_manifest import DownloadManifest, MANIFEST_FILENAME
+from download_scheduler import (DownloadScheduler, DEAD_LETTER_FILENAME, DEFAULT_REQUESTS_PER_SECOND, DEFAULT_RETRIES,
+                                parse_rate)
+from extract_link import stream_playlist_links
+from library_store import LibraryStore
+from metadata_cache import MetadataCache
+from mp3_metadata_editor import load_artwork
+from video_downloader_mp3 import (DEFAULT_DOWNLOAD_WORKERS, DEFAULT_MP3_QUALITY, DEFAULT_TRANSCODE_WORKERS,
+                                  OUTPUT_PROFILES, download_videos, parse_profiles)
+from workspace import MIN_FREE_ENV, SCRATCH_ENV, Workspace, parse_size
+
+_DONE = object() # Sentinel closing a stage queue
+
+
+def _iter_queue(work_queue):
+    """Yields items from a stage queue until the producer puts _DONE."""
+    while True:
+        item = work_queue.get()
+        if item is _DONE:
+            return
+        yield item
+
+
+def run_pipeline(video_urls=(), playlist_urls=(), links_file=None, download_directory=".",
+                 mp3_quality=DEFAULT_MP3_QUALITY, download_workers=DEFAULT_DOWNLOAD_WORKERS,
+                 transcode_workers=DEFAULT_TRANSCODE_WORKERS,
+                 use_manifest=True, use_metadata_cache=True, streaming=False, embed_metadata=True,
+                 extra_tags=None, artwork_filename=None, max_artwork_size=None, save_links_file="video_links.txt",
+                 bandwidth_limit=None, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, retries=DEFAULT_RETRIES,
+                 library_path=None, output_profiles=(), scratch_root=None, min_free_bytes=None, replaygain=False):
+    """
+    Runs listing, download, MP3 conversion and tagging in one process.
+
+    The stages are connected by queues: a listing thread feeds video URLs to the
+    download pool while playlist pages are still loading, and each finished download
+    goes straight to the transcode pool (see video_downloader_mp3.download_videos).
+    Per-track tags and the cover (the artwork file if given, else the thumbnail) are
+    written by the encode itself, so there is no separate tagging pass.
+
+    Args:
+        video_urls: Video URLs to download.
+        playlist_urls: Playlist URLs to list (concurrently) and download.
+        links_file: Optional file of video URLs (one per line) to download.
+        download_directory: The directory to save MP3 files to.
+        save_links_file: The file playlist listings are saved to (see extract_link).
+        artwork_filename: Optional cover image embedded in every MP3 instead of its thumbnail.
+        max_artwork_size: Optional longest artwork side in pixels (see mp3_metadata_editor.load_artwork).
+        bandwidth_limit, requests_per_second, retries: See download_scheduler.DownloadScheduler.
+                         URLs that still fail are saved to failed_links.txt in the download directory.
+        library_path: Optional library directory; each track is then downloaded and encoded
+                      once into it and linked into the download directory (see library_store).
+        output_profiles: Optional video_downloader_mp3.OUTPUT_PROFILES names encoded next to
+                         each MP3 by the same ffmpeg run.
+        scratch_root, min_free_bytes: See workspace.Workspace. Downloads are staged in the
+                         scratch directory and new ones wait while free space is low.
+        replaygain: Boolean, if True, each encode also measures loudness and the files get
+                    ReplayGain tags (see loudness.py).
+        Remaining arguments: see video_downloader_mp3.download_videos.
+
+    Returns:
+        A dict with the lists of 'converted' MP3 paths, 'skipped' and 'failed' URLs and
+        the 'dead_letters' left for a later run.
+    """
+    started = time.perf_counter()
+    os.makedirs(download_directory, exist_ok=True)
+    manifest = DownloadManifest(os.path.join(download_directory, MANIFEST_FILENAME)) if use_manifest else None
+    metadata_cache = MetadataCache() if use_metadata_cache else None
+    artwork = load_artwork(artwork_filename, max_artwork_size) if artwork_filename else None
+    scheduler = DownloadScheduler(bandwidth_limit, requests_per_second, retries,
+                                  dead_letter_path=os.path.join(download_directory, DEAD_LETTER_FILENAME))
+    workspace = Workspace(download_directory, scratch_root, min_free_bytes)
+    artwork_filepath = None
+    if artwork: # Written once (downscaled if asked) for every encode to embed
+        artwork_data, mime_type = artwork
+        artwork_filepath = os.path.join(workspace.scratch_directory,
+                                        ".artwork.png" if mime_type == 'image/png' else ".artwork.jpg")
+        with open(artwork_filepath, 'wb') as f:
+            f.write(artwork_data)
+
+    url_queue = queue.Queue(maxsize=1000)
+
+    def list_stage():
+        try:
+            for video_url in video_urls:
+                url_queue.put(video_url)
+            if links_file:
+                with open(links_file, 'r') as f:
+                    links = [line.strip() for line in f if line.strip()] # The dead-letter file is rewritten during the run
+                for video_url in links:
+                    url_queue.put(video_url)
+            if playlist_urls:
+                for video_url in stream_playlist_links(list(playlist_urls), save_links_file, manifest=manifest):
+                    url_queue.put(video_url)
+        except Exception as e:
+            print(f"Error listing videos: {e}")
+        finally:
+            url_queue.put(_DONE)
+
+    list_thread = threading.Thread(target=list_stage, name="list", daemon=True)
+    list_thread.start()
+
+    try:
+        results = download_videos(_iter_queue(url_queue), download_directory, mp3_quality,
+                                  download_workers=download_workers, transcode_workers=transcode_workers,
+                                  manifest=manifest, streaming=streaming, metadata_cache=metadata_cache,
+                                  embed_metadata=embed_metadata, extra_tags=extra_tags,
+                                  scheduler=scheduler, library=LibraryStore(library_path) if library_path else None,
+                                  output_profiles=output_profiles, workspace=workspace, replaygain=replaygain,
+                                  artwork_filepath=artwork_filepath)
+    finally:
+        if manifest:
+            manifest.close()
+        if metadata_cache:
+            metadata_cache.close()
+        workspace.close()
+
+    results['dead_letters'] = scheduler.dead_letters
+    instrumentation.emit('pipeline_finished', duration_s=round(time.perf_counter() - started, 3),
+                         converted=len(results['converted']), skipped=len(results['skipped']),
+                         failed=len(results['failed']))
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Download YouTube videos/playlists as tagged MP3s in one unattended run.")
+    parser.add_argument("video_urls", nargs="*", metavar="VIDEO_URL", help="video URLs to download")
+    parser.add_argument("-p", "--playlist", action="append", default=[], metavar="URL", dest="playlist_urls",
+                        help="playlist URL to list and download (repeatable)")
+    parser.add_argument("-f", "--links-file", metavar="FILE",
+                        help="file of video URLs, one per line (default: video_links.txt if no URL is given)")
+    parser.add_argument("-o", "--output", default=".", metavar="DIR", dest="download_directory",
+                        help="download directory (default: current directory)")
+    parser.add_argument("-q", "--quality", default=DEFAULT_MP3_QUALITY, dest="mp3_quality",
+                        help=f"MP3 bitrate (default: {DEFAULT_MP3_QUALITY})")
+    parser.add_argument("--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS,
+                        help=f"concurrent downloads (default: {DEFAULT_DOWNLOAD_WORKERS})")
+    parser.add_argument("--transcode-workers", type=int, default=DEFAULT_TRANSCODE_WORKERS,
+                        help=f"concurrent MP3 encodes (default: {DEFAULT_TRANSCODE_WORKERS})")
+    parser.add_argument("--stream", action="store_true", dest="streaming",
+                        help="pipe downloads straight into the encoder (no intermediate file)")
+    parser.add_argument("--no-manifest", action="store_false", dest="use_manifest",
+                        help="re-download everything instead of resuming")
+    parser.add_argument("--no-metadata-cache", action="store_false", dest="use_metadata_cache",
+                        help="always extract video info again")
+    parser.add_argument("--no-tags", action="store_false", dest="embed_metadata",
+                        help="do not write per-track tags and thumbnails")
+    for name in ('artist', 'album', 'genre'):
+        parser.add_argument(f"--{name}", help=f"{name} tag for every track (overrides the video's own)")
+    parser.add_argument("--artwork", metavar="IMAGE", dest="artwork_filename",
+                        help="cover image for every track instead of its thumbnail")
+    parser.add_argument("--artwork-size", type=int, metavar="PIXELS", dest="max_artwork_size",
+                        help="downscale the artwork to this longest side")
+    parser.add_argument("--limit-rate", type=parse_rate, metavar="RATE", dest="bandwidth_limit",
+                        help="bandwidth shared by all downloads, e.g. 500K or 2M (default: unlimited)")
+    parser.add_argument("--requests-per-second", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help=f"requests started per second against one host (default: {DEFAULT_REQUESTS_PER_SECOND:g})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"extra attempts for transient download failures (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help=f"download only the links earlier runs saved to {DEAD_LETTER_FILENAME} in the output directory")
+    parser.add_argument("--library", metavar="DIR", dest="library_path",
+                        help="keep each track once in DIR and link it into the output directory "
+                             "(same filesystem for hardlinks)")
+    parser.add_argument("--profiles", type=parse_profiles, default=[], metavar="NAME[,NAME...]",
+                        dest="output_profiles",
+                        help=f"also encode these versions of each track from the same decode ({', '.join(OUTPUT_PROFILES)})")
+    parser.add_argument("--replaygain", action="store_true",
+                        help="measure each track's loudness during its encode and write ReplayGain tags")
+    parser.add_argument("--scratch-dir", metavar="DIR", dest="scratch_root",
+                        help=f"stage downloads under DIR (default: ${SCRATCH_ENV}, else /dev/shm when it has room, "
+                             "else .scratch in the output directory)")
+    parser.add_argument("--min-free", type=parse_size, metavar="SIZE", dest="min_free_bytes",
+                        help=f"pause new downloads while the disk has less than SIZE free, e.g. 5G "
+                             f"(default: ${MIN_FREE_ENV} or 256M)")
+    parser.add_argument("--events", metavar="FILE", dest="events_file",
+                        help=f"append structured JSON-lines stage events to FILE (default: ${instrumentation.EVENTS_ENV})")
+    parser.add_argument("--metrics", metavar="FILE", dest="metrics_file",
+                        help=f"write Prometheus text metrics to FILE at exit (default: ${instrumentation.METRICS_ENV})")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics over HTTP on PORT while running")
+    return parser
+
+
+def main(argv=None):
+    """Command-line entry point; returns a process exit status."""
+    options = vars(build_parser().parse_args(argv))
+    instrumentation.configure(options.pop('events_file'), options.pop('metrics_file'))
+    metrics_port = options.pop('metrics_port')
+    if metrics_port:
+        instrumentation.serve_metrics(metrics_port)
+    options['extra_tags'] = {}
+    for name in ('artist', 'album', 'genre'):
+        value = options.pop(name)
+        if value is not None:
+            options['extra_tags'][name] = value
+    if options.pop('retry_failed'):
+        options['links_file'] = os.path.join(options['download_directory'], DEAD_LETTER_FILENAME)
+        if not os.path.exists(options['links_file']):
+            print(f"No failed links to retry ('{options['links_file']}' does not exist).")
+            return 0
+    if not (options['video_urls'] or options['playlist_urls'] or options['links_file']):
+        options['links_file'] = "video_links.txt"
+
+    results = run_pipeline(**options)
+    print(f"\nPipeline complete! Converted: {len(results['converted'])}, already done: {len(results['skipped'])}, "
+          f"failed: {len(results['failed'])}")
+    if results['dead_letters']:
+        print(f"{len(results['dead_letters'])} failed links saved to "
+              f"'{os.path.join(options['download_directory'], DEAD_LETTER_FILENAME)}'; rerun with --retry-failed.")
+    return 1 if results['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,58 @@
+import os
+import pytest
+from download_manifest import DownloadManifest, file_checksum, video_id_from_url
+
+# Resume points of the per-directory download manifest.
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    with DownloadManifest(str(tmp_path / "manifest.sqlite")) as manifest:
+        yield manifest
+
+
+def test_video_id_from_url():
+    assert video_id_from_url("https://www.youtube.com/watch?v=abc&list=x") == "abc"
+    assert video_id_from_url("https://youtu.be/abc?t=5") == "abc"
+    assert video_id_from_url("https://www.youtube.com/shorts/abc") == "abc"
+    assert video_id_from_url(" https://example.com/video ") == "https://example.com/video"
+
+
+def test_stage_never_moves_back_through_mark(manifest):
+    manifest.mark("abc", "https://youtu.be/abc", 'tagged')
+    manifest.mark("abc", "https://youtu.be/abc", 'downloaded', title="Song")
+    assert manifest.get("abc")['stage'] == 'tagged'
+    assert manifest.get("abc")['title'] == "Song"
+    assert manifest.stage_counts() == {'listed': 0, 'downloaded': 0, 'transcoded': 0, 'tagged': 1}
+
+
+def test_mark_rejects_unknown_stages_and_fields(manifest):
+    with pytest.raises(ValueError):
+        manifest.mark("abc", "https://youtu.be/abc", 'uploaded')
+    with pytest.raises(ValueError):
+        manifest.mark("abc", "https://youtu.be/abc", 'listed', colour="red")
+
+
+def test_resume_points(manifest, tmp_path):
+    assert manifest.resume_point("abc") == 'download'
+
+    source_path = tmp_path / "song.webm"
+    source_path.write_text("source")
+    manifest.mark("abc", "https://youtu.be/abc", 'downloaded', source_path=str(source_path))
+    assert manifest.resume_point("abc") == 'transcode'
+
+    output_path = tmp_path / "song.mp3"
+    output_path.write_text("encoded")
+    manifest.mark("abc", "https://youtu.be/abc", 'tagged', source_path=None, output_path=str(output_path),
+                  size=os.path.getsize(output_path), checksum=file_checksum(str(output_path)))
+    assert manifest.resume_point("abc") == 'done'
+
+    output_path.write_text("edited elsewhere") # Size changed: encode again
+    assert manifest.resume_point("abc") == 'download'
+    assert manifest.get("abc")['stage'] == 'listed'
+
+
+def test_missing_source_means_downloading_again(manifest, tmp_path):
+    manifest.mark("abc", "https://youtu.be/abc", 'downloaded', source_path=str(tmp_path / "gone.webm"))
+    assert manifest.resume_point("abc") == 'download'
+    assert manifest.get("abc")['stage'] == 'listed'
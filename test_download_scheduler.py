@@ -0,0 +1,78 @@
+import time
+import urllib.error
+import pytest
+from download_scheduler import DownloadScheduler, TokenBucket, is_retryable, parse_rate
+
+# Bandwidth budget, per-host request rate, retries and dead letters of the download scheduler.
+
+
+def test_parse_rate():
+    assert parse_rate('2M') == 2 * 1024 ** 2
+    assert parse_rate('500KB/s') == 500 * 1024
+    assert parse_rate('100') == 100
+    assert parse_rate(None) is None
+
+
+def test_is_retryable():
+    assert is_retryable(urllib.error.HTTPError('https://x', 429, 'Too Many Requests', {}, None))
+    assert not is_retryable(urllib.error.HTTPError('https://x', 404, 'Not Found', {}, None))
+    assert is_retryable(ConnectionResetError())
+    assert not is_retryable(RuntimeError("ERROR: Private video"))
+    assert not is_retryable(ValueError("bad"))
+
+
+def test_token_bucket_spaces_out_acquisitions():
+    bucket = TokenBucket(rate=100, capacity=1)
+    assert bucket.acquire() == 0
+    start = time.monotonic()
+    bucket.acquire(5) # 5 tokens short at 100 per second
+    assert time.monotonic() - start >= 0.04
+
+
+def test_backoff_honours_retry_after():
+    scheduler = DownloadScheduler(backoff_base=1, backoff_max=10)
+    error = urllib.error.HTTPError('https://x', 429, 'Too Many Requests', {'Retry-After': '3'}, None)
+    assert scheduler.backoff_delay(0, error) == 3
+    assert 0 <= scheduler.backoff_delay(5) <= 10
+
+
+def test_call_does_not_retry_permanent_errors():
+    scheduler = DownloadScheduler(retries=3)
+    calls = []
+
+    def download():
+        calls.append(1)
+        raise RuntimeError("ERROR: Video unavailable")
+
+    with pytest.raises(RuntimeError):
+        scheduler.call('https://youtu.be/abc', download)
+    assert len(calls) == 1
+
+
+def test_call_retries_transient_errors():
+    pytest.importorskip('tqdm') # Retries are reported through tqdm.write
+    scheduler = DownloadScheduler(retries=2, backoff_base=0.001)
+    outcomes = [ConnectionResetError(), ConnectionResetError(), 'done']
+
+    def download():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert scheduler.call('https://youtu.be/abc', download) == 'done'
+
+
+def test_dead_letters_persist_until_cleared(tmp_path):
+    dead_letter_path = tmp_path / "failed_links.txt"
+    scheduler = DownloadScheduler(dead_letter_path=str(dead_letter_path))
+    scheduler.record_failure('https://youtu.be/a')
+    scheduler.record_failure('https://youtu.be/b')
+    scheduler.record_failure('https://youtu.be/a')
+    assert dead_letter_path.read_text() == "https://youtu.be/a\nhttps://youtu.be/b\n"
+
+    scheduler = DownloadScheduler(dead_letter_path=str(dead_letter_path))
+    assert scheduler.dead_letters == ['https://youtu.be/a', 'https://youtu.be/b']
+    scheduler.clear_failure('https://youtu.be/a')
+    scheduler.clear_failure('https://youtu.be/b')
+    assert not dead_letter_path.exists()
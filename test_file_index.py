@@ -0,0 +1,73 @@
+import os
+import pytest
+from file_index import FileIndex, scan_files
+
+# Incremental batch scans: which files each stage still has to process.
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name in ("a.webm", "b.webm", "notes.txt", ".c.partial.webm"):
+        (tmp_path / name).write_text(name)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "d.webm").write_text("d")
+    return tmp_path
+
+
+def test_scan_files_skips_hidden_files_and_other_extensions(directory):
+    paths = [os.path.relpath(path, directory) for path, _, _ in scan_files(str(directory), ['.webm'])]
+    assert paths == ["a.webm", "b.webm"]
+    paths = [os.path.relpath(path, directory) for path, _, _ in scan_files(str(directory), ['.WEBM'], recursive=True)]
+    assert paths == ["a.webm", "b.webm", os.path.join("sub", "d.webm")]
+
+
+def test_pending_skips_unchanged_files(directory):
+    with FileIndex(str(directory)) as index:
+        a, b = index.pending('convert', ['.webm'])
+        index.mark(a, 'convert')
+        assert index.pending('convert', ['.webm']) == [b]
+        assert index.pending('other_stage', ['.webm']) == [a, b]
+
+        with open(a, 'a') as f:
+            f.write("changed")
+        assert index.pending('convert', ['.webm']) == [a, b]
+
+
+def test_pending_with_other_settings_or_a_missing_output(directory):
+    with FileIndex(str(directory)) as index:
+        a = str(directory / "a.webm")
+        output_path = directory / "a.mp4"
+        output_path.write_text("output")
+        index.mark(a, 'convert', settings='crf=23', output_path=str(output_path))
+        assert a not in index.pending('convert', ['.webm'], settings='crf=23')
+        assert a in index.pending('convert', ['.webm'], settings='crf=18')
+        output_path.unlink()
+        assert a in index.pending('convert', ['.webm'], settings='crf=23')
+
+
+def test_claimed_outputs_are_not_pending(directory):
+    with FileIndex(str(directory)) as index:
+        b = str(directory / "b.webm")
+        with index.claim(b, 'download'):
+            assert b not in index.pending('convert', ['.webm'])
+        assert b in index.pending('convert', ['.webm'])
+
+
+def test_results_are_kept_per_stage(directory):
+    with FileIndex(str(directory)) as index:
+        a = str(directory / "a.webm")
+        index.mark(a, 'loudness', result='{"integrated_lufs": -14.0}')
+        index.mark(str(directory / "b.webm"), 'loudness', state='failed', error="boom")
+        assert index.results('loudness') == {os.path.normpath(a): '{"integrated_lufs": -14.0}'}
+
+    with FileIndex(str(directory)) as index: # Reopened from disk
+        assert index.stage_counts() == {'loudness': {'done': 1, 'failed': 1}}
+
+
+def test_records_of_deleted_files_are_dropped(directory):
+    with FileIndex(str(directory)) as index:
+        a = str(directory / "a.webm")
+        index.mark(a, 'convert')
+        os.remove(a)
+        index.pending('convert', ['.webm'])
+        assert index.stage_counts() == {}
@@ -0,0 +1,48 @@
+import os
+import re
+import subprocess
+import sys
+
+# Cold-start check: importing an entry point must not load the heavy dependencies (they are
+# imported inside the functions that use them) and must stay within the time budget.
+# Run it directly (python test_import_time.py) or with pytest.
+
+IMPORT_BUDGET_MS = 300 # Cumulative `-X importtime` of each module, standard library included
+HEAVY_MODULES = ('yt_dlp', 'pytube', 'mutagen', 'tqdm', 'PIL')
+ENTRY_MODULES = ('main', 'pipeline', 'video_downloader_mp3', 'job_queue', 'mp3_metadata_editor',
+                 'webm_to_mp4_converter', 'mp4_to_m4a_converter', 'extract_link', 'download_manifest',
+                 'file_index', 'library_store', 'download_scheduler', 'metadata_cache', 'instrumentation',
+                 'workspace', 'loudness', 'benchmark', 'cli_options')
+
+
+def measure_import(module_name):
+    """Imports a module in a fresh interpreter; returns (milliseconds, heavy modules it loaded)."""
+    code = f"import sys, {module_name}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    match = re.search(rf"^import time:\s*\d+ \|\s*(\d+) \| {module_name}$", result.stderr, re.MULTILINE)
+    return int(match.group(1)) / 1000, [name for name in result.stdout.strip().split(',') if name]
+
+
+def test_import_time_budget():
+    for module_name in ENTRY_MODULES:
+        milliseconds, heavy_modules = measure_import(module_name)
+        assert not heavy_modules, f"importing {module_name} loads {', '.join(heavy_modules)}"
+        assert milliseconds <= IMPORT_BUDGET_MS, \
+            f"importing {module_name} takes {milliseconds:.0f} ms (budget: {IMPORT_BUDGET_MS} ms)"
+
+
+if __name__ == "__main__":
+    failed = False
+    for module_name in ENTRY_MODULES:
+        milliseconds, heavy_modules = measure_import(module_name)
+        problems = []
+        if heavy_modules:
+            problems.append(f"loads {', '.join(heavy_modules)}")
+        if milliseconds > IMPORT_BUDGET_MS:
+            problems.append(f"over the {IMPORT_BUDGET_MS} ms budget")
+        failed = failed or bool(problems)
+        print(f"{module_name:<24}{milliseconds:>8.1f} ms  {'; '.join(problems) or 'OK'}")
+
+    print("\n--- End of Import Time Test ---")
+    sys.exit(1 if failed else 0)
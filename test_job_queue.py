@@ -0,0 +1,122 @@
+import time
+import pytest
+import job_queue
+from job_queue import JobQueue, enqueue_pipeline, run_job
+
+# Leases, retries, dead-lettering and deduplication of the shared job queue.
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with JobQueue(str(tmp_path / "queue.sqlite")) as queue:
+        yield queue
+
+
+def test_claim_leases_a_job_to_one_worker(queue):
+    job_id = queue.enqueue('tag', {'path': 'song.mp3'})
+    job = queue.claim('w1')
+    assert (job['id'], job['payload'], job['attempts']) == (job_id, {'path': 'song.mp3'}, 1)
+    assert queue.claim('w2') is None
+    assert queue.heartbeat(job_id, 'w1')
+    assert not queue.heartbeat(job_id, 'w2')
+    assert not queue.complete(job_id, 'w2')
+    assert queue.complete(job_id, 'w1', {'result': 'updated'})
+    assert queue.counts()['tag'] == {'done': 1}
+
+
+def test_claim_only_takes_the_requested_kinds(queue):
+    queue.enqueue('download', {'url': 'https://youtu.be/a'})
+    assert queue.claim('w1', kinds=('transcode',)) is None
+    assert queue.claim('w1', kinds=('download', 'transcode'))['kind'] == 'download'
+
+
+def test_expired_lease_is_handed_out_again(queue):
+    job_id = queue.enqueue('tag', {'path': 'song.mp3'})
+    queue.claim('crashed', lease_seconds=0.01)
+    time.sleep(0.05)
+    job = queue.claim('w2')
+    assert (job['id'], job['attempts']) == (job_id, 2)
+    assert not queue.complete(job_id, 'crashed')
+
+
+def test_failed_job_is_retried_after_a_delay_then_dead_lettered(queue):
+    job_id = queue.enqueue('tag', {'path': 'song.mp3'}, max_attempts=2)
+    job = queue.claim('w1')
+    assert queue.fail(job['id'], 'w1', "boom") == 'queued'
+    assert queue.claim('w1') is None # Waiting for its retry delay
+
+    with queue._transaction() as conn: # Skip the delay
+        conn.execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+    job = queue.claim('w1')
+    assert job['attempts'] == 2
+    assert queue.fail(job['id'], 'w1', "boom again") == 'failed'
+    assert queue.failures() == [('tag', {'path': 'song.mp3'}, "boom again")]
+
+    assert queue.retry_failed() == 1
+    assert queue.claim('w1')['attempts'] == 1
+
+
+def test_lease_expiry_counts_as_an_attempt(queue):
+    queue.enqueue('tag', {'path': 'song.mp3'}, max_attempts=1)
+    queue.claim('crashed', lease_seconds=0.01)
+    time.sleep(0.05)
+    assert queue.requeue_expired() == 1
+    assert queue.counts()['tag'] == {'failed': 1}
+
+
+def test_release_does_not_count_the_run(queue):
+    job_id = queue.enqueue('tag', {'path': 'song.mp3'})
+    queue.release(queue.claim('w1')['id'], 'w1')
+    job = queue.claim('w2')
+    assert (job['id'], job['attempts']) == (job_id, 1)
+
+
+def test_dedup_only_against_pending_jobs(queue):
+    job_id = queue.enqueue('list', {'playlist_url': 'p'}, key='list:p')
+    assert queue.enqueue('list', {'playlist_url': 'p'}, key='list:p') is None
+    queue.claim('w1')
+    assert queue.enqueue('list', {'playlist_url': 'p'}, key='list:p') is None
+    queue.complete(job_id, 'w1')
+    assert queue.enqueue('list', {'playlist_url': 'p'}, key='list:p') is not None # Listed again later
+
+    download_id = queue.enqueue('download', {'url': 'a'}, key='download:a', skip_done=True)
+    queue.claim('w1', kinds=('download',))
+    queue.complete(download_id, 'w1')
+    assert queue.enqueue('download', {'url': 'a'}, key='download:a', skip_done=True) is None
+
+
+def test_enqueue_pipeline_keys_videos_by_id(queue, tmp_path):
+    urls = ['https://www.youtube.com/watch?v=abc', 'https://youtu.be/abc', 'https://youtu.be/def']
+    assert enqueue_pipeline(queue, urls, download_directory=str(tmp_path)) == 2
+    assert enqueue_pipeline(queue, [], ['https://www.youtube.com/playlist?list=x'], str(tmp_path)) == 1
+
+
+def test_transcode_source_is_deleted_only_once_the_job_is_done(queue, tmp_path, monkeypatch):
+    source_path = tmp_path / "song.webm"
+    source_path.write_text("source")
+    monkeypatch.setitem(job_queue.HANDLERS, 'transcode', lambda payload, queue: {'output_path': str(tmp_path / "song.mp3")})
+    queue.enqueue('transcode', {'source_path': str(source_path)})
+
+    job = queue.claim('w1', lease_seconds=0.01)
+    time.sleep(0.05)
+    queue.claim('w2') # Took the job over: the first worker's run no longer counts
+    assert run_job(queue, job, 'w1')
+    assert source_path.exists()
+
+    queue.release(job['id'], 'w2')
+    assert run_job(queue, queue.claim('w3'), 'w3')
+    assert not source_path.exists()
+
+
+def test_failed_run_keeps_the_source(queue, tmp_path, monkeypatch):
+    source_path = tmp_path / "song.webm"
+    source_path.write_text("source")
+
+    def crash(payload, queue):
+        raise RuntimeError("ffmpeg died")
+
+    monkeypatch.setitem(job_queue.HANDLERS, 'transcode', crash)
+    queue.enqueue('transcode', {'source_path': str(source_path)})
+    assert not run_job(queue, queue.claim('w1'), 'w1')
+    assert source_path.exists()
+    assert queue.counts()['transcode'] == {'queued': 1}
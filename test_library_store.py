@@ -0,0 +1,77 @@
+import os
+from library_store import LibraryStore, format_hash, unshare_file
+
+# Content-addressed track library and the links placed into playlist directories.
+
+VIDEO_INFO = {'id': 'abc', 'format_id': '251', 'ext': 'webm', 'acodec': 'opus', 'abr': 160}
+
+
+def make_track(directory, name="abc.mp3", data=b"encoded audio"):
+    filepath = os.path.join(directory, name)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    return filepath
+
+
+def test_format_hash_covers_source_and_settings():
+    key = format_hash(VIDEO_INFO, codec='mp3', bitrate='320k', tags={'track': '1/2'})
+    assert key == format_hash(dict(VIDEO_INFO, title="ignored"), codec='mp3', bitrate='320k', tags={'track': '1/2'})
+    assert key != format_hash(dict(VIDEO_INFO, format_id='140'), codec='mp3', bitrate='320k', tags={'track': '1/2'})
+    assert key != format_hash(VIDEO_INFO, codec='mp3', bitrate='320k', tags={'track': '2/2'})
+
+
+def test_add_lookup_and_place(tmp_path):
+    library = LibraryStore(str(tmp_path / "library"))
+    entry_hash = format_hash(VIDEO_INFO)
+    assert library.lookup('abc', entry_hash) is None
+
+    entry_path = library.add(make_track(library.staging_directory), 'abc', entry_hash)
+    assert library.lookup('abc', entry_hash) == entry_path
+    assert list(library.entries()) == [('abc', entry_path)]
+    assert os.listdir(os.path.join(library.library_path, 'abc')) == [entry_hash + '.mp3']
+
+    playlist = str(tmp_path / "playlist")
+    destination_path, method = library.place(entry_path, playlist, "Song.mp3", 'abc')
+    assert (destination_path, method) == (os.path.join(playlist, "Song.mp3"), 'hardlink')
+    assert library.place(entry_path, playlist, "Song.mp3", 'abc') == (destination_path, 'existing')
+
+    make_track(playlist, "Other.mp3")
+    destination_path, _ = library.place(entry_path, playlist, "Other.mp3", 'abc')
+    assert destination_path == os.path.join(playlist, "Other [abc].mp3")
+
+
+def test_add_of_an_entry_stored_by_another_run(tmp_path):
+    library = LibraryStore(str(tmp_path / "library"))
+    entry_hash = format_hash(VIDEO_INFO)
+    entry_path = library.add(make_track(library.staging_directory, data=b"first"), 'abc', entry_hash)
+    staged_path = make_track(library.staging_directory, data=b"second")
+    assert library.add(staged_path, 'abc', entry_hash) == entry_path
+    assert not os.path.exists(staged_path)
+    with open(entry_path, 'rb') as f:
+        assert f.read() == b"first"
+
+
+def test_unshare_file_protects_the_library_and_other_playlists(tmp_path):
+    library = LibraryStore(str(tmp_path / "library"))
+    entry_path = library.add(make_track(library.staging_directory), 'abc', format_hash(VIDEO_INFO))
+    first, _ = library.place(entry_path, str(tmp_path / "first"), "Song.mp3", 'abc')
+    second, _ = library.place(entry_path, str(tmp_path / "second"), "Song.mp3", 'abc')
+
+    assert unshare_file(first)
+    assert not unshare_file(first) # Already private
+    with open(first, 'ab') as f:
+        f.write(b" with new tags")
+    for path in (entry_path, second):
+        with open(path, 'rb') as f:
+            assert f.read() == b"encoded audio"
+    assert os.listdir(tmp_path / "first") == ["Song.mp3"]
+
+
+def test_unshare_file_replaces_a_symlink_with_a_copy(tmp_path):
+    stored_path = make_track(str(tmp_path))
+    link_path = str(tmp_path / "link.mp3")
+    os.symlink(stored_path, link_path)
+    assert unshare_file(link_path)
+    assert not os.path.islink(link_path)
+    with open(link_path, 'rb') as f:
+        assert f.read() == b"encoded audio"
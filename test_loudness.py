@@ -0,0 +1,80 @@
+import pytest
+from audio_transcoder import parse_loudness
+from loudness import replaygain_measurement, replaygain_tags
+
+# ReplayGain from ffmpeg's ebur128 summary: parsing the log and the tag values' maths.
+
+# stderr of an encode with LOUDNESS_OUTPUT at -loglevel info (ffmpeg 6)
+EBUR128_LOG = """\
+Input #0, matroska,webm, from 'song.webm':
+  Duration: 00:03:12.54, start: -0.007000, bitrate: 132 kb/s
+  Stream #0:0(eng): Audio: opus, 48000 Hz, stereo, fltp (default)
+Stream mapping:
+  Stream #0:0 -> #0:0 (opus (native) -> mp3 (libmp3lame))
+  Stream #0:0 -> #1:0 (opus (native) -> pcm_s16le (native))
+Output #0, mp3, to '.song.partial.mp3':
+Output #1, null, to 'pipe:':
+[Parsed_ebur128_0 @ 0x55d5c6f2e4c0] Summary:
+
+  Integrated loudness:
+    I:         -9.4 LUFS
+    Threshold: -19.6 LUFS
+
+  Loudness range:
+    LRA:         5.2 LU
+    Threshold:  -29.7 LU
+    LRA low:   -13.1 LUFS
+    LRA high:   -7.9 LUFS
+
+  True peak:
+    Peak:        1.3 dBFS
+size=    7524kB time=00:03:12.52 bitrate= 320.1kbits/s speed=41.2x
+"""
+
+SILENT_LOG = """\
+[Parsed_ebur128_0 @ 0x5601f0a3b2c0] Summary:
+
+  Integrated loudness:
+    I:         -70.0 LUFS
+    Threshold:   0.0 LUFS
+
+  Loudness range:
+    LRA:         0.0 LU
+    Threshold:   0.0 LU
+    LRA low:     0.0 LUFS
+    LRA high:    0.0 LUFS
+
+  True peak:
+    Peak:       -inf dBFS
+"""
+
+
+def test_parse_loudness_reads_the_summary():
+    assert parse_loudness(EBUR128_LOG) == {'integrated_lufs': -9.4, 'true_peak_dbfs': 1.3}
+
+
+def test_parse_loudness_of_silence_or_no_summary():
+    assert parse_loudness(SILENT_LOG) is None
+    assert parse_loudness(SILENT_LOG.replace("-70.0 LUFS", "-inf LUFS", 1).replace("-inf dBFS", "-3.0 dBFS")) is None
+    assert parse_loudness(EBUR128_LOG.split("[Parsed_ebur128_0")[0]) is None
+    assert parse_loudness(None) is None
+
+
+def test_replaygain_tags():
+    tags = replaygain_tags(parse_loudness(EBUR128_LOG))
+    assert tags == {'replaygain_track_gain': "-8.60 dB", 'replaygain_track_peak': "1.161449"} # -18 LUFS reference
+
+
+@pytest.mark.parametrize('measurement', [
+    {'integrated_lufs': -9.4, 'true_peak_dbfs': 1.3},
+    {'integrated_lufs': -23.0, 'true_peak_dbfs': -6.02},
+    {'integrated_lufs': -40.55, 'true_peak_dbfs': -60.0},
+])
+def test_replaygain_tags_round_trip(measurement):
+    assert replaygain_measurement(replaygain_tags(measurement)) == measurement
+
+
+def test_replaygain_measurement_of_missing_or_malformed_tags():
+    assert replaygain_measurement({'replaygain_track_gain': "-8.60 dB"}) is None
+    assert replaygain_measurement({'replaygain_track_gain': "loud", 'replaygain_track_peak': "1.0"}) is None
+    assert replaygain_measurement({'replaygain_track_gain': "-8.60 dB", 'replaygain_track_peak': "0.000000"}) is None
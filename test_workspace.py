@@ -0,0 +1,117 @@
+import errno
+import os
+import socket
+import pytest
+import workspace
+from download_manifest import DownloadManifest
+from workspace import Workspace, atomic_outputs, parse_size, wait_for_free_space
+
+# Scratch space, free-space waits and leftovers of interrupted runs (see workspace.Workspace).
+
+
+def test_parse_size():
+    assert parse_size('2G') == 2 * 1024 ** 3
+    assert parse_size('500MB') == 500 * 1024 ** 2
+    assert parse_size('1024') == 1024
+    assert parse_size('') is None
+
+
+def test_min_free_zero_turns_the_check_off(monkeypatch):
+    monkeypatch.setenv(workspace.MIN_FREE_ENV, '0')
+    assert workspace.default_min_free_bytes() == 0
+    monkeypatch.delenv(workspace.MIN_FREE_ENV)
+    assert workspace.default_min_free_bytes() == workspace.DEFAULT_MIN_FREE_BYTES
+
+
+def test_atomic_outputs(tmp_path):
+    output_filepath = str(tmp_path / "song.mp3")
+    with atomic_outputs([output_filepath]) as (temporary_path,):
+        with open(temporary_path, 'w') as f:
+            f.write("audio")
+        assert not os.path.exists(output_filepath)
+    assert os.listdir(tmp_path) == ["song.mp3"]
+
+    with pytest.raises(RuntimeError):
+        with atomic_outputs([str(tmp_path / "broken.mp3")]) as (temporary_path,):
+            with open(temporary_path, 'w') as f:
+                f.write("half")
+            raise RuntimeError
+    assert os.listdir(tmp_path) == ["song.mp3"]
+
+
+def test_wait_for_free_space_resumes_and_times_out(monkeypatch):
+    free = iter([0, 0, 10 ** 12])
+    monkeypatch.setattr(workspace, 'free_bytes', lambda path: next(free))
+    assert wait_for_free_space(['.'], 100, poll_interval=0.01) == pytest.approx(0.02)
+
+    monkeypatch.setattr(workspace, 'free_bytes', lambda path: 0)
+    with pytest.raises(OSError) as error:
+        wait_for_free_space(['.'], 100, poll_interval=0.01, timeout=0.03)
+    assert error.value.errno == errno.ENOSPC
+
+
+def test_separate_scratch_has_its_own_threshold(tmp_path, monkeypatch):
+    with Workspace(str(tmp_path / "out"), str(tmp_path / "scratch"), min_free_bytes=100, max_wait=0) as space:
+        space.separate_scratch = True # As if the scratch space were a small tmpfs
+        free = {space.output_directory: 1000, space.scratch_directory: workspace.SCRATCH_MIN_FREE_BYTES}
+        monkeypatch.setattr(workspace, 'free_bytes', lambda path: free[path])
+        assert space.wait_for_space() == 0
+        free[space.scratch_directory] -= 1
+        with pytest.raises(OSError):
+            space.wait_for_space()
+
+
+def test_after_a_timeout_later_jobs_fail_without_waiting(tmp_path, monkeypatch):
+    with Workspace(str(tmp_path / "out"), str(tmp_path / "scratch"), min_free_bytes=100, max_wait=0.03) as space:
+        space.separate_scratch = False
+        free = {'bytes': 0}
+        monkeypatch.setattr(workspace, 'free_bytes', lambda path: free['bytes'])
+        sleeps = []
+        monkeypatch.setattr(workspace.time, 'sleep', sleeps.append)
+        with pytest.raises(OSError):
+            space.wait_for_space()
+        waits = len(sleeps)
+        with pytest.raises(OSError):
+            space.wait_for_space()
+        assert len(sleeps) == waits
+
+        free['bytes'] = 1000 # Space came back
+        assert space.wait_for_space() == 0
+        assert not space.out_of_space
+
+
+def test_close_keeps_unconverted_sources_for_resume(tmp_path):
+    output_directory = str(tmp_path / "out")
+    with Workspace(output_directory, str(tmp_path / "scratch")) as space:
+        source_path = os.path.join(space.scratch_directory, "song.webm")
+        for name in ("song.webm", ".thumbnail.jpg", "other.webm.part"):
+            open(os.path.join(space.scratch_directory, name), 'w').close()
+    assert os.listdir(os.path.join(output_directory, workspace.SOURCES_DIRNAME)) == ["song.webm"]
+    assert not os.path.exists(space.scratch_directory)
+
+    with DownloadManifest(os.path.join(output_directory, "manifest.sqlite")) as manifest:
+        manifest.mark("abc", "https://youtu.be/abc", 'downloaded', source_path=source_path)
+        assert manifest.resume_point("abc") == 'transcode'
+        assert manifest.get("abc")['source_path'] == os.path.join(
+            os.path.abspath(output_directory), workspace.SOURCES_DIRNAME, "song.webm")
+
+
+def test_leftovers_of_dead_processes_are_cleaned_up(tmp_path):
+    scratch_root = tmp_path / "scratch"
+    output_directory = tmp_path / "out"
+    orphan = scratch_root / f"ytdl-{socket.gethostname()}-999999999-abc"
+    orphan.mkdir(parents=True)
+    output_directory.mkdir()
+    (orphan / workspace.OWNER_FILENAME).write_text(str(output_directory / workspace.SOURCES_DIRNAME))
+    (orphan / "song.webm").write_text("source")
+    stale = output_directory / ".song.partial.mp3"
+    stale.write_text("half")
+    os.utime(stale, (0, 0))
+    fresh = output_directory / ".other.partial.mp3"
+    fresh.write_text("half")
+
+    with Workspace(str(output_directory), str(scratch_root)):
+        assert not orphan.exists()
+        assert (output_directory / workspace.SOURCES_DIRNAME / "song.webm").exists()
+        assert not stale.exists()
+        assert fresh.exists()
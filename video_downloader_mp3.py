@@ -1,101 +1,591 @@
-import yt_dlp
+import contextlib
+import copy
 import os
-from tqdm import tqdm
-from moviepy.audio.io import AudioFileClip
+import tempfile
+import threading
+import time
+import uuid
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys # Import sys module
+import instrumentation
+from audio_transcoder import transcode_audio, transcode_stream
+from cli_options import pop_flag, pop_option
+from download_manifest import DownloadManifest, MANIFEST_FILENAME, video_id_from_url, file_checksum
+from download_scheduler import (DownloadScheduler, DEAD_LETTER_FILENAME, DEFAULT_REQUESTS_PER_SECOND, DEFAULT_RETRIES,
+                                parse_rate)
+from extract_link import stream_playlist_links
+from library_store import LibraryStore, format_hash
+from loudness import record_loudness, tag_replaygain
+from metadata_cache import MetadataCache
+from mp3_metadata_editor import SUPPORTED_EXTENSIONS, load_artwork, track_tags_from_info, tag_audio_file
+from workspace import Workspace
 
 DEFAULT_MP3_QUALITY = "320k" # Set default MP3 quality here
+DEFAULT_DOWNLOAD_WORKERS = 4 # Concurrent yt-dlp downloads (network-bound stage)
+DEFAULT_TRANSCODE_WORKERS = os.cpu_count() or 1 # Concurrent MP3 encodes (CPU-bound stage)
+DEFAULT_FORMAT = 'bestaudio/best' # yt-dlp format selection for downloads
+STREAM_FORMAT = 'bestaudio[protocol^=http][ext=webm]/bestaudio[protocol^=http]/' + DEFAULT_FORMAT # Pipe-friendly single files first
+STREAM_CHUNK_SIZE = 10 * 1024 * 1024 # Bytes per HTTP range request in streaming mode
+DEFAULT_FILENAME_TEMPLATE = '%(title)s [%(id)s].%(ext)s' # yt-dlp output template: same-titled videos don't collide
+LIBRARY_FILENAME_TEMPLATE = '%(id)s.{run_id}.%(ext)s' # Staging names in the library: unique per video and run
 
-def download_video_from_url_to_mp3(video_url, download_path=".", mp3_quality=DEFAULT_MP3_QUALITY): # Use default quality
+# Extra versions that can be encoded next to each MP3 from the same decode (--profiles):
+# name -> (extension, bitrate, filename suffix).
+OUTPUT_PROFILES = {
+    'm4a': ('.m4a', '256k', ''),
+    'mobile': ('.mp3', '128k', ' (mobile)'),
+    'opus': ('.opus', '96k', ''),
+}
+
+
+def parse_profiles(value):
+    """Parses a comma-separated list of OUTPUT_PROFILES names, e.g. 'm4a,mobile'."""
+    profiles = [profile.strip() for profile in value.split(',') if profile.strip()]
+    unknown = [profile for profile in profiles if profile not in OUTPUT_PROFILES]
+    if unknown:
+        raise ValueError(f"Unknown output profiles: {', '.join(unknown)} (choose from {', '.join(OUTPUT_PROFILES)})")
+    return profiles
+
+
+def profile_outputs(mp3_filepath, output_profiles=()):
+    """Returns the (output_filepath, bitrate) pairs of the profile versions written next to an MP3."""
+    base = os.path.splitext(mp3_filepath)[0]
+    outputs = []
+    for profile in output_profiles:
+        extension, bitrate, suffix = OUTPUT_PROFILES[profile]
+        outputs.append((base + suffix + extension, bitrate))
+    return outputs
+
+
+def output_filename(video_info, directory, output_profiles=(), reserved=None):
     """
-    Downloads a single YouTube video from a URL as an MP3 file using yt-dlp and moviepy.
-    MP3 quality is set to DEFAULT_MP3_QUALITY.
+    The name a video's MP3 is saved under in `directory`: "<title>.mp3", or
+    "<title> [<video id>].mp3" when a file (the MP3 or one of its profile versions, see
+    profile_outputs) already uses the title. That second name is only ever this video's,
+    so an older encode of it is replaced.
 
     Args:
-        video_url: The URL of the YouTube video.
-        download_path: The directory to save the MP3 file to (default is current directory).
+        reserved: Optional {file name: video id} dict of the names a batch has handed out
+                  but not written yet; the returned name is added to it. The caller holds
+                  the lock guarding it.
     """
-    ydl_opts = { # ydl_opts remains the same
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(download_path, '%(title)s.%(ext)s'),
+    import yt_dlp
+    video_id = video_info.get('id') or 'unknown'
+    title = yt_dlp.utils.sanitize_filename(video_info.get('title') or video_id)
+    filename = f"{title}.mp3"
+    mp3_filepath = os.path.join(directory, filename)
+    filepaths = [mp3_filepath] + [filepath for filepath, _ in profile_outputs(mp3_filepath, output_profiles)]
+    if (reserved or {}).get(filename, video_id) != video_id or any(os.path.exists(path) for path in filepaths):
+        filename = f"{title} [{video_id}].mp3"
+    if reserved is not None:
+        reserved[filename] = video_id
+    return filename
+
+
+def build_ydl_opts(download_path=".", format_spec=DEFAULT_FORMAT, filename_template=DEFAULT_FILENAME_TEMPLATE):
+    """Returns the yt-dlp options shared by single and batch downloads."""
+    return {
+        'format': format_spec,
+        'outtmpl': os.path.join(download_path, filename_template),
         'progress_hooks': [],
         'noplaylist': True,
         'quiet': True,
     }
 
-    def progress_hook_builder(video_title): # progress_hook_builder remains the same
-        pbar = None
-        def progress_hook(d):
-            nonlocal pbar
-            if d['status'] == 'downloading':
-                if pbar is None:
-                    pbar = tqdm(total=d['total_bytes'] or d['total_bytes_estimate'],
-                                unit='B', unit_scale=True, unit_divisor=1024,
-                                desc=f"Downloading: {video_title}", initial=d.get('downloaded_bytes', 0), leave=False)
-                else:
-                    pbar.n = d.get('downloaded_bytes', 0) or pbar.n
-                    pbar.total = d['total_bytes'] or d['total_bytes_estimate']
-                    pbar.desc = f"Downloading: {video_title}"
-                    pbar.update(d['downloaded_bytes'] - pbar.n if 'downloaded_bytes' in d else 0)
-
-            elif d['status'] == 'finished':
-                if pbar:
-                    pbar.close()
-                    print(f"Downloaded: {video_title}")
-
-            elif d['status'] == 'error':
-                if pbar:
-                    pbar.close()
-                    print(f"Error downloading: {video_title}: {d.get('error')}")
-
-        return progress_hook
 
+def progress_hook_builder(video_title, show_progress=True):
+    """
+    Builds a yt-dlp progress hook for a single download. It reports progress, speed and
+    failures as instrumentation events and, if `show_progress` is True, shows a tqdm bar.
+    """
+    from tqdm import tqdm
+    pbar = None
+    last_event = 0.0
+    def progress_hook(d):
+        nonlocal pbar, last_event
+        if d['status'] == 'downloading':
+            now = time.monotonic()
+            if now - last_event >= instrumentation.PROGRESS_EVENT_INTERVAL:
+                last_event = now
+                instrumentation.emit('download_progress', title=video_title,
+                                     downloaded_bytes=d.get('downloaded_bytes'),
+                                     total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                                     speed_bps=d.get('speed'), eta_s=d.get('eta'))
+            if not show_progress:
+                return
+            if pbar is None:
+                pbar = tqdm(total=d['total_bytes'] or d['total_bytes_estimate'],
+                            unit='B', unit_scale=True, unit_divisor=1024,
+                            desc=f"Downloading: {video_title}", initial=d.get('downloaded_bytes', 0), leave=False)
+            else:
+                pbar.n = d.get('downloaded_bytes', 0) or pbar.n
+                pbar.total = d['total_bytes'] or d['total_bytes_estimate']
+                pbar.desc = f"Downloading: {video_title}"
+                pbar.update(d['downloaded_bytes'] - pbar.n if 'downloaded_bytes' in d else 0)
+
+        elif d['status'] == 'finished':
+            downloaded_bytes = d.get('total_bytes') or d.get('downloaded_bytes')
+            elapsed = d.get('elapsed')
+            instrumentation.emit('download_finished', title=video_title, bytes=downloaded_bytes, elapsed_s=elapsed,
+                                 speed_bps=round(downloaded_bytes / elapsed) if downloaded_bytes and elapsed else None)
+            if pbar:
+                pbar.close()
+                print(f"Downloaded: {video_title}")
+
+        elif d['status'] == 'error':
+            instrumentation.emit('download_error', title=video_title, reason=str(d.get('error')))
+            if pbar:
+                pbar.close()
+                print(f"Error downloading: {video_title}: {d.get('error')}")
+
+    return progress_hook
+
+
+class DownloadSession:
+    """
+    Long-lived yt-dlp state shared by every video of a batch.
+
+    Each worker thread lazily gets one YoutubeDL instance that it keeps for the whole
+    batch, instead of building a new one per URL. Extracted info dicts go through an
+    optional MetadataCache and are handed to the download as-is, so a video's metadata
+    is resolved once rather than once for the title and again inside the download.
+    With a DownloadScheduler, requests wait for their host's request rate and the
+    received bytes are throttled to the shared bandwidth budget.
+    """
+
+    def __init__(self, download_path=".", format_spec=DEFAULT_FORMAT, metadata_cache=None, scheduler=None,
+                 filename_template=DEFAULT_FILENAME_TEMPLATE):
+        self.download_path = download_path
+        self.format_spec = format_spec
+        self.filename_template = filename_template
+        self.metadata_cache = metadata_cache
+        self.scheduler = scheduler
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    @property
+    def ydl(self):
+        """The calling thread's YoutubeDL instance."""
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            import yt_dlp
+            ydl_opts = build_ydl_opts(self.download_path, self.format_spec, self.filename_template)
+            ydl_opts['progress_hooks'] = [self._dispatch_progress]
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances.append(ydl)
+        return ydl
+
+    def _dispatch_progress(self, d):
+        if self.scheduler and d['status'] == 'downloading':
+            # The hook runs between the blocks yt-dlp reads, so sleeping here throttles the download
+            downloaded_bytes = d.get('downloaded_bytes') or 0
+            self.scheduler.throttle_bytes(downloaded_bytes - getattr(self._local, 'downloaded_bytes', 0))
+            self._local.downloaded_bytes = downloaded_bytes
+        progress_hook = getattr(self._local, 'progress_hook', None)
+        if progress_hook:
+            progress_hook(d)
+
+    def extract_info(self, video_url, refresh=False):
+        """
+        Returns the info dict of a video, from the metadata cache when possible.
+
+        Args:
+            video_url: The URL of the YouTube video.
+            refresh: Boolean, if True, ignore the cache and extract again.
+        """
+        video_id = video_id_from_url(video_url)
+        with instrumentation.stage('extract', video_id=video_id, refresh=refresh) as record:
+            if self.metadata_cache and not refresh:
+                video_info = self.metadata_cache.get(video_id, self.format_spec)
+                if video_info:
+                    record['cached'] = True
+                    return video_info
+
+            record['cached'] = False
+            if self.scheduler:
+                self.scheduler.wait_for_host(video_url)
+            video_info = self.ydl.extract_info(video_url, download=False)
+            if not video_info:
+                raise ValueError(f"Could not retrieve video information for URL: {video_url}")
+            video_info = self.ydl.sanitize_info(video_info)
+            if self.metadata_cache:
+                self.metadata_cache.put(video_id, video_info, self.format_spec)
+            return video_info
+
+    def output_filepath(self, video_info):
+        """The path yt-dlp saves the selected format of `video_info` to."""
+        return self.ydl.prepare_filename(video_info)
+
+    def download(self, video_info, progress_hook=None):
+        """
+        Downloads a video from an already-extracted info dict (no second extraction).
+
+        Returns:
+            The path of the downloaded file.
+        """
+        with instrumentation.stage('download', video_id=video_info.get('id'),
+                                   format_id=video_info.get('format_id')) as record:
+            if self.scheduler:
+                self.scheduler.wait_for_host(video_info.get('url') or video_info.get('webpage_url'))
+            self._local.progress_hook = progress_hook
+            self._local.downloaded_bytes = 0
+            try:
+                result = self.ydl.process_ie_result(copy.deepcopy(video_info), download=True)
+            finally:
+                self._local.progress_hook = None
+            requested_downloads = (result or {}).get('requested_downloads') or [{}]
+            filepath = requested_downloads[0].get('filepath') or self.output_filepath(video_info)
+            record['bytes'] = os.path.getsize(filepath) if os.path.exists(filepath) else None
+        return filepath
+
+    def close(self):
+        with self._lock:
+            for ydl in self._instances:
+                ydl.close()
+            self._instances.clear()
+
+
+def download_audio(video_url, download_path=".", show_progress=True, session=None, video_info=None):
+    """
+    Downloads the best audio stream of a single video with yt-dlp (no conversion).
+
+    Args:
+        video_url: The URL of the YouTube video.
+        download_path: The directory to save the downloaded file to.
+        show_progress: Boolean, if True, show a per-download tqdm bar.
+        session: Optional DownloadSession to reuse (a one-off session is used otherwise).
+        video_info: Optional info dict the session already extracted for the video.
+
+    Returns:
+        A (video_info, filepath) tuple: the extracted info dict and the downloaded audio file.
+    """
+    import yt_dlp
+    own_session = session is None
+    session = session or DownloadSession(download_path)
+    try:
+        video_info = video_info or session.extract_info(video_url)
+        video_title = video_info.get('title', 'Unknown Title')
+
+        if not os.path.exists(download_path):
+            os.makedirs(download_path, exist_ok=True)
+
+        progress_hook = progress_hook_builder(video_title, show_progress)
+        try:
+            filepath = session.download(video_info, progress_hook)
+        except yt_dlp.utils.DownloadError:
+            if not session.metadata_cache:
+                raise
+            # Cached format URLs may have expired early: extract again and retry once
+            video_info = session.extract_info(video_url, refresh=True)
+            filepath = session.download(video_info, progress_hook)
+    finally:
+        if own_session:
+            session.close()
+
+    return video_info, filepath
+
+
+def convert_audio_to_mp3(filepath, mp3_quality=DEFAULT_MP3_QUALITY, delete_original=True, metadata=None,
+                         cover_filepath=None, output_profiles=(), output_directory=None, loudness_callback=None,
+                         mp3_filename=None):
+    """
+    Converts a downloaded audio file (webm, m4a, ...) to MP3 with a streaming ffmpeg
+    audio-only pipeline (MP3 sources are remuxed instead of re-encoded).
+
+    Args:
+        filepath: The path of the downloaded audio file.
+        mp3_quality: The MP3 bitrate (default: DEFAULT_MP3_QUALITY).
+        delete_original: Boolean, if True, delete the source file after a successful conversion.
+        metadata: Optional tags (see track_metadata) written by the same ffmpeg pass.
+        cover_filepath: Optional cover image embedded by the same ffmpeg pass.
+        output_profiles: Optional OUTPUT_PROFILES names. Their versions are written next to
+                         the MP3 (see profile_outputs) by the same ffmpeg run, which decodes
+                         the source once for all of them.
+        output_directory: Optional directory for the MP3 (default: next to the source), e.g.
+                          when the source was downloaded to a Workspace's scratch directory.
+        loudness_callback: Optional callback(measurement) given the source's loudness, measured
+                           by the same ffmpeg run (see audio_transcoder.transcode_audio). Not
+                           called for an MP3 source without output profiles: nothing is
+                           decoded then, and a decode just for the measurement is not worth it.
+        mp3_filename: Optional name of the MP3 (default: the source's, see output_filename).
+
+    Returns:
+        The path of the written MP3 file.
+    """
+    base, ext = os.path.splitext(filepath)
+    if mp3_filename:
+        base = os.path.join(os.path.dirname(filepath), os.path.splitext(mp3_filename)[0])
+    if output_directory:
+        base = os.path.join(output_directory, os.path.basename(base))
+    mp3_filepath = base + ".mp3"
+    extra_outputs = profile_outputs(mp3_filepath, output_profiles)
+
+    if os.path.abspath(mp3_filepath) == os.path.abspath(filepath):
+        if metadata:
+            tag_audio_file(mp3_filepath, metadata) # yt-dlp already delivered an MP3: only tag it
+        if extra_outputs: # The other versions still come from one decode of the MP3
+            output_filepath, bitrate = extra_outputs[0]
+            transcode_audio(mp3_filepath, output_filepath, bitrate=bitrate, metadata=metadata,
+                            cover_filepath=cover_filepath, extra_outputs=extra_outputs[1:],
+                            loudness_callback=loudness_callback)
+        return mp3_filepath
+
+    transcode_audio(filepath, mp3_filepath, bitrate=mp3_quality, metadata=metadata, cover_filepath=cover_filepath,
+                    extra_outputs=extra_outputs, loudness_callback=loudness_callback)
+
+    if delete_original:
+        os.remove(filepath) # Clean up the original downloaded file (webm, etc.)
+
+    return mp3_filepath
+
+
+def fetch_thumbnail(video_info, directory="."):
+    """
+    Downloads the video's thumbnail into a hidden temporary file in `directory`.
+
+    Returns:
+        The thumbnail's path (the caller deletes it), or None if there is none or it failed.
+    """
+    thumbnail_url = video_info.get('thumbnail')
+    if not thumbnail_url:
+        return None
+    try:
+        with instrumentation.stage('thumbnail', video_id=video_info.get('id')) as record:
+            request = urllib.request.Request(thumbnail_url, headers=video_info.get('http_headers') or {})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                thumbnail_data = response.read()
+            record['bytes'] = len(thumbnail_data)
+    except Exception as e:
+        print(f"Could not fetch thumbnail for '{video_info.get('title')}': {e}")
+        return None
+
+    os.makedirs(directory, exist_ok=True)
+    fd, thumbnail_filepath = tempfile.mkstemp(prefix=".thumbnail-", dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(thumbnail_data)
+    return thumbnail_filepath
+
+
+@contextlib.contextmanager
+def track_metadata(video_info, directory=".", track_number=None, track_total=None, extra_tags=None,
+                   embed_thumbnail=True, artwork_filepath=None):
+    """
+    Prepares the tags and cover an encode should embed for one track.
+
+    Yields a (metadata, cover_filepath) tuple: per-track tags from the info dict (see
+    mp3_metadata_editor.track_tags_from_info) updated with `extra_tags`, and the cover:
+    `artwork_filepath` if given, else the fetched thumbnail (unless `embed_thumbnail` is
+    False), which is deleted again when the block exits.
+    """
+    metadata = track_tags_from_info(video_info, track_number, track_total)
+    metadata.update(extra_tags or {})
+    if artwork_filepath:
+        yield metadata, artwork_filepath
+        return
+    cover_filepath = fetch_thumbnail(video_info, directory) if embed_thumbnail else None
+    try:
+        yield metadata, cover_filepath
+    finally:
+        if cover_filepath and os.path.exists(cover_filepath):
+            os.remove(cover_filepath)
+
+
+def iter_http_chunks(url, headers=None, chunk_size=STREAM_CHUNK_SIZE, read_size=64 * 1024, scheduler=None):
+    """
+    Yields the body of `url` piece by piece, fetched with consecutive HTTP range requests
+    of `chunk_size` bytes (YouTube throttles single long-running requests).
+    With a DownloadScheduler each request waits for the host's request rate and every
+    block is throttled to the shared bandwidth budget.
+    """
+    start = 0
+    while True:
+        request_headers = dict(headers or {})
+        request_headers['Range'] = f"bytes={start}-{start + chunk_size - 1}"
+        request = urllib.request.Request(url, headers=request_headers)
+        if scheduler:
+            scheduler.wait_for_host(url)
+        with urllib.request.urlopen(request, timeout=30) as response:
+            received = 0
+            for block in iter(lambda: response.read(read_size), b''):
+                received += len(block)
+                if scheduler:
+                    scheduler.throttle_bytes(len(block))
+                yield block
+            if response.status != 206:
+                return # Server ignored the range and sent the whole body
+            total_size = response.headers.get('Content-Range', '').rpartition('/')[2]
+
+        start += received
+        if received < chunk_size or (total_size.isdigit() and start >= int(total_size)):
+            return
+
+
+def stream_video_to_mp3(video_url, download_path=".", mp3_quality=DEFAULT_MP3_QUALITY, session=None,
+                        embed_metadata=True, track_number=None, track_total=None, extra_tags=None,
+                        embed_thumbnail=True, video_info=None, output_profiles=(), loudness_callback=None,
+                        artwork_filepath=None, mp3_filename=None):
+    """
+    Downloads a single video's audio and encodes it to MP3 in one streaming pass.
+
+    The downloaded bytes are piped straight into ffmpeg, so the encode overlaps with the
+    download and no intermediate WEBM/M4A file touches the disk. Videos without a single
+    plain-HTTP audio format fall back to download_audio + convert_audio_to_mp3, the source
+    going to the session's download directory (which may be a scratch directory).
+
+    Args:
+        video_url: The URL of the YouTube video.
+        download_path: The directory to save the MP3 file to.
+        mp3_quality: The MP3 bitrate (default: DEFAULT_MP3_QUALITY).
+        session: Optional DownloadSession created with format_spec=STREAM_FORMAT.
+        embed_metadata: Boolean, if True, write per-track tags and the thumbnail during the encode.
+        track_number, track_total, extra_tags, embed_thumbnail, artwork_filepath: See track_metadata.
+        video_info: Optional info dict the session already extracted for the video.
+        output_profiles: Optional OUTPUT_PROFILES names encoded from the same stream.
+        loudness_callback: Optional callback(measurement) given the loudness measured from the same stream.
+        mp3_filename: Optional name of the MP3 (default: see output_filename).
 
+    Returns:
+        A (video_info, mp3_filepath) tuple.
+    """
+    own_session = session is None
+    session = session or DownloadSession(download_path, STREAM_FORMAT)
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        video_info = video_info or session.extract_info(video_url)
+        mp3_filename = mp3_filename or output_filename(video_info, download_path, output_profiles)
+        mp3_filepath = os.path.join(download_path, mp3_filename)
+        extra_outputs = profile_outputs(mp3_filepath, output_profiles)
+        os.makedirs(download_path, exist_ok=True)
+
+        metadata_context = contextlib.nullcontext((None, None))
+        if embed_metadata:
+            metadata_context = track_metadata(video_info, session.download_path, track_number, track_total,
+                                              extra_tags, embed_thumbnail, artwork_filepath)
+        with metadata_context as (metadata, cover_filepath):
+
+            if video_info.get('requested_formats') or video_info.get('protocol') not in ('http', 'https'):
+                filepath = session.download(video_info)
+                return video_info, convert_audio_to_mp3(filepath, mp3_quality, metadata=metadata,
+                                                        cover_filepath=cover_filepath, output_profiles=output_profiles,
+                                                        output_directory=download_path,
+                                                        loudness_callback=loudness_callback, mp3_filename=mp3_filename)
+
+            # transcode_stream renames its outputs into place only once ffmpeg succeeds,
+            # so a failed or interrupted stream never leaves a truncated file behind
             try:
-                video_info = ydl.extract_info(video_url, download=False)
+                transcode_stream(iter_http_chunks(video_info['url'], video_info.get('http_headers'),
+                                                  scheduler=session.scheduler),
+                                 mp3_filepath, bitrate=mp3_quality, metadata=metadata, cover_filepath=cover_filepath,
+                                 extra_outputs=extra_outputs, loudness_callback=loudness_callback)
+            except urllib.error.HTTPError as e:
+                if not (session.metadata_cache and e.code == 403):
+                    raise
+                # Cached format URL expired early: extract again and restart the stream once
+                video_info = session.extract_info(video_url, refresh=True)
+                transcode_stream(iter_http_chunks(video_info['url'], video_info.get('http_headers'),
+                                                  scheduler=session.scheduler),
+                                 mp3_filepath, bitrate=mp3_quality, metadata=metadata, cover_filepath=cover_filepath,
+                                 extra_outputs=extra_outputs, loudness_callback=loudness_callback)
+    finally:
+        if own_session:
+            session.close()
 
-                if video_info:
-                    video_title = video_info.get('title', 'Unknown Title')
+    return video_info, mp3_filepath
 
-                    if not os.path.exists(download_path):
-                        os.makedirs(download_path)
 
-                    try:
-                        print(f"\nDownloading audio for video: {video_title}")
-                        ydl_opts['progress_hooks'] = [progress_hook_builder(video_title)]
-                        filepath = ydl.download([video_url])[0]
-                        print(f"Downloaded audio file: {filepath}")
+def download_video_from_url_to_mp3(video_url, download_path=".", mp3_quality=DEFAULT_MP3_QUALITY, streaming=False, # Use default quality
+                                   embed_metadata=True, extra_tags=None, library_path=None, output_profiles=(),
+                                   replaygain=False):
+    """
+    Downloads a single YouTube video from a URL as an MP3 file using yt-dlp and ffmpeg.
+    MP3 quality is set to DEFAULT_MP3_QUALITY.
 
-                        # Convert to MP3 using moviepy
-                        base, ext = os.path.splitext(filepath)
-                        mp3_filepath = base + ".mp3"
+    Args:
+        video_url: The URL of the YouTube video.
+        download_path: The directory to save the MP3 file to (default is current directory).
+        streaming: Boolean, if True, pipe the download straight into the encoder (see stream_video_to_mp3).
+        embed_metadata: Boolean, if True, tag the MP3 (title, artist, date, thumbnail) while it is written.
+        extra_tags: Optional {tag name: value} dict overriding the per-track tags (e.g. album, genre).
+        library_path: Optional library directory (see library_store.LibraryStore). The MP3 is
+                      then kept there once and only linked into download_path.
+        output_profiles: Optional OUTPUT_PROFILES names (e.g. ['m4a', 'mobile']) also encoded
+                         from the same download, next to the MP3.
+        replaygain: Boolean, if True, measure loudness during the encode and write ReplayGain tags.
+    """
+    from tqdm import tqdm
+    try:
+        if library_path:
+            results = download_videos([video_url], download_path, mp3_quality, download_workers=1, transcode_workers=1,
+                                      streaming=streaming, embed_metadata=embed_metadata, extra_tags=extra_tags,
+                                      library=LibraryStore(library_path), output_profiles=output_profiles,
+                                      replaygain=replaygain)
+            for mp3_filepath in results['converted']:
+                print(f"MP3 in library, linked as: {mp3_filepath}")
+            print("\nVideo download and conversion process complete!")
+            return
 
-                        try:
-                            print(f"Converting to MP3 using moviepy: {video_title}")
-                            audio_clip = AudioFileClip(filepath)
-                            with tqdm(total=1, unit="file", desc=f"Converting to MP3: {video_title}", leave=False) as pbar:
-                                audio_clip.write_audiofile(mp3_filepath, bitrate=mp3_quality) # Use DEFAULT_MP3_QUALITY
-                                pbar.update(1)
-                            audio_clip.close()
-                            print(f"Converted to MP3: {mp3_filepath}")
+        measurements = [] # Filled by the encode when replaygain is set
+        loudness_callback = measurements.append if replaygain else None
 
-                            # Clean up the original downloaded file (webm, etc.)
-                            os.remove(filepath)
-                            print(f"Deleted original audio file: {filepath}")
+        if streaming:
+            try:
+                print(f"\nStreaming audio for video into MP3: {video_url}")
+                video_info, mp3_filepath = stream_video_to_mp3(video_url, download_path, mp3_quality,
+                                                               embed_metadata=embed_metadata, extra_tags=extra_tags,
+                                                               output_profiles=output_profiles,
+                                                               loudness_callback=loudness_callback)
+                output_filepaths = [filepath for filepath, _ in profile_outputs(mp3_filepath, output_profiles)]
+                if measurements:
+                    tag_replaygain([mp3_filepath] + output_filepaths, measurements[-1])
+                    record_loudness(download_path, [mp3_filepath] + output_filepaths, measurements[-1])
+                print(f"Converted to MP3: {mp3_filepath}")
+                for output_filepath in output_filepaths:
+                    print(f"Also written: {output_filepath}")
+            except Exception as stream_error:
+                print(f"Error streaming video to MP3: {stream_error}")
+            print("\nVideo download and conversion process complete!")
+            return
 
-                        except Exception as moviepy_conversion_error:
-                            print(f"Error converting to MP3 with moviepy for video '{video_title}': {moviepy_conversion_error}")
+        with Workspace(download_path) as workspace: # The source and thumbnail go to its scratch directory
+            try:
+                print(f"\nDownloading audio for video: {video_url}")
+                workspace.wait_for_space()
+                video_info, filepath = download_audio(video_url, workspace.scratch_directory)
+                video_title = video_info.get('title', 'Unknown Title')
+                print(f"Downloaded audio file: {filepath}")
 
+                try:
+                    print(f"Converting to MP3 using ffmpeg: {video_title}")
+                    metadata_context = contextlib.nullcontext((None, None))
+                    if embed_metadata:
+                        metadata_context = track_metadata(video_info, workspace.scratch_directory, extra_tags=extra_tags)
+                    with tqdm(total=1, unit="file", desc=f"Converting to MP3: {video_title}", leave=False) as pbar, \
+                            metadata_context as (metadata, cover_filepath):
+                        mp3_filepath = convert_audio_to_mp3(filepath, mp3_quality, metadata=metadata, # Use DEFAULT_MP3_QUALITY
+                                                            cover_filepath=cover_filepath, output_profiles=output_profiles,
+                                                            output_directory=download_path,
+                                                            loudness_callback=loudness_callback,
+                                                            mp3_filename=output_filename(video_info, download_path,
+                                                                                         output_profiles))
+                        pbar.update(1)
+                    output_filepaths = [filepath for filepath, _ in profile_outputs(mp3_filepath, output_profiles)]
+                    if measurements:
+                        tag_replaygain([mp3_filepath] + output_filepaths, measurements[-1])
+                        record_loudness(download_path, [mp3_filepath] + output_filepaths, measurements[-1])
+                    print(f"Converted to MP3: {mp3_filepath}")
+                    for output_filepath in output_filepaths:
+                        print(f"Also written: {output_filepath}")
+                    print(f"Deleted original audio file: {filepath}")
 
-                    except Exception as download_error:
-                        print(f"Error downloading video: {download_error}")
-                else:
-                    print(f"Could not retrieve video information for URL: {video_url}")
+                except Exception as conversion_error:
+                    print(f"Error converting to MP3 with ffmpeg for video '{video_title}': {conversion_error}")
 
-            except Exception as info_error:
-                print(f"Error getting video info: {info_error}")
+            except Exception as download_error:
+                print(f"Error downloading video: {download_error}")
 
         print("\nVideo download and conversion process complete!")
 
@@ -103,7 +593,407 @@ def download_video_from_url_to_mp3(video_url, download_path=".", mp3_quality=DEF
         print(f"An error occurred: {main_error}")
 
 
-def download_videos_from_file(links_file="video_links.txt", download_directory=".", mp3_quality=DEFAULT_MP3_QUALITY): # Use default quality
+def unique_links(video_links):
+    """Yields the video URLs of an iterable in order, skipping repeats of a video already yielded."""
+    seen = set()
+    for video_url in video_links:
+        video_id = video_id_from_url(video_url)
+        if video_id not in seen:
+            seen.add(video_id)
+            yield video_url
+
+
+class DownloadBatch:
+    """
+    One run of download_videos: its settings, the shared session and the per-stage workers.
+
+    Every video goes through download (or a library lookup), transcode, store and record,
+    and ends in exactly one finish() call, which keeps the results, the counters and the
+    aggregated progress bar in step.
+    """
+
+    def __init__(self, video_links, download_directory=".", mp3_quality=DEFAULT_MP3_QUALITY,
+                 download_workers=DEFAULT_DOWNLOAD_WORKERS, transcode_workers=DEFAULT_TRANSCODE_WORKERS,
+                 manifest=None, streaming=False, metadata_cache=None, embed_metadata=True, extra_tags=None,
+                 embed_thumbnail=True, on_converted=None, scheduler=None, library=None, output_profiles=(),
+                 workspace=None, replaygain=False, artwork_filepath=None):
+        if hasattr(video_links, '__len__'):
+            self.video_links = list(unique_links(video_links))
+            self.total = len(self.video_links)
+        else: # A generator (e.g. a playlist still being listed) is deduplicated as it is consumed
+            self.video_links = unique_links(video_links)
+            self.total = None
+        self.download_directory = download_directory
+        self.mp3_quality = mp3_quality
+        self.download_workers = download_workers
+        self.transcode_workers = transcode_workers
+        self.manifest = manifest
+        self.streaming = streaming
+        self.metadata_cache = metadata_cache
+        self.embed_metadata = embed_metadata
+        self.extra_tags = extra_tags
+        self.embed_thumbnail = embed_thumbnail
+        self.on_converted = on_converted
+        self.scheduler = scheduler
+        self.library = library
+        self.output_profiles = output_profiles
+        self.workspace = workspace
+        self.replaygain = replaygain
+        self.results = {'converted': [], 'skipped': [], 'failed': []}
+        self.counts = {'downloading': 0, 'converting': 0}
+        self.lock = threading.Lock()
+        self.reserved = {} # MP3 names handed out to videos of this batch (see output_filename)
+        self.output_directory = library.staging_directory if library else download_directory # Where encodes are written
+        # Library entries are shared by every playlist linking them, so their encodes only embed the
+        # video's own tags; what this batch adds (extra tags, artwork) goes on the links (see personalize)
+        self.encode_tags = ({'track_total': None, 'extra_tags': None, 'artwork_filepath': None} if library else
+                            {'track_total': self.total, 'extra_tags': extra_tags, 'artwork_filepath': artwork_filepath})
+        self.artwork = load_artwork(artwork_filepath) if library and embed_metadata and artwork_filepath else None
+        self.session = None
+        self.pbar = None
+        self.transcode_pool = None
+
+    def run(self):
+        """Processes every video of the batch and returns the results dict of download_videos."""
+        from tqdm import tqdm
+        own_workspace = self.workspace is None
+        self.workspace = self.workspace or Workspace(self.download_directory)
+        # Concurrent runs share the library's staging directory, so their encodes get run-specific names
+        filename_template = (LIBRARY_FILENAME_TEMPLATE.format(run_id=f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+                             if self.library else DEFAULT_FILENAME_TEMPLATE)
+        self.session = DownloadSession(self.workspace.scratch_directory,
+                                       STREAM_FORMAT if self.streaming else DEFAULT_FORMAT,
+                                       self.metadata_cache, self.scheduler, filename_template)
+        try:
+            with tqdm(total=self.total, desc="Processing videos", unit="video") as self.pbar, \
+                    ThreadPoolExecutor(max_workers=max(1, self.download_workers),
+                                       thread_name_prefix="download") as download_pool, \
+                    ThreadPoolExecutor(max_workers=max(1, self.transcode_workers),
+                                       thread_name_prefix="transcode") as self.transcode_pool:
+                download_futures = [download_pool.submit(self.download, video_url, track_number)
+                                    for track_number, video_url in enumerate(self.video_links, start=1)]
+                transcode_futures = [f.result() for f in as_completed(download_futures)]
+                for f in transcode_futures:
+                    if f is not None:
+                        f.result()
+        finally:
+            self.session.close()
+            if own_workspace:
+                self.workspace.close()
+        return self.results
+
+    def refresh(self):
+        """Redraws the progress bar's counters; the caller holds the lock."""
+        self.pbar.set_postfix(downloading=self.counts['downloading'], converting=self.counts['converting'],
+                              skipped=len(self.results['skipped']), failed=len(self.results['failed']), refresh=True)
+
+    @contextlib.contextmanager
+    def active(self, stage):
+        """Counts a video as 'downloading' or 'converting' while the block runs."""
+        with self.lock:
+            self.counts[stage] += 1
+            self.refresh()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.counts[stage] -= 1
+
+    def finish(self, video_url, outcome, message=None, mp3_filepath=None):
+        """
+        Ends a video: adds its MP3 ('converted') or URL ('skipped', 'failed') to the results,
+        advances the progress bar and prints `message` (if any) above it.
+        """
+        with self.lock:
+            self.results[outcome].append(mp3_filepath or video_url)
+            self.pbar.update(1)
+            self.refresh()
+        if message:
+            self.pbar.write(message)
+
+    def fail(self, video_url, stage, error):
+        instrumentation.emit('video_failed', url=video_url, stage=stage, reason=instrumentation.failure_reason(error))
+        if self.scheduler:
+            self.scheduler.record_failure(video_url)
+        if self.manifest:
+            self.manifest.mark(video_id_from_url(video_url), video_url, 'listed', error=str(error))
+        self.finish(video_url, 'failed', f"Error {stage} {video_url}: {error}")
+
+    def attempt(self, video_url, function, *args, **kwargs):
+        if self.scheduler:
+            return self.scheduler.call(video_url, function, *args, **kwargs)
+        return function(*args, **kwargs)
+
+    def mp3_filename(self, video_info):
+        if self.library: # Staged under a name unique to the video and run, linked under its title by place()
+            return None
+        with self.lock:
+            return output_filename(video_info, self.download_directory, self.output_profiles, self.reserved)
+
+    def library_key(self, video_info, profile=None):
+        """The entry hash of a video's encode: its source format and the encode settings."""
+        settings = {'tags': self.embed_metadata, 'thumbnail': self.embed_metadata and self.embed_thumbnail}
+        if self.replaygain: # Entries stored without ReplayGain tags keep their keys
+            settings['replaygain'] = True
+        if profile:
+            extension, bitrate, _ = OUTPUT_PROFILES[profile]
+            return format_hash(video_info, codec=extension, bitrate=bitrate, **settings)
+        return format_hash(video_info, codec='mp3', bitrate=self.mp3_quality, **settings)
+
+    def personalize(self, filepaths):
+        """Writes this batch's extra tags and artwork on placed links (tag_audio_file copies them first)."""
+        if self.embed_metadata and (self.extra_tags or self.artwork):
+            for filepath in filepaths:
+                if os.path.splitext(filepath)[1].lower() in SUPPORTED_EXTENSIONS:
+                    tag_audio_file(filepath, self.extra_tags or {}, self.artwork)
+
+    def place(self, video_url, video_info, entry_path, suffix=''):
+        import yt_dlp
+        video_id = video_id_from_url(video_url)
+        filename = (yt_dlp.utils.sanitize_filename(video_info.get('title') or video_id) + suffix
+                    + os.path.splitext(entry_path)[1])
+        output_filepath, method = self.library.place(entry_path, self.download_directory, filename, video_id)
+        instrumentation.emit('library_link', url=video_url, output=output_filepath, method=method)
+        return output_filepath
+
+    def link_from_library(self, video_url, video_info):
+        """
+        Links a video's stored MP3 and every requested profile version into the download
+        directory if the library has them all; returns the linked MP3's path, else None.
+        """
+        video_id = video_id_from_url(video_url)
+        entry_path = self.library.lookup(video_id, self.library_key(video_info))
+        entry_paths = [self.library.lookup(video_id, self.library_key(video_info, profile), OUTPUT_PROFILES[profile][0])
+                       for profile in self.output_profiles]
+        if not entry_path or not all(entry_paths):
+            return None
+        placed = [self.place(video_url, video_info, profile_path, OUTPUT_PROFILES[profile][2])
+                  for profile, profile_path in zip(self.output_profiles, entry_paths)]
+        mp3_filepath = self.place(video_url, video_info, entry_path)
+        self.personalize([mp3_filepath] + placed)
+        return mp3_filepath
+
+    def store(self, video_url, video_info, mp3_filepath, measurements=()):
+        """
+        Tags a new MP3 and its profile versions with the loudness its encode measured (if any),
+        moves them into the library and links them (if there is one) and records the loudness
+        of the files in the download directory (see loudness.record_loudness); returns the
+        MP3's path in the download directory.
+        """
+        output_filepaths = [filepath for filepath, _ in profile_outputs(mp3_filepath, self.output_profiles)]
+        if measurements:
+            tag_replaygain([mp3_filepath] + output_filepaths, measurements[-1])
+        if self.library:
+            video_id = video_id_from_url(video_url)
+            for index, (profile, output_filepath) in enumerate(zip(self.output_profiles, output_filepaths)):
+                entry_path = self.library.add(output_filepath, video_id, self.library_key(video_info, profile))
+                output_filepaths[index] = self.place(video_url, video_info, entry_path, OUTPUT_PROFILES[profile][2])
+            entry_path = self.library.add(mp3_filepath, video_id, self.library_key(video_info))
+            mp3_filepath = self.place(video_url, video_info, entry_path)
+            self.personalize([mp3_filepath] + output_filepaths)
+        if measurements:
+            record_loudness(self.download_directory, [mp3_filepath] + output_filepaths, measurements[-1])
+        return mp3_filepath
+
+    def record(self, video_url, mp3_filepath):
+        """Marks a video's MP3 as finished in the manifest and hands it to `on_converted`."""
+        instrumentation.emit('video_converted', url=video_url, output=mp3_filepath, bytes=os.path.getsize(mp3_filepath))
+        if self.scheduler:
+            self.scheduler.clear_failure(video_url)
+        if self.manifest:
+            self.manifest.mark(video_id_from_url(video_url), video_url,
+                               'tagged' if self.embed_metadata else 'transcoded', source_path=None,
+                               output_path=mp3_filepath, size=os.path.getsize(mp3_filepath),
+                               checksum=file_checksum(mp3_filepath), error=None)
+        if self.on_converted:
+            self.on_converted(video_url, mp3_filepath)
+
+    def transcode(self, video_url, video_info, filepath, track_number):
+        """Transcode worker: encodes a downloaded file, then stores and records it."""
+        try:
+            with self.active('converting'):
+                measurements = []
+                metadata_context = contextlib.nullcontext((None, None))
+                if self.embed_metadata:
+                    metadata_context = track_metadata(video_info, self.workspace.scratch_directory,
+                                                      None if self.library else track_number,
+                                                      embed_thumbnail=self.embed_thumbnail, **self.encode_tags)
+                with metadata_context as (metadata, cover_filepath):
+                    mp3_filepath = convert_audio_to_mp3(
+                        filepath, self.mp3_quality, metadata=metadata, cover_filepath=cover_filepath,
+                        output_profiles=self.output_profiles, output_directory=self.output_directory,
+                        loudness_callback=measurements.append if self.replaygain else None,
+                        mp3_filename=self.mp3_filename(video_info))
+                mp3_filepath = self.store(video_url, video_info, mp3_filepath, measurements)
+                self.record(video_url, mp3_filepath)
+        except Exception as e:
+            self.fail(video_url, "converting", e)
+            return
+        self.finish(video_url, 'converted', f"Converted to MP3: {mp3_filepath}", mp3_filepath)
+
+    def stream(self, video_url, video_info, track_number):
+        """Download worker in streaming mode: pipes the download into the encoder (see stream_video_to_mp3)."""
+        try:
+            with self.active('downloading'):
+                measurements = []
+                video_info = video_info or self.attempt(video_url, self.session.extract_info, video_url)
+                video_info, mp3_filepath = self.attempt(
+                    video_url, stream_video_to_mp3, video_url, self.output_directory, self.mp3_quality,
+                    session=self.session, embed_metadata=self.embed_metadata,
+                    track_number=None if self.library else track_number, embed_thumbnail=self.embed_thumbnail,
+                    video_info=video_info, output_profiles=self.output_profiles,
+                    loudness_callback=measurements.append if self.replaygain else None,
+                    mp3_filename=self.mp3_filename(video_info), **self.encode_tags)
+                mp3_filepath = self.store(video_url, video_info, mp3_filepath, measurements)
+                self.record(video_url, mp3_filepath)
+        except Exception as e:
+            self.fail(video_url, "streaming", e)
+            return
+        self.finish(video_url, 'converted', f"Converted to MP3: {mp3_filepath}", mp3_filepath)
+
+    def resume(self, video_url, track_number):
+        """Hands a video whose download survived an earlier run straight to the transcode pool."""
+        video_id = video_id_from_url(video_url)
+        entry = self.manifest.get(video_id)
+        self.pbar.write(f"Resuming conversion: {entry['title']}")
+        try:
+            video_info = (self.attempt(video_url, self.session.extract_info, video_url)
+                          if self.embed_metadata or self.library else {'id': video_id, 'title': entry['title']})
+        except Exception as e:
+            self.fail(video_url, "getting video info for", e)
+            return None
+        return self.transcode_pool.submit(self.transcode, video_url, video_info, entry['source_path'], track_number)
+
+    def download(self, video_url, track_number):
+        """
+        Download worker: skips or resumes what the manifest records, links what the library
+        has and otherwise downloads the video; returns its transcode future (if any).
+        """
+        video_id = video_id_from_url(video_url)
+        if self.manifest:
+            resume_point = self.manifest.resume_point(video_id)
+            if resume_point == 'done':
+                instrumentation.emit('video_skipped', url=video_url)
+                if self.scheduler:
+                    self.scheduler.clear_failure(video_url)
+                self.finish(video_url, 'skipped')
+                return None
+            if resume_point == 'transcode':
+                return self.resume(video_url, track_number)
+            self.manifest.mark(video_id, video_url, 'listed')
+
+        video_info = None
+        if self.library:
+            try:
+                video_info = self.attempt(video_url, self.session.extract_info, video_url)
+                mp3_filepath = self.link_from_library(video_url, video_info)
+                if mp3_filepath: # Already fetched and encoded for another playlist or directory
+                    self.record(video_url, mp3_filepath)
+            except Exception as e:
+                self.fail(video_url, "looking up", e)
+                return None
+            if mp3_filepath:
+                self.finish(video_url, 'converted', f"Linked from library: {mp3_filepath}", mp3_filepath)
+                return None
+
+        try:
+            self.workspace.wait_for_space() # New downloads pause while the disk is low; running encodes go on
+        except OSError as e:
+            self.fail(video_url, "waiting for disk space for", e)
+            return None
+        if self.streaming:
+            self.stream(video_url, video_info, track_number)
+            return None
+
+        try:
+            with self.active('downloading'):
+                video_info, filepath = self.attempt(video_url, download_audio, video_url,
+                                                    self.workspace.scratch_directory, show_progress=False,
+                                                    session=self.session, video_info=video_info)
+                video_title = video_info.get('title', 'Unknown Title')
+                if self.manifest:
+                    self.manifest.mark(video_id, video_url, 'downloaded', title=video_title, source_path=filepath,
+                                       size=os.path.getsize(filepath))
+        except Exception as e:
+            self.fail(video_url, "downloading", e)
+            return None
+        self.pbar.write(f"Downloaded: {video_title}")
+        return self.transcode_pool.submit(self.transcode, video_url, video_info, filepath, track_number)
+
+
+def download_videos(video_links, download_directory=".", mp3_quality=DEFAULT_MP3_QUALITY,
+                    download_workers=DEFAULT_DOWNLOAD_WORKERS, transcode_workers=DEFAULT_TRANSCODE_WORKERS,
+                    manifest=None, streaming=False, metadata_cache=None, embed_metadata=True, extra_tags=None,
+                    embed_thumbnail=True, on_converted=None, scheduler=None, library=None, output_profiles=(),
+                    workspace=None, replaygain=False, artwork_filepath=None):
+    """
+    Downloads many videos as MP3 with a bounded worker pool per stage.
+
+    Downloads run on up to `download_workers` threads and every finished download is
+    handed straight to a pool of `transcode_workers` MP3 encoders, so the network and
+    the CPU stay busy at the same time. A single aggregated progress bar replaces the
+    per-video bars.
+
+    Args:
+        video_links: An iterable of video URLs; repeats of a video are only downloaded once.
+        download_directory: The directory to save MP3 files to.
+        mp3_quality: The MP3 bitrate (default: DEFAULT_MP3_QUALITY).
+        download_workers: Maximum number of concurrent downloads.
+        transcode_workers: Maximum number of concurrent MP3 conversions.
+        manifest: Optional DownloadManifest. Videos it records as finished are skipped and
+                  videos whose download survived are only transcoded.
+        streaming: Boolean, if True, each download worker pipes its download straight into
+                   an MP3 encoder (see stream_video_to_mp3) and the transcode pool stays idle.
+        metadata_cache: Optional MetadataCache; info extracted by an earlier run is reused.
+                        Either way one DownloadSession serves the whole batch.
+        embed_metadata: Boolean, if True, each MP3 gets its own title/artist/date/thumbnail
+                        tags and its position in `video_links` as track number, written by
+                        the encode itself (no separate tagging pass).
+        extra_tags: Optional {tag name: value} dict applied to every track (e.g. album, genre).
+        embed_thumbnail: Boolean, if False, tags are embedded without the video thumbnail.
+        artwork_filepath: Optional cover image every encode embeds instead of the thumbnail
+                          (with `embed_metadata`).
+        on_converted: Optional callback(video_url, mp3_filepath) called from the worker as
+                      soon as each MP3 is written, so a later stage can pick it up at once.
+        scheduler: Optional DownloadScheduler. Downloads then share its bandwidth budget and
+                   per-host request rate, transient failures are retried with backoff, and
+                   videos that still fail are added to its dead-letter file.
+        library: Optional LibraryStore. Each MP3 is then encoded into the library once per
+                 video, source format and encode settings, with the tags of the video only
+                 (no track number), and the download directory gets a link to it named after
+                 the title ("<title> [<video id>].mp3" if another video took the name). A
+                 video already in the library is linked without downloading it again.
+                 `extra_tags` and `artwork_filepath` are written on a private copy of the link.
+        output_profiles: Optional OUTPUT_PROFILES names. Each is encoded next to the MP3 by
+                         the same ffmpeg run (one decode per video) and, with a library,
+                         stored and linked like the MP3. Videos the manifest already records
+                         as finished are not revisited for profiles added later.
+        workspace: Optional workspace.Workspace (default: one for `download_directory`, closed
+                   at the end). Downloads and thumbnails go to its scratch directory, only
+                   the encoded files are written to the download directory (or the library's
+                   staging directory), and each download waits for free disk space first.
+        replaygain: Boolean, if True, each encode also measures the track's loudness (no extra
+                    decode) and the MP3 and its MP3/M4A profile versions get ReplayGain tags
+                    (see loudness.py) before they are recorded as finished; the measurement
+                    is also kept in the download directory's file index. MP3 sources that
+                    need no encode are left without tags.
+
+    Returns:
+        A dict with the lists of 'converted' MP3 paths, 'skipped' and 'failed' URLs.
+    """
+    return DownloadBatch(video_links, download_directory, mp3_quality, download_workers=download_workers,
+                         transcode_workers=transcode_workers, manifest=manifest, streaming=streaming,
+                         metadata_cache=metadata_cache, embed_metadata=embed_metadata, extra_tags=extra_tags,
+                         embed_thumbnail=embed_thumbnail, on_converted=on_converted, scheduler=scheduler,
+                         library=library, output_profiles=output_profiles, workspace=workspace,
+                         replaygain=replaygain, artwork_filepath=artwork_filepath).run()
+
+
+def download_videos_from_file(links_file="video_links.txt", download_directory=".", mp3_quality=DEFAULT_MP3_QUALITY, # Use default quality
+                              download_workers=DEFAULT_DOWNLOAD_WORKERS, transcode_workers=DEFAULT_TRANSCODE_WORKERS,
+                              use_manifest=True, streaming=False, use_metadata_cache=True, embed_metadata=True,
+                              extra_tags=None, bandwidth_limit=None, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                              retries=DEFAULT_RETRIES, library_path=None, output_profiles=(), replaygain=False):
     """
     Reads video URLs from a file and downloads each video as MP3.
     MP3 quality is set to DEFAULT_MP3_QUALITY.
@@ -111,18 +1001,53 @@ def download_videos_from_file(links_file="video_links.txt", download_directory="
     Args:
         links_file: The file containing video URLs (one URL per line).
         download_directory: The directory to save MP3 files to.
+        download_workers: Maximum number of concurrent downloads.
+        transcode_workers: Maximum number of concurrent MP3 conversions.
+        use_manifest: Boolean, if True, keep a manifest in the download directory so a
+                      rerun skips finished videos and resumes interrupted ones.
+        streaming: Boolean, if True, pipe each download straight into the MP3 encoder.
+        use_metadata_cache: Boolean, if True, reuse video info extracted by recent runs
+                            (see metadata_cache.MetadataCache).
+        embed_metadata: Boolean, if True, tag each MP3 from its own video info while it is encoded.
+        extra_tags: Optional {tag name: value} dict applied to every track (e.g. album, genre).
+        bandwidth_limit: Optional bytes per second shared by all concurrent downloads.
+        requests_per_second: Maximum requests started per second against one host.
+        retries: Extra attempts for a download that failed on a transient error. URLs that
+                 still fail are saved to failed_links.txt in the download directory, which
+                 can be passed back as `links_file` to retry only them.
+        library_path: Optional library directory (see library_store.LibraryStore). Each track is
+                      then downloaded and encoded once into it, however many download
+                      directories link to it.
+        output_profiles: Optional OUTPUT_PROFILES names encoded next to each MP3 from the same decode.
+        replaygain: Boolean, if True, write ReplayGain tags measured during each encode.
     """
     try:
         with open(links_file, 'r') as f:
             video_links = [line.strip() for line in f if line.strip()] # Read links, remove empty lines
 
-        print(f"Found {len(video_links)} video links in '{links_file}'. Starting downloads...")
+        print(f"Found {len(video_links)} video links in '{links_file}'. Starting downloads "
+              f"({download_workers} download / {transcode_workers} transcode workers)...")
 
-        for video_url in tqdm(video_links, desc="Processing videos", unit="video"):
-            print(f"\nProcessing URL: {video_url}")
-            download_video_from_url_to_mp3(video_url, download_directory, mp3_quality) # Use DEFAULT_MP3_QUALITY
+        manifest = DownloadManifest(os.path.join(download_directory, MANIFEST_FILENAME)) if use_manifest else None
+        metadata_cache = MetadataCache() if use_metadata_cache else None
+        scheduler = DownloadScheduler(bandwidth_limit, requests_per_second, retries,
+                                      dead_letter_path=os.path.join(download_directory, DEAD_LETTER_FILENAME))
+        try:
+            results = download_videos(video_links, download_directory, mp3_quality,
+                                      download_workers=download_workers, transcode_workers=transcode_workers,
+                                      manifest=manifest, streaming=streaming, metadata_cache=metadata_cache,
+                                      embed_metadata=embed_metadata, extra_tags=extra_tags, scheduler=scheduler,
+                                      library=LibraryStore(library_path) if library_path else None,
+                                      output_profiles=output_profiles, replaygain=replaygain)
+        finally:
+            if manifest:
+                manifest.close()
+            if metadata_cache:
+                metadata_cache.close()
 
-        print("\nAll video downloads from file complete!")
+        print(f"\nAll video downloads from file complete! Converted: {len(results['converted'])}, "
+              f"already done: {len(results['skipped'])}, failed: {len(results['failed'])}")
+        report_dead_letters(scheduler)
 
     except FileNotFoundError:
         print(f"Error: Links file '{links_file}' not found.")
@@ -130,16 +1055,128 @@ def download_videos_from_file(links_file="video_links.txt", download_directory="
         print(f"Error processing video links from file: {e}")
 
 
+def download_playlists(playlist_urls, links_file="video_links.txt", download_directory=".", mp3_quality=DEFAULT_MP3_QUALITY,
+                       download_workers=DEFAULT_DOWNLOAD_WORKERS, transcode_workers=DEFAULT_TRANSCODE_WORKERS,
+                       use_manifest=True, streaming=False, use_metadata_cache=True, embed_metadata=True,
+                       extra_tags=None, bandwidth_limit=None, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                       retries=DEFAULT_RETRIES, library_path=None, output_profiles=(), replaygain=False):
+    """
+    Lists one or more playlists and downloads their videos as MP3 while the listing runs.
+
+    Video URLs are saved to `links_file` as they are found (see
+    extract_link.stream_playlist_links) and handed to the download pool immediately,
+    so downloads start on the first page instead of after the whole listing.
+
+    Args:
+        playlist_urls: A list of playlist URLs (fetched concurrently, duplicates removed).
+        links_file: The file the discovered video URLs are saved to.
+        download_directory: The directory to save MP3 files to.
+        Remaining arguments: see download_videos_from_file.
+    """
+    manifest = DownloadManifest(os.path.join(download_directory, MANIFEST_FILENAME)) if use_manifest else None
+    metadata_cache = MetadataCache() if use_metadata_cache else None
+    scheduler = DownloadScheduler(bandwidth_limit, requests_per_second, retries,
+                                  dead_letter_path=os.path.join(download_directory, DEAD_LETTER_FILENAME))
+    try:
+        video_links = stream_playlist_links(playlist_urls, links_file, manifest=manifest)
+        results = download_videos(video_links, download_directory, mp3_quality,
+                                  download_workers=download_workers, transcode_workers=transcode_workers,
+                                  manifest=manifest, streaming=streaming, metadata_cache=metadata_cache,
+                                  embed_metadata=embed_metadata, extra_tags=extra_tags, scheduler=scheduler,
+                                  library=LibraryStore(library_path) if library_path else None,
+                                  output_profiles=output_profiles, replaygain=replaygain)
+        print(f"\nAll playlist downloads complete! Converted: {len(results['converted'])}, "
+              f"already done: {len(results['skipped'])}, failed: {len(results['failed'])}")
+        report_dead_letters(scheduler)
+
+    except Exception as e:
+        print(f"Error downloading playlists: {e}")
+    finally:
+        if manifest:
+            manifest.close()
+        if metadata_cache:
+            metadata_cache.close()
+
+
+def report_dead_letters(scheduler):
+    """Tells where the URLs that failed for good were saved, if there are any."""
+    dead_letters = scheduler.dead_letters
+    if dead_letters:
+        print(f"{len(dead_letters)} failed links saved to '{scheduler.dead_letter_path}'. "
+              f"Retry only them with --retry-failed.")
+
+
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    download_workers = pop_option(args, "--download-workers", DEFAULT_DOWNLOAD_WORKERS, int)
+    transcode_workers = pop_option(args, "--transcode-workers", DEFAULT_TRANSCODE_WORKERS, int)
+    use_manifest = not pop_flag(args, "--no-manifest")
+    streaming = pop_flag(args, "--stream")
+    use_metadata_cache = not pop_flag(args, "--no-metadata-cache")
+    embed_metadata = not pop_flag(args, "--no-tags")
+    extra_tags = {name: value for name in ('artist', 'album', 'genre')
+                  if (value := pop_option(args, f"--{name}")) is not None}
+    network_options = {
+        'bandwidth_limit': pop_option(args, "--limit-rate", None, parse_rate),
+        'requests_per_second': pop_option(args, "--requests-per-second", DEFAULT_REQUESTS_PER_SECOND, float),
+        'retries': pop_option(args, "--retries", DEFAULT_RETRIES, int),
+    }
+    retry_failed = pop_flag(args, "--retry-failed")
+    library_path = pop_option(args, "--library")
+    replaygain = pop_flag(args, "--replaygain")
+    try:
+        output_profiles = pop_option(args, "--profiles", [], parse_profiles)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    playlist_urls = []
+    while "--playlist-url" in args:
+        playlist_urls.append(pop_option(args, "--playlist-url"))
+
     download_directory = "." # Default download directory
-    if "--playlist" in sys.argv: # Check for --playlist flag in command line arguments
-        download_directory = sys.argv[-1] if len(sys.argv) > 1 and sys.argv[-1] != "--playlist" else "." # Get directory from argument if provided
-        download_videos_from_file(download_directory=download_directory) # Run playlist download
-    elif len(sys.argv) > 1: # If there are command line arguments (assume single video URL and optional directory)
-        video_url = sys.argv[1] # First argument is video URL
-        download_directory = sys.argv[2] if len(sys.argv) > 2 else "." # Second argument (optional) is download directory
-        download_video_from_url_to_mp3(video_url, download_directory=download_directory) # Run single video download
+    if playlist_urls: # List the playlists and download their videos as they are found
+        download_directory = args[0] if args else "."
+        download_playlists(playlist_urls, download_directory=download_directory, download_workers=download_workers,
+                           transcode_workers=transcode_workers, use_manifest=use_manifest, streaming=streaming,
+                           use_metadata_cache=use_metadata_cache, embed_metadata=embed_metadata,
+                           extra_tags=extra_tags, library_path=library_path, output_profiles=output_profiles,
+                           replaygain=replaygain, **network_options)
+    elif "--playlist" in args: # Check for --playlist flag in command line arguments
+        download_directory = args[-1] if args[-1] != "--playlist" else "." # Get directory from argument if provided
+        links_file = "video_links.txt"
+        if retry_failed: # Only the URLs an earlier run gave up on
+            links_file = os.path.join(download_directory, DEAD_LETTER_FILENAME)
+        download_videos_from_file(links_file, download_directory=download_directory, download_workers=download_workers,
+                                  transcode_workers=transcode_workers, use_manifest=use_manifest,
+                                  streaming=streaming, use_metadata_cache=use_metadata_cache,
+                                  embed_metadata=embed_metadata, extra_tags=extra_tags, library_path=library_path,
+                                  output_profiles=output_profiles, replaygain=replaygain,
+                                  **network_options) # Run playlist download
+    elif len(args) > 0: # If there are command line arguments (assume single video URL and optional directory)
+        video_url = args[0] # First argument is video URL
+        download_directory = args[1] if len(args) > 1 else "." # Second argument (optional) is download directory
+        download_video_from_url_to_mp3(video_url, download_path=download_directory, streaming=streaming,
+                                       embed_metadata=embed_metadata, extra_tags=extra_tags,
+                                       library_path=library_path, output_profiles=output_profiles,
+                                       replaygain=replaygain) # Run single video download
     else:
         print("Usage when running video_downloader_mp3.py directly:")
         print("  For single video: python video_downloader_mp3.py <video_url> [download_directory]")
-        print("  For playlist (links from video_links.txt): python video_downloader_mp3.py --playlist [download_directory]")
\ No newline at end of file
+        print("  For playlist (links from video_links.txt): python video_downloader_mp3.py --playlist [download_directory]")
+        print("  For playlists listed while downloading: python video_downloader_mp3.py --playlist-url <url> [--playlist-url <url> ...] [download_directory]")
+        print("  Playlist options: --download-workers N (default: %d) --transcode-workers N (default: %d)"
+              % (DEFAULT_DOWNLOAD_WORKERS, DEFAULT_TRANSCODE_WORKERS))
+        print("                    --no-manifest (re-download everything instead of resuming)")
+        print("                    --no-metadata-cache (always extract video info again)")
+        print("                    --limit-rate RATE (e.g. 2M: bandwidth shared by all downloads)")
+        print("                    --requests-per-second N (per host, default: %g) --retries N (default: %d)"
+              % (DEFAULT_REQUESTS_PER_SECOND, DEFAULT_RETRIES))
+        print("                    --retry-failed (with --playlist: download only the links saved to %s)"
+              % DEAD_LETTER_FILENAME)
+        print("  Both modes: --stream (pipe downloads straight into the MP3 encoder, no intermediate file)")
+        print("              --artist/--album/--genre <value> (override the per-track tags taken from each video)")
+        print("              --no-tags (do not write title/artist/date/thumbnail tags)")
+        print("              --library DIR (keep each track once in DIR and hardlink it into the download directory)")
+        print("              --profiles NAME[,NAME...] (also encode these versions from the same decode: %s)"
+              % ", ".join(OUTPUT_PROFILES))
+        print("              --replaygain (measure loudness during the encode and write ReplayGain tags)")
\ No newline at end of file
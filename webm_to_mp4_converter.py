@@ -1,73 +1,193 @@
+import contextlib
 import os
 import subprocess
-from tqdm import tqdm
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import instrumentation
+from audio_transcoder import probe_streams, probe_duration, run_ffmpeg_with_progress
+from cli_options import pop_flag, pop_option
+from file_index import FileIndex
+from workspace import atomic_outputs, remove_partial_files, wait_for_free_space
+
+DEFAULT_VIDEO_CODEC = "libx264" # Encoder used when the video stream cannot be copied
+DEFAULT_PRESET = "veryfast" # libx264/libx265 speed/size trade-off
+DEFAULT_THREADS_PER_JOB = 2 # Encoder threads given to each ffmpeg job
+
+# Streams copied into the MP4 without re-encoding: the H.264/AAC that every player handles
+REMUX_VIDEO_CODECS = {'h264'}
+REMUX_AUDIO_CODECS = {'aac'}
+# Also copied with --copy-webm-codecs: YouTube's usual WEBM streams, valid in MP4 but not
+# playable everywhere (e.g. QuickTime and iOS)
+WEBM_VIDEO_CODECS = {'vp9', 'av1'}
+WEBM_AUDIO_CODECS = {'opus'}
+
+
+def default_job_count(threads_per_job=DEFAULT_THREADS_PER_JOB):
+    """Number of concurrent ffmpeg jobs that fits the available cores."""
+    return max(1, (os.cpu_count() or 1) // max(1, threads_per_job))
+
+
+def build_mp4_command(webm_filepath, mp4_filepath, streams, video_codec=DEFAULT_VIDEO_CODEC,
+                      preset=DEFAULT_PRESET, threads=DEFAULT_THREADS_PER_JOB, allow_remux=True,
+                      copy_webm_codecs=False):
+    """
+    Builds the ffmpeg command converting one WEBM file to MP4.
 
+    Each stream is copied when it already is H.264/AAC (see REMUX_VIDEO_CODECS and
+    REMUX_AUDIO_CODECS) and re-encoded otherwise, so a WEBM with such streams is only
+    remuxed. With copy_webm_codecs, VP9/AV1/Opus streams are copied as well.
 
-def batch_convert_webm_to_mp4_ffmpeg_direct(delete_webm=True):
+    Returns:
+        A (command, remuxed) tuple, remuxed being True when no stream is re-encoded.
+    """
+    video_codecs = [s.get('codec_name') for s in streams if s.get('codec_type') == 'video']
+    audio_codecs = [s.get('codec_name') for s in streams if s.get('codec_type') == 'audio']
+    video_remux_codecs = REMUX_VIDEO_CODECS | WEBM_VIDEO_CODECS if copy_webm_codecs else REMUX_VIDEO_CODECS
+    audio_remux_codecs = REMUX_AUDIO_CODECS | WEBM_AUDIO_CODECS if copy_webm_codecs else REMUX_AUDIO_CODECS
+    copy_video = allow_remux and all(codec in video_remux_codecs for codec in video_codecs)
+    copy_audio = allow_remux and all(codec in audio_remux_codecs for codec in audio_codecs)
+
+    command = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y", "-i", webm_filepath]
+    if copy_video:
+        command += ["-codec:v", "copy"]
+    else:
+        command += ["-codec:v", video_codec] # Video codec
+        if video_codec in ("libx264", "libx265"):
+            command += ["-preset", preset]
+        command += ["-threads", str(threads)]
+    command += ["-codec:a", "copy" if copy_audio else "aac"] # Audio codec
+    command.append(mp4_filepath) # Output file
+    return command, copy_video and copy_audio
+
+
+def batch_convert_webm_to_mp4_ffmpeg_direct(delete_webm=True, jobs=None, preset=DEFAULT_PRESET,
+                                            threads=DEFAULT_THREADS_PER_JOB, video_codec=DEFAULT_VIDEO_CODEC,
+                                            allow_remux=True, copy_webm_codecs=False, use_index=True,
+                                            min_free_bytes=None):
     """
     Batch converts WEBM video files in the current directory to MP4 format
     using direct ffmpeg command execution via subprocess.
 
+    Up to `jobs` ffmpeg processes run at once. WEBMs whose streams already are H.264/AAC
+    are remuxed with stream copy; the rest are re-encoded. One progress bar tracks the
+    combined media duration, fed by ffmpeg's -progress output.
+
     Args:
         delete_webm: Boolean, if True, delete the original .webm file after successful conversion (default: True).
+        jobs: Number of concurrent ffmpeg processes (default: sized to the CPU cores, see default_job_count).
+        preset: x264/x265 encoder preset for re-encoded video (default: DEFAULT_PRESET).
+        threads: Encoder threads per ffmpeg process (default: DEFAULT_THREADS_PER_JOB).
+        video_codec: ffmpeg video encoder for re-encodes, e.g. "libx264" or "h264_nvenc".
+        allow_remux: Boolean, if False, always re-encode.
+        copy_webm_codecs: Boolean, if True, also copy VP9/AV1/Opus streams into the MP4 instead of
+                          re-encoding them (fast, but the MP4 does not play everywhere).
+        use_index: Boolean, if True, skip WEBMs already converted and unchanged since, and
+                   files another batch job is still writing (see file_index.FileIndex).
+        min_free_bytes: Jobs wait to start while the disk has less free space (default: see
+                        workspace.default_min_free_bytes).
     """
-
-    webm_files_processed = 0
+    from tqdm import tqdm
+    jobs = jobs or default_job_count(threads)
+    remove_partial_files('.') # MP4s left half-written by an interrupted run
+    index = FileIndex('.') if use_index else None
+    if index:
+        webm_filepaths = index.pending('webm_to_mp4', ['.webm'])
+    else:
+        webm_filepaths = [filename for filename in os.listdir('.')
+                          if filename.lower().endswith('.webm') and not filename.startswith('.')]
+    webm_files_processed = len(webm_filepaths)
     webm_files_converted = 0
-
-    for filename in os.listdir('.'):
-        if filename.lower().endswith('.webm'):
-            webm_filepath = filename
-            mp4_filepath = os.path.splitext(webm_filepath)[0] + '.mp4' # Change extension to .mp4
-            print(f"Processing WEBM file: {webm_filepath}")
-            webm_files_processed += 1
-
+    webm_files_remuxed = 0
+
+    durations = {webm_filepath: probe_duration(webm_filepath) or 0.0 for webm_filepath in webm_filepaths}
+    lock = threading.Lock()
+    pbar = tqdm(total=round(sum(durations.values()), 1), unit="s", desc=f"Converting to MP4 ({jobs} jobs)")
+
+    def convert(webm_filepath):
+        mp4_filepath = os.path.splitext(webm_filepath)[0] + '.mp4' # Change extension to .mp4
+        wait_for_free_space(['.'], min_free_bytes) # Source and output both stay on disk until the job ends
+        reported = 0.0
+
+        def on_progress(seconds_done):
+            nonlocal reported
+            seconds_done = min(seconds_done, durations[webm_filepath])
+            with lock:
+                pbar.update(round(seconds_done - reported, 1))
+            reported = seconds_done
+
+        with instrumentation.stage('webm_to_mp4', input=webm_filepath,
+                                   media_s=durations[webm_filepath]) as record:
+            with index.claim(mp4_filepath, 'webm_to_mp4') if index else contextlib.nullcontext(), \
+                    atomic_outputs([mp4_filepath]) as (temporary_path,):
+                command, remuxed = build_mp4_command(webm_filepath, temporary_path, probe_streams(webm_filepath),
+                                                     video_codec=video_codec, preset=preset, threads=threads,
+                                                     allow_remux=allow_remux, copy_webm_codecs=copy_webm_codecs)
+                record['remuxed'] = remuxed
+                run_ffmpeg_with_progress(command, on_progress) # Adds ffmpeg's CPU time to the record
+            record.update(bytes=os.path.getsize(webm_filepath), output_bytes=os.path.getsize(mp4_filepath))
+        on_progress(durations[webm_filepath])
+        return mp4_filepath, remuxed
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="ffmpeg") as pool:
+        futures = {pool.submit(convert, webm_filepath): webm_filepath for webm_filepath in webm_filepaths}
+        for future in as_completed(futures):
+            webm_filepath = futures[future]
             try:
-                with tqdm(total=1, unit="file", desc=f"Converting to MP4: {webm_filepath}", leave=False) as pbar:
-                    # Construct the ffmpeg command
-                    command = [
-                        "ffmpeg",
-                        "-i", webm_filepath,  # Input file
-                        "-codec:v", "libx264", # Video codec
-                        "-codec:a", "aac",    # Audio codec
-                        "-strict", "experimental", # or "normal" or "unofficial" - try "experimental" first
-                        mp4_filepath          # Output file
-                    ]
-
-                    # Execute the ffmpeg command using subprocess.run
-                    result = subprocess.run(command, capture_output=True, text=True, check=True)
-
-                    pbar.update(1)
-                print(f"  Converted to MP4: {mp4_filepath}")
+                mp4_filepath, remuxed = future.result()
+                tqdm.write(f"  Converted to MP4 ({'remuxed' if remuxed else 're-encoded'}): {mp4_filepath}")
                 webm_files_converted += 1
+                webm_files_remuxed += remuxed
+                if index:
+                    index.mark(webm_filepath, 'webm_to_mp4', output_path=mp4_filepath)
 
                 if delete_webm:
                     os.remove(webm_filepath)
-                    print(f"  Deleted original WEBM file: {webm_filepath}")
+                    tqdm.write(f"  Deleted original WEBM file: {webm_filepath}")
 
             except subprocess.CalledProcessError as e:
-                print(f"  Error converting {webm_filepath}: ffmpeg command failed.")
-                print(f"  Return code: {e.returncode}")
-                print(f"  Stdout: {e.stdout}")
-                print(f"  Stderr: {e.stderr}")
-                print("  Check ffmpeg output for details.")
+                if index:
+                    index.mark(webm_filepath, 'webm_to_mp4', state='failed', error=instrumentation.failure_reason(e))
+                tqdm.write(f"  Error converting {webm_filepath}: ffmpeg command failed.")
+                tqdm.write(f"  Return code: {e.returncode}")
+                tqdm.write(f"  Stderr: {e.stderr}")
+                tqdm.write("  Check ffmpeg output for details.")
 
             except FileNotFoundError:
-                print("  Error: ffmpeg command not found. Make sure ffmpeg is installed and in your system's PATH.")
+                tqdm.write("  Error: ffmpeg command not found. Make sure ffmpeg is installed and in your system's PATH.")
 
             except Exception as e: # Catch any other unexpected errors
-                print(f"  An unexpected error occurred while processing {webm_filepath}: {e}")
-                print("  Please report this error with details if it persists.")
-
+                tqdm.write(f"  An unexpected error occurred while processing {webm_filepath}: {e}")
+                tqdm.write("  Please report this error with details if it persists.")
+    pbar.close()
+    if index:
+        index.close()
 
     print(f"\nWEBM to MP4 conversion process completed (using direct ffmpeg commands).")
-    print(f"Total WEBM files found: {webm_files_processed}")
-    print(f"Successfully converted to MP4: {webm_files_converted}")
+    print(f"Total WEBM files found: {webm_files_processed}" + (" (new or changed)" if index else ""))
+    print(f"Successfully converted to MP4: {webm_files_converted} ({webm_files_remuxed} remuxed without re-encoding)")
+
 
 if __name__ == "__main__":
-    print("WEBM to MP4 Batch Converter (Direct ffmpeg Command Execution)")
-    delete_original = input("Delete original WEBM files after conversion? (yes/no, default: yes): ").strip().lower()
-    delete_webm_files = True if delete_original in ['yes', 'y', ''] else False
+    args = sys.argv[1:]
+    threads = pop_option(args, "--threads", DEFAULT_THREADS_PER_JOB, int)
+    jobs = pop_option(args, "--jobs", None, int)
+    preset = pop_option(args, "--preset", DEFAULT_PRESET)
+    video_codec = pop_option(args, "--video-codec", DEFAULT_VIDEO_CODEC)
+    allow_remux = not pop_flag(args, "--no-remux")
+    copy_webm_codecs = pop_flag(args, "--copy-webm-codecs") # Remux VP9/AV1/Opus instead of re-encoding
+    use_index = not pop_flag(args, "--full-scan") # Reconvert every WEBM, ignoring the file index
+    answered_yes = pop_flag(args, "--yes")
+    no_delete = pop_flag(args, "--no-delete")
 
-    batch_convert_webm_to_mp4_ffmpeg_direct(delete_webm_files)
+    print("WEBM to MP4 Batch Converter (Direct ffmpeg Command Execution)")
+    if answered_yes or no_delete:
+        delete_webm_files = not no_delete
+    else:
+        delete_original = input("Delete original WEBM files after conversion? (yes/no, default: yes): ").strip().lower()
+        delete_webm_files = True if delete_original in ['yes', 'y', ''] else False
+
+    batch_convert_webm_to_mp4_ffmpeg_direct(delete_webm_files, jobs=jobs, preset=preset, threads=threads,
+                                            video_codec=video_codec, allow_remux=allow_remux,
+                                            copy_webm_codecs=copy_webm_codecs, use_index=use_index)
     print("\nScript finished.")
\ No newline at end of file
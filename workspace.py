@@ -0,0 +1,305 @@
+import contextlib
+import errno
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import instrumentation
+
+# Parent directory of the scratch space (default: a tmpfs if one has room, see Workspace)
+SCRATCH_ENV = "DOWNLOADYOUTUBE_SCRATCH"
+# Free space to keep on the output and scratch filesystems, e.g. "5G" (default: DEFAULT_MIN_FREE_BYTES)
+MIN_FREE_ENV = "DOWNLOADYOUTUBE_MIN_FREE"
+TMPFS_DIRECTORY = "/dev/shm"
+SCRATCH_DIRNAME = ".scratch" # Scratch parent inside the output directory when there is no usable tmpfs
+DEFAULT_MIN_FREE_BYTES = 256 * 1024 ** 2 # New jobs wait while the output filesystem has less free
+DEFAULT_MIN_TMPFS_BYTES = 1024 ** 3 # A tmpfs with less free is not used for scratch space
+SCRATCH_MIN_FREE_BYTES = 256 * 1024 ** 2 # New jobs wait while a separate scratch filesystem has less free
+SPACE_POLL_INTERVAL = 10.0 # Seconds between free-space checks while paused
+MAX_SPACE_WAIT = 10 * 60 # Seconds a Workspace waits for free space before its jobs fail instead
+SOURCES_DIRNAME = ".sources" # Downloaded sources not converted yet, kept in the output directory between runs
+SOURCE_MAX_AGE = 7 * 24 * 60 * 60 # Kept sources no run has picked up for this long are deleted
+OWNER_FILENAME = ".sources-directory" # Inside a scratch directory: where its sources are kept
+PARTIAL_MARKER = ".partial" # Outputs are written as ".<name>.partial<ext>" and renamed when complete
+ORPHAN_AGE_SECONDS = 15 * 60 # Partial outputs untouched for this long were left by a crashed run
+
+_SCRATCH_PATTERN = re.compile(r"^ytdl-(?P<host>.+)-(?P<pid>\d+)-[^-]+$")
+
+
+def parse_size(value):
+    """Parses a size such as '500M', '2G' or '2GB' (powers of 1024) into bytes."""
+    if value is None:
+        return None
+    value = str(value).strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    if not value:
+        return None
+    multiplier = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}.get(value[-1], 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+
+
+def default_min_free_bytes():
+    """The free-space threshold from $DOWNLOADYOUTUBE_MIN_FREE (0 turns the check off), or DEFAULT_MIN_FREE_BYTES."""
+    min_free_bytes = parse_size(os.environ.get(MIN_FREE_ENV))
+    return DEFAULT_MIN_FREE_BYTES if min_free_bytes is None else min_free_bytes
+
+
+def partial_path(output_filepath):
+    """The hidden temporary name an output is written under (same directory and extension)."""
+    directory, filename = os.path.split(output_filepath)
+    base, extension = os.path.splitext(filename)
+    return os.path.join(directory, f".{base}{PARTIAL_MARKER}{extension}")
+
+
+@contextlib.contextmanager
+def atomic_outputs(output_filepaths):
+    """
+    Yields temporary paths (see partial_path) to write `output_filepaths` under.
+
+    When the block succeeds every temporary file is renamed to its final name, so an
+    output only ever appears complete; when it fails they are deleted. A crash leaves
+    only hidden partial files, which batch scans skip and remove_partial_files cleans up.
+    """
+    temporary_paths = [partial_path(output_filepath) for output_filepath in output_filepaths]
+    try:
+        yield temporary_paths
+        for temporary_path, output_filepath in zip(temporary_paths, output_filepaths):
+            os.replace(temporary_path, output_filepath)
+    finally:
+        for temporary_path in temporary_paths:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+
+def remove_partial_files(directory=".", max_age=ORPHAN_AGE_SECONDS, partial_only=True):
+    """
+    Deletes the partial outputs in `directory` that nothing has written to for `max_age`
+    seconds (left by a crashed run; a running one keeps its files fresh). With
+    `partial_only` False every file that old is deleted (used for kept sources).
+
+    Returns:
+        The number of files deleted.
+    """
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        is_partial = entry.name.startswith('.') and PARTIAL_MARKER in entry.name
+        if (is_partial or not partial_only) and entry.is_file(follow_symlinks=False):
+            try:
+                if now - entry.stat().st_mtime >= max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def keep_sources(scratch_directory, sources_directory):
+    """
+    Moves the downloaded sources left in a scratch directory (ones not converted yet) to
+    `sources_directory`, so a later run can still convert them instead of downloading
+    again (see download_manifest.DownloadManifest.resume_point). Hidden files (thumbnails)
+    and unfinished downloads are not kept.
+
+    Returns:
+        The number of files kept.
+    """
+    kept = 0
+    try:
+        entries = list(os.scandir(scratch_directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        if entry.name.startswith('.') or entry.name.endswith(('.part', '.ytdl')) \
+                or not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            os.makedirs(sources_directory, exist_ok=True)
+            shutil.move(entry.path, os.path.join(sources_directory, entry.name))
+            kept += 1
+        except OSError as e:
+            print(f"Could not keep downloaded source '{entry.path}': {e}")
+    return kept
+
+
+def _pid_alive(pid):
+    if os.name == 'nt': # os.kill would terminate the process on Windows: assume it still runs
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Alive, owned by another user
+        return True
+    return True
+
+
+def remove_orphan_scratch(scratch_root):
+    """
+    Deletes the scratch directories under `scratch_root` left by processes of this host
+    that are no longer running, after keeping their downloaded sources (see keep_sources).
+
+    Returns:
+        The number of directories deleted.
+    """
+    removed = 0
+    hostname = socket.gethostname()
+    try:
+        entries = list(os.scandir(scratch_root))
+    except OSError:
+        return 0
+    for entry in entries:
+        match = _SCRATCH_PATTERN.match(entry.name)
+        if not match or match['host'] != hostname or not entry.is_dir(follow_symlinks=False):
+            continue
+        pid = int(match['pid'])
+        if pid != os.getpid() and not _pid_alive(pid):
+            try:
+                with open(os.path.join(entry.path, OWNER_FILENAME), 'r') as f:
+                    keep_sources(entry.path, f.read().strip())
+            except OSError:
+                pass # Written by an older version: nothing recorded to keep
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def free_bytes(path):
+    """Free bytes on the filesystem holding `path` (or its nearest existing parent)."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+def wait_for_free_space(paths, min_free_bytes=None, poll_interval=SPACE_POLL_INTERVAL, timeout=None):
+    """
+    Blocks while a filesystem holding one of `paths` has less than `min_free_bytes` free.
+
+    Returns:
+        The seconds spent waiting.
+
+    Raises:
+        OSError (ENOSPC) if there is still too little space after `timeout` seconds.
+    """
+    min_free_bytes = default_min_free_bytes() if min_free_bytes is None else min_free_bytes
+    waited = 0.0
+    while True:
+        low = [(path, free) for path in paths if (free := free_bytes(path)) < min_free_bytes]
+        if not low:
+            if waited:
+                print(f"Disk space recovered after {waited:.0f}s; resuming.")
+            return waited
+        if not waited and timeout != 0:
+            path, free = low[0]
+            print(f"Low disk space on '{path}': {free / 1024 ** 3:.1f} GB free, "
+                  f"{min_free_bytes / 1024 ** 3:.1f} GB required. Pausing new jobs...")
+            instrumentation.emit('disk_space_low', path=path, free_bytes=free, min_free_bytes=min_free_bytes)
+        if timeout is not None and waited >= timeout:
+            path, free = low[0]
+            raise OSError(errno.ENOSPC, f"Only {free / 1024 ** 3:.1f} GB free after waiting {waited:.0f}s", path)
+        time.sleep(poll_interval)
+        waited += poll_interval
+
+
+class Workspace:
+    """
+    Scratch space and disk-space policy for one batch writing into `output_directory`.
+
+    - Intermediates (downloaded sources, thumbnails) go to a private scratch directory,
+      on a tmpfs (TMPFS_DIRECTORY) when it has at least DEFAULT_MIN_TMPFS_BYTES free and
+      under <output_directory>/.scratch otherwise. close() deletes it, keeping the sources
+      not converted yet in <output_directory>/.sources (see keep_sources).
+    - wait_for_space() pauses the caller while the output filesystem has less than
+      `min_free_bytes` free, or a scratch space on another filesystem less than
+      SCRATCH_MIN_FREE_BYTES; call it before starting each new job. Once a wait has timed
+      out, later calls fail at once while space is still low instead of waiting again.
+    - On creation, scratch directories of dead processes of this host, stale partial
+      outputs (see atomic_outputs) and kept sources older than SOURCE_MAX_AGE are removed.
+
+    Args:
+        output_directory: Where the batch writes its final files.
+        scratch_root: Parent of the scratch directory (default: $DOWNLOADYOUTUBE_SCRATCH, then see above).
+        min_free_bytes: Free-space threshold (default: see default_min_free_bytes).
+        max_wait: Seconds wait_for_space() waits before it gives up with an OSError (default: MAX_SPACE_WAIT).
+    """
+
+    def __init__(self, output_directory=".", scratch_root=None, min_free_bytes=None, max_wait=MAX_SPACE_WAIT):
+        self.output_directory = output_directory
+        self.sources_directory = os.path.join(output_directory, SOURCES_DIRNAME)
+        self.min_free_bytes = min_free_bytes if min_free_bytes is not None else default_min_free_bytes()
+        self.max_wait = max_wait
+        self.scratch_root = scratch_root or os.environ.get(SCRATCH_ENV) or self._default_scratch_root()
+        os.makedirs(self.scratch_root, exist_ok=True)
+        os.makedirs(output_directory, exist_ok=True)
+        orphans = (remove_orphan_scratch(self.scratch_root) + remove_partial_files(output_directory)
+                   + remove_partial_files(self.sources_directory, SOURCE_MAX_AGE, partial_only=False))
+        if orphans:
+            print(f"Removed {orphans} leftovers of interrupted runs.")
+        self.scratch_directory = tempfile.mkdtemp(prefix=f"ytdl-{socket.gethostname()}-{os.getpid()}-",
+                                                  dir=self.scratch_root)
+        with open(os.path.join(self.scratch_directory, OWNER_FILENAME), 'w') as f:
+            f.write(os.path.abspath(self.sources_directory)) # Read by remove_orphan_scratch after a crash
+        # Scratch space on its own filesystem (e.g. a tmpfs) is checked against its own threshold
+        self.separate_scratch = os.stat(self.scratch_directory).st_dev != os.stat(output_directory).st_dev
+        self._space_lock = threading.Lock()
+        self.out_of_space = False # A wait timed out; see wait_for_space
+
+    def _default_scratch_root(self):
+        if os.path.isdir(TMPFS_DIRECTORY) and os.access(TMPFS_DIRECTORY, os.W_OK) \
+                and free_bytes(TMPFS_DIRECTORY) >= DEFAULT_MIN_TMPFS_BYTES:
+            return os.path.join(TMPFS_DIRECTORY, "downloadyoutube")
+        return os.path.join(self.output_directory, SCRATCH_DIRNAME)
+
+    def wait_for_space(self):
+        """
+        Blocks while the output or scratch filesystem is low on space; returns the seconds waited.
+
+        Raises:
+            OSError (ENOSPC) if space is still low after `max_wait` seconds, or right away
+            when an earlier wait already timed out and space has not come back since.
+        """
+        with self._space_lock: # One waiting thread reports; the others queue up behind it
+            max_wait = 0 if self.out_of_space else self.max_wait
+            try:
+                waited = wait_for_free_space([self.output_directory], self.min_free_bytes, timeout=max_wait)
+                if self.separate_scratch:
+                    waited += wait_for_free_space([self.scratch_directory], SCRATCH_MIN_FREE_BYTES, timeout=max_wait)
+            except OSError:
+                self.out_of_space = True
+                raise
+            self.out_of_space = False
+            return waited
+
+    def close(self):
+        """Keeps the sources not converted yet (see keep_sources) and deletes the scratch directory."""
+        kept = keep_sources(self.scratch_directory, self.sources_directory)
+        if kept:
+            print(f"Kept {kept} downloaded sources not converted yet in '{self.sources_directory}'.")
+        shutil.rmtree(self.scratch_directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    output_directory = sys.argv[1] if len(sys.argv) > 1 else "."
+    workspace = Workspace(output_directory) # Also removes leftovers of interrupted runs
+    try:
+        print(f"Scratch space: {workspace.scratch_root} ({free_bytes(workspace.scratch_root) / 1024 ** 3:.1f} GB free)")
+        print(f"Output directory: {output_directory} ({free_bytes(output_directory) / 1024 ** 3:.1f} GB free, "
+              f"new jobs pause below {workspace.min_free_bytes / 1024 ** 3:.1f} GB)")
+    finally:
+        workspace.close()